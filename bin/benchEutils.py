@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+#
+# Benchmark NCBIutilsLib/simpleURLLib against a local fake eutils server,
+#   so fetch path regressions can be caught without hitting NCBI.
+#
+# The fake server (FakeEutilsHandler) does esearch, epost, efetch, esummary
+#   with webenvs & query_keys on a history server, paging (retstart/retmax),
+#   random 429s (w/ Retry-After), and configurable latency & record sizes.
+#
+# Each scenario runs in its own (forked) process so its peak RSS is its own.
+# Reported per scenario: num of requests, requests/sec, p50/p99 request
+#   latency, MB of eutils output parsed/sec, peak RSS.
+#
+# Example:
+#   benchEutils.py --latency 20 --rate429 0.05 search-fetch-xml post-summary-json
+#
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+import resource
+import threading
+import multiprocessing
+import http.server
+import urllib.parse
+import simpleURLLib as surl
+import NCBIutilsLib as eulib
+
+#-----------------------------------
+
+class FakeEutilsHandler (http.server.BaseHTTPRequestHandler):
+    """ Fake eutils server. Config is set on the class by startFakeEutils().
+        esearch results are IDs 1..count (whatever the term).
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0		# seconds to wait before each reply
+    recordBytes = 2000		# approx size of each record
+    count = 10000		# num of results of an esearch
+    rate429 = 0.0		# fraction of requests that get a 429
+    webenvs = {}		# webenv -> [list of IDs for each query_key]
+    lock = threading.Lock()
+
+    def do_GET(self):
+        path, query = (self.path.split('?', 1) + [''])[:2]
+        self.handle_eutil(path, dict(urllib.parse.parse_qsl(query)))
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.handle_eutil(self.path,
+                        dict(urllib.parse.parse_qsl(self.rfile.read(length))))
+
+    def handle_eutil(self, path, params):
+        params = {toStr(k): toStr(v) for k, v in params.items()}
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.rate429:
+            self.reply(b'{"error":"API rate limit exceeded"}', status=429)
+            return
+        eutil = path.split('/')[-1]
+        if eutil == 'esearch.fcgi':
+            self.reply(self.addQuery(params.get('WebEnv'),
+                        [str(i) for i in range(1, self.count+1)], 'eSearch'))
+        elif eutil == 'epost.fcgi':
+            self.reply(self.addQuery(params.get('WebEnv'),
+                                        params['id'].split(','), 'ePost'))
+        elif eutil in ('efetch.fcgi', 'esummary.fcgi'):
+            with self.lock:
+                queries = self.webenvs.get(params.get('webenv'), [])
+            key = int(params.get('query_key', 0))
+            if not 0 < key <= len(queries):
+                self.reply(b'<eSummaryResult><ERROR>Unable to obtain query ' +
+                            b'#%d</ERROR></eSummaryResult>' % key)
+                return
+            start = int(params.get('retstart', 0))
+            ids = queries[key-1][start:start + int(params.get('retmax', 20))]
+            if eutil == 'efetch.fcgi':
+                self.reply(self.fetchXML(ids))
+            elif params.get('retmode') == 'json':
+                self.reply(self.summaryJSON(ids))
+            else:
+                self.reply(self.summaryXML(ids))
+        else:
+            self.reply(b'Not found', status=404)
+
+    def addQuery(self, webenv, ids, outputTag):
+        with self.lock:
+            if webenv not in self.webenvs:
+                webenv = 'WE%d' % len(self.webenvs)
+                self.webenvs[webenv] = []
+            self.webenvs[webenv].append(ids)
+            key = len(self.webenvs[webenv])
+        return ('<%sResult><Count>%d</Count><QueryKey>%d</QueryKey>' \
+                '<WebEnv>%s</WebEnv></%sResult>' % (outputTag, len(ids), key,
+                                            webenv, outputTag)).encode()
+
+    def filler(self):
+        return 'x' * max(0, self.recordBytes - 400)
+
+    def fetchXML(self, ids):
+        return ('<?xml version="1.0" ?>\n<PubmedArticleSet>\n' + \
+            ''.join(['<PubmedArticle><MedlineCitation><PMID Version="1">%s' \
+                '</PMID><Article><ArticleTitle>Title %s</ArticleTitle>' \
+                '<Abstract><AbstractText>%s</AbstractText></Abstract>' \
+                '</Article></MedlineCitation></PubmedArticle>\n' % \
+                (i, i, self.filler()) for i in ids]) + \
+            '</PubmedArticleSet>\n').encode()
+
+    def summaryXML(self, ids):
+        return ('<?xml version="1.0" ?>\n<eSummaryResult>' \
+            '<DocumentSummarySet status="OK">\n' + \
+            ''.join(['<DocumentSummary uid="%s"><PubDate>2020 Jan</PubDate>' \
+                '<Source>J Bench</Source><Authors><Author><Name>Smith J' \
+                '</Name><AuthType>Author</AuthType></Author></Authors>' \
+                '<Title>Title %s %s</Title><ArticleIds><ArticleId>' \
+                '<IdType>doi</IdType><Value>10.1/%s</Value></ArticleId>' \
+                '</ArticleIds></DocumentSummary>\n' % \
+                (i, i, self.filler(), i) for i in ids]) + \
+            '</DocumentSummarySet></eSummaryResult>\n').encode()
+
+    def summaryJSON(self, ids):
+        result = {'uids': ids}
+        for i in ids:
+            result[i] = {'uid': i, 'pubdate': '2020 Jan', 'source': 'J Bench',
+                    'authors': [{'name': 'Smith J', 'authtype': 'Author'}],
+                    'title': 'Title %s %s' % (i, self.filler()),
+                    'articleids': [{'idtype': 'doi', 'value': '10.1/%s' % i}]}
+        return json.dumps({'header': {}, 'result': result}).encode()
+
+    def reply(self, body, status=200):
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+# end class FakeEutilsHandler -------------------------
+
+def toStr(x):
+    return x.decode() if isinstance(x, bytes) else x
+
+def startFakeEutils(latency=0.0, recordBytes=2000, count=10000, rate429=0.0):
+    """ Start a FakeEutilsHandler server thread, return (server, base url)
+    """
+    FakeEutilsHandler.latency = latency
+    FakeEutilsHandler.recordBytes = recordBytes
+    FakeEutilsHandler.count = count
+    FakeEutilsHandler.rate429 = rate429
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                        FakeEutilsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,),
+                                                                daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:%d/' % server.server_address[1]
+#----------------------
+
+class TimingReader (object):
+    """ Wraps a ThrottledURLReader or AsyncURLReader, keeps the latency of
+        each readURL() (including its throttle waits and retries)
+    """
+    def __init__(self, reader):
+        self.reader = reader
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def readURL(self, url, GET=True, params=None, headers={}):
+        startTime = time.time()
+        output = self.reader.readURL(url, GET=GET, params=params,
+                                                            headers=headers)
+        with self.lock:
+            self.latencies.append(time.time() - startTime)
+        return output
+
+    async def readURLAsync(self, url, GET=True, params=None, headers={}):
+        startTime = time.time()
+        output = await self.reader.readURL(url, GET=GET, params=params,
+                                                            headers=headers)
+        self.latencies.append(time.time() - startTime)
+        return output
+# end class TimingReader -------------------------
+
+class AsyncTimingReader (TimingReader):
+    """ TimingReader for an AsyncURLReader """
+    readURL = TimingReader.readURLAsync
+# end class AsyncTimingReader -------------------------
+
+#----------------------
+# Scenarios: f(args, reader) runs the scenario,
+#   returns (num of records, num of bytes of eutils output parsed)
+#----------------------
+
+def searchPages(args, reader, op, retmode):
+    numRecords = numBytes = 0
+    count, pages, webenv = eulib.iterSearchResultPages('pubmed', 'bench',
+                            op=op, retmode=retmode, pageSize=args.pageSize,
+                            numWorkers=args.workers, URLReader=reader)
+    for retstart, output in pages:
+        numRecords += len(eulib.splitRecords('pubmed', output, op=op,
+                                                            retmode=retmode))
+        numBytes += len(output)
+    return numRecords, numBytes
+
+def searchFetchXML(args, reader):
+    return searchPages(args, reader, 'fetch', 'xml')
+
+def searchSummaryJSON(args, reader):
+    return searchPages(args, reader, 'summary', 'json')
+
+def postSummaries(args, reader, retmode):
+    numRecords = numBytes = 0
+    ids = list(range(1, args.ids+1))
+    for batch, output, webenv in eulib.iterPostResults('pubmed', ids,
+                            op='summary', retmode=retmode, URLReader=reader):
+        numRecords += len(eulib.parseSummary(output, retmode=retmode))
+        numBytes += len(output)
+    return numRecords, numBytes
+
+def postSummaryXML(args, reader):
+    return postSummaries(args, reader, 'xml')
+
+def postSummaryJSON(args, reader):
+    return postSummaries(args, reader, 'json')
+
+def asyncPostSummaryJSON(args, reader):
+    ids = list(range(1, args.ids+1))
+    batches = [ids[i:i+eulib.JSON_RETMAX] for i in
+                                    range(0, len(ids), eulib.JSON_RETMAX)]
+    async def run():
+        return await asyncio.gather(*[eulib.getPostResultsAsync('pubmed',
+                                batch, op='summary', retmode='json',
+                                URLReader=reader) for batch in batches])
+    numRecords = numBytes = 0
+    for output, webenv in asyncio.run(run()):
+        numRecords += len(eulib.parseSummary(output, retmode='json'))
+        numBytes += len(output)
+    return numRecords, numBytes
+
+SCENARIOS = {		# name -> (scenario function, uses async reader)
+    'search-fetch-xml'   : (searchFetchXML, False),
+    'search-summary-json': (searchSummaryJSON, False),
+    'post-summary-xml'   : (postSummaryXML, False),
+    'post-summary-json'  : (postSummaryJSON, False),
+    'async-post-summary-json': (asyncPostSummaryJSON, True),
+    }
+#----------------------
+
+def parseCmdLine():
+    parser = argparse.ArgumentParser( \
+        description='benchmark eutils fetching against a local fake server.')
+
+    parser.add_argument('scenarios', nargs='*', default=sorted(SCENARIOS),
+        help='scenarios to run: %s. Default: all' % ', '.join(sorted(SCENARIOS)))
+
+    parser.add_argument('--count', dest='count', type=int, default=20000,
+        help="num of esearch results. Default: 20000")
+
+    parser.add_argument('--ids', dest='ids', type=int, default=5000,
+        help="num of IDs to epost. Default: 5000")
+
+    parser.add_argument('--recordbytes', dest='recordBytes', type=int,
+        default=2000, help="approx bytes per record. Default: 2000")
+
+    parser.add_argument('--latency', dest='latency', type=float, default=5,
+        help="server latency per request in ms. Default: 5")
+
+    parser.add_argument('--rate429', dest='rate429', type=float, default=0.02,
+        help="fraction of requests that get a 429. Default: 0.02")
+
+    parser.add_argument('--rate', dest='rate', type=float, default=0,
+        help="client max requests/sec, 0 = no throttling. Default: 0")
+
+    parser.add_argument('--pagesize', dest='pageSize', type=int, default=None,
+        help="results per esearch result page. Default: eutils max")
+
+    parser.add_argument('--workers', dest='workers', type=int, default=3,
+        help="num of pages fetched concurrently. Default: 3")
+
+    parser.add_argument('--nopool', dest='pool', action='store_false',
+        help="don't reuse connections (ConnectionPool)")
+
+    parser.add_argument('--json', dest='json', action='store_true',
+        help="write results as json, one line per scenario")
+
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario: %s" % name)
+    return args
+#----------------------
+
+def runScenario(args, name):
+    """ Run scenario 'name' (in a forked process), return dict of results
+    """
+    func, isAsync = SCENARIOS[name]
+    rateLimiter = surl.RateLimiter(rate=args.rate) if args.rate else None
+    retryPolicy = surl.RetryPolicy(maxRetries=10, backoff=0.01, jitter=0)
+    if isAsync:
+        reader = AsyncTimingReader(surl.AsyncURLReader(seconds=0,
+                        rateLimiter=rateLimiter, retryPolicy=retryPolicy))
+    else:
+        pool = surl.ConnectionPool(compress=False) if args.pool else None
+        reader = TimingReader(surl.ThrottledURLReader(seconds=0,
+                        rateLimiter=rateLimiter, pool=pool,
+                        retryPolicy=retryPolicy))
+    startTime = time.time()
+    numRecords, numBytes = func(args, reader)
+    elapsed = time.time() - startTime
+
+    latencies = sorted(reader.latencies) or [0.0]
+    def percentile(p):
+        return latencies[min(len(latencies)-1, int(p * len(latencies)))]
+    return {'scenario' : name,
+            'requests' : len(reader.latencies),
+            'records'  : numRecords,
+            'seconds'  : round(elapsed, 3),
+            'reqPerSec': round(len(reader.latencies) / elapsed, 1),
+            'p50ms'    : round(1000 * percentile(0.50), 2),
+            'p99ms'    : round(1000 * percentile(0.99), 2),
+            'MBParsedPerSec': round(numBytes / elapsed / 1024**2, 2),
+            'peakRSSMB': round(peakRSSMB(), 1),
+            }
+#----------------------
+
+def peakRSSMB():
+    """ Return this process's peak resident set size in MB """
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':	# bytes on macOS, KB on Linux
+        return maxRSS / 1024.0**2
+    return maxRSS / 1024.0
+#----------------------
+
+def main():
+    args = parseCmdLine()
+    server, base = startFakeEutils(latency=args.latency/1000.0,
+                        recordBytes=args.recordBytes, count=args.count,
+                        rate429=args.rate429)
+    eulib.setEutilsBase(base)
+
+    fmt = "%-24s %8s %8s %8s %8s %8s %10s %8s"
+    if not args.json:
+        print(fmt % ('scenario', 'requests', 'req/s', 'p50 ms', 'p99 ms',
+                                    'records', 'MB/s parsed', 'RSS MB'))
+    context = multiprocessing.get_context('fork')
+    for name in args.scenarios:
+        with context.Pool(1) as processPool:
+            result = processPool.apply(runScenario, (args, name))
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(fmt % (name, result['requests'], result['reqPerSec'],
+                    result['p50ms'], result['p99ms'], result['records'],
+                    result['MBParsedPerSec'], result['peakRSSMB']))
+        sys.stdout.flush()
+    server.shutdown()
+#----------------------
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,30 @@
 #
 # Output to stdout.
 #
+# --stream mode: read IDs in batches (from the cmd line and/or --input file)
+#   and write each batch's records as soon as the batch is done:
+#   json: one json object per line (JSONL), xml: one DocumentSummary per line
+#   (newlines in text content are written as &#10; so they are preserved).
+#   Memory use stays flat no matter how many IDs.
+#   --workers N: N batches are requested at a time (sharing the rate limit),
+#       output in batch order unless --unordered.
+#   --checkpoint file: remember completed batches so a rerun w/ the same
+#       input and batch size skips them. Append to the output on the rerun:
+#       getPubmed.py -s -i ids.txt --checkpoint ck.txt >> out.jsonl
+#       The checkpoint also remembers the output file size after each batch.
+#       If the output is a file, the rerun first truncates it to the end of
+#       the last completed batch, dropping any partly written batch (which
+#       will be redone). If the output is a pipe, it can't, so a batch that
+#       was partly written when the run stopped is written again in full.
+#
 import sys
+import os
+import re
+import stat
 import argparse
+import itertools
+import collections
+import concurrent.futures
 import json
 import simpleURLLib as surl
 import NCBIutilsLib as eulib
@@ -22,24 +44,119 @@ def parseCmdLine():
     parser.add_argument('-f', '--format', dest='format', choices=['json','xml'],
         default='json', required=False, help="eutils summary output format")
 
+    parser.add_argument('-i', '--input', dest='inputFile', default=None,
+        required=False,
+        help="file of pubmed IDs (whitespace separated), '-' for stdin")
+
+    parser.add_argument('-s', '--stream', dest='stream', action='store_true',
+        required=False,
+        help="process IDs in batches, write one record per line (JSONL/xml)")
+
+    parser.add_argument('-b', '--batchsize', dest='batchSize', type=int,
+        default=eulib.JSON_RETMAX, required=False,
+        help="num of IDs per eutils request in stream mode. Default: %d" \
+                                                        % eulib.JSON_RETMAX)
+
+    parser.add_argument('-w', '--workers', dest='workers', type=int,
+        default=1, required=False,
+        help="num of batches to request at a time in stream mode. " +
+            "They share the eutils rate limit. Default: 1")
+
+    parser.add_argument('-u', '--unordered', dest='ordered',
+        action='store_false', required=False,
+        help="in stream mode, write batches as they finish, not in order")
+
+    parser.add_argument('-c', '--checkpoint', dest='checkpointFile',
+        default=None, required=False,
+        help="file to record completed batches in, so an interrupted " +
+            "stream mode run can be resumed. Implies --stream")
+
+    parser.add_argument('--ratelockfile', dest='rateLockFile',
+        default=None, required=False,
+        help="file to share the eutils request rate limit with other " +
+            "processes. Default: don't share")
+
     parser.add_argument('-q', '--quiet', dest='verbose', action='store_false',
         required=False, help="skip helpful messages to stderr")
 
     args = parser.parse_args()
+    if args.workers > 1 or args.checkpointFile != None:
+        args.stream = True
 
     return args
 #----------------------
 
 args = parseCmdLine()
 
+def verbose(text):
+    if args.verbose:
+        sys.stderr.write(text)
+        sys.stderr.flush()
+#----------------------
+
+def iterPmids():
+    """ Generator: the IDs from the cmd line, then from the input file
+    """
+    for pmid in args.pmids:
+        yield pmid
+    if args.inputFile != None:
+        if args.inputFile == '-': fp = sys.stdin
+        else:                     fp = open(args.inputFile, 'r')
+        for line in fp:
+            for pmid in line.split():
+                yield pmid
+        if fp != sys.stdin: fp.close()
+#----------------------
+
+def iterBatches(items, batchSize):
+    """ Generator: lists of up to batchSize items from the items iterable
+    """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batchSize))
+        if not batch:
+            break
+        yield batch
+#----------------------
+
+xmlTokenRE = re.compile(rb'<!\[CDATA\[.*?\]\]>|<!--.*?-->|<[^>]*>|[^<]+', re.S)
+
+def oneLineXML(rcd):
+    """ Return xml record bytes w/ no newlines, w/o changing what it parses to:
+        whitespace-only text w/ a newline (indenting between elements) is
+            dropped, newlines in other text become &#10; (in CDATA too),
+        newlines inside tags/comments become spaces (same to an xml parser).
+    """
+    def oneLine(m):
+        token = m.group(0)
+        if b'\n' not in token:
+            return token
+        if token.startswith(b'<![CDATA['):
+            return token.replace(b'\n', b']]>&#10;<![CDATA[')
+        if token.startswith(b'<'):
+            return token.replace(b'\n', b' ')
+        if not token.strip():
+            return b''
+        return token.replace(b'\n', b'&#10;')
+    rcd = rcd.replace(b'\r\n', b'\n').replace(b'\r', b'\n')  # xml line ends
+    return xmlTokenRE.sub(oneLine, rcd)
+#----------------------
+
 #----------------------
 # Main prog
 #----------------------
 def main():
     retmode = args.format
-    urlReader = surl.ThrottledURLReader( seconds=0.4 ) # don't overwhelm eutils
+    # don't overwhelm eutils: share the API key rate w/ other eutils scripts
+    rateLimiter = surl.RateLimiter(rate=eulib.EUTILS_REQS_PER_SEC,
+                                                lockFile=args.rateLockFile)
+    urlReader = surl.ThrottledURLReader(rateLimiter=rateLimiter,
+                    pool=surl.ConnectionPool(), retryPolicy=surl.RetryPolicy())
+    if args.stream:
+        streamResults(urlReader, retmode)
+        return
 
-    resultsBytes = eulib.getPostResults('pubmed', args.pmids,
+    resultsBytes = eulib.getPostResults('pubmed', list(iterPmids()),
                                     URLReader = urlReader, op='summary',
                                     rettype=None, retmode=retmode,) [0]
     if retmode == 'json':
@@ -48,6 +165,148 @@ def main():
                                         separators=(',',': ')) + '\n')
     else:
         print(resultsBytes.decode())
+#----------------------
+
+def streamResults(urlReader, retmode):
+    """ --stream mode: write one record per line, batch by batch.
+        Up to args.workers batches are in progress at once.
+    """
+    maxBatch = eulib.JSON_RETMAX if retmode == 'json' else eulib.XML_RETMAX
+    batchSize = max(1, min(args.batchSize, maxBatch))
+    out = sys.stdout.buffer
+    checkpoint = Checkpoint(args.checkpointFile, batchSize, out)
+    if checkpoint.done:
+        verbose("Resuming, %d batches already done\n" % len(checkpoint.done))
+    if checkpoint.truncated:
+        verbose("Dropped %d bytes of partly written output\n" \
+                                                    % checkpoint.truncated)
+
+    counts = {'ids': 0, 'records': 0}
+    def getRecords(batch):
+        resultsBytes = eulib.getPostResults('pubmed', batch,
+                                    URLReader = urlReader, op='summary',
+                                    rettype=None, retmode=retmode,) [0]
+        return eulib.splitRecords('pubmed', resultsBytes, op='summary',
+                                                            retmode=retmode)
+    def writeRecords(batchNum, batch, records):
+        for rcd in records.values():
+            if retmode == 'xml':
+                rcd = oneLineXML(rcd)
+            else:			# json: newlines only between tokens
+                rcd = rcd.replace(b'\n', b' ')
+            out.write(rcd + b'\n')
+        out.flush()
+        checkpoint.setDone(batchNum)	# only after its output is written
+
+        counts['ids'] += len(batch)
+        counts['records'] += len(records)
+        verbose("%d IDs done, %d records written\n" % (counts['ids'],
+                                                        counts['records']))
+    batches = ((n, batch) for n, batch in
+                    enumerate(iterBatches(iterPmids(), batchSize))
+                    if n not in checkpoint.done)
+
+    workers = max(1, args.workers)
+    maxPending = 2 * workers		# bounds memory: batches in progress
+    pending = collections.deque()	# (batchNum, batch, future)
+    def finishOne():
+        if args.ordered:
+            batchNum, batch, future = pending.popleft()
+        else:
+            futures = [p[2] for p in pending]
+            concurrent.futures.wait(futures,
+                            return_when=concurrent.futures.FIRST_COMPLETED)
+            i = [f.done() for f in futures].index(True)
+            batchNum, batch, future = pending[i]
+            del pending[i]
+        writeRecords(batchNum, batch, future.result())
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for batchNum, batch in batches:
+            pending.append( (batchNum, batch, pool.submit(getRecords, batch)) )
+            while len(pending) >= maxPending:
+                finishOne()
+        while pending:
+            finishOne()
+    checkpoint.close()
+#----------------------
+
+class Checkpoint (object):
+    """
+    Remembers which batches (by batch number) have been written to the
+        output stream, in a file:
+        1st line: "batchsize N [output size]", then one "batchNum [size]"
+        line per completed batch. Size is the output file size after it, or
+        missing if the output is not a regular file (e.g., a pipe).
+    On load, a partly written last line is ignored (and removed), and if
+        the output is a regular file that is longer than the last recorded
+        size, it is truncated to that size (self.truncated = bytes dropped).
+    Each line is fsync'd (after the output) so the checkpoint never claims a
+        batch that did not make it to disk.
+    If filename is None, nothing is remembered.
+    """
+    def __init__(self, filename, batchSize, out):
+        self.done = set()
+        self.fp = None
+        self.out = out
+        self.truncated = 0
+        if filename == None:
+            return
+        lines = []
+        if os.path.exists(filename):
+            with open(filename, 'r') as fp:
+                lines = fp.read().split('\n')[:-1]	# drop partial last line
+        if lines:
+            header = lines[0].split()
+            if int(header[1]) != batchSize:
+                sys.stderr.write("Checkpoint file %s is for batchsize " \
+                        "%s, not %d\n" % (filename, header[1], batchSize))
+                sys.exit(5)
+            lastSize = header[2] if len(header) > 2 else None
+            for line in lines[1:]:
+                fields = line.split()
+                self.done.add(int(fields[0]))
+                lastSize = fields[1] if len(fields) > 1 else None
+            if lastSize != None:
+                self._truncateOutput(int(lastSize))
+            self.fp = open(filename, 'r+')
+            self.fp.truncate(len('\n'.join(lines)) + 1)
+            self.fp.seek(0, os.SEEK_END)
+        else:
+            self.fp = open(filename, 'w')
+            self._writeLine("batchsize %d" % batchSize)
+
+    def _outputSize(self):
+        """ Return the output's size if it is a regular file, else None """
+        try:
+            st = os.fstat(self.out.fileno())
+        except (OSError, AttributeError, ValueError):
+            return None
+        return st.st_size if stat.S_ISREG(st.st_mode) else None
+
+    def _truncateOutput(self, size):
+        outSize = self._outputSize()
+        if outSize != None and outSize > size:
+            os.ftruncate(self.out.fileno(), size)
+            self.truncated = outSize - size
+
+    def _writeLine(self, text):
+        size = self._outputSize()
+        if size != None:
+            os.fsync(self.out.fileno())
+            text += " %d" % size
+        self.fp.write(text + "\n")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def setDone(self, batchNum):
+        if self.fp != None:
+            self._writeLine("%d" % batchNum)
+
+    def close(self):
+        if self.fp != None:
+            self.fp.close()
+# end class Checkpoint -------------------------
 
 # ---------------------
 
@@ -11,6 +11,11 @@ Author: Jim
 
 *** Examples ***
     URLReader = surl.ThrottledURLReader()
+    # or, to use the full API key rate budget shared by all processes:
+    URLReader = surl.ThrottledURLReader(rateLimiter=surl.RateLimiter(
+                        rate=EUTILS_REQS_PER_SEC, lockFile='/tmp/eutils.rate'))
+    # add pool=surl.ConnectionPool() to reuse connections (skip TLS setup)
+    # add retryPolicy=surl.RetryPolicy() to retry 429s & 5xx w/ backoff
     query = 'Aging+Cell[TA]+AND+(2017/01/01:2017/02/01[PPDAT]+AND+foxo[TITLE})'
     ids = [28440906, 28256074, ]
 
@@ -27,6 +32,71 @@ Author: Jim
 # NOTICE RETTYPE VS RETMODE, see below... 
 #      this confused the heck out of me for hours
 
+(3) count, pages, webenv = iterSearchResultPages('pubmed', query, op='fetch',
+                                        retmode='xml', URLReader=URLReader)
+    for retstart, output in pages:	# ALL the results, 10000 per page
+        ...
+
+(4) async with many lookups at once (see the async versions at the bottom):
+    async def lookup(ids, reader):
+        return await getPostResultsAsync('pubmed', ids, URLReader=reader)
+    reader = surl.AsyncURLReader(rateLimiter=surl.RateLimiter(rate=10))
+    ... await asyncio.gather(*[lookup(ids, reader) for ids in idLists])
+
+(5) for article in iterResultRecords('pubmed', webenv, op='fetch',
+                                                        URLReader=URLReader):
+        # article is an ElementTree PubmedArticle element, parsed as the
+        # efetch output is downloading. Memory use is one record at a time.
+        pmid = article.findtext('MedlineCitation/PMID')
+
+(6) cache = surl.ResponseCache('/data/eutilsCache', ttl=30*24*3600)
+    output, webenv = getPostResults('pubmed', ids, cache=cache)
+    # 2nd time these ids are requested, output comes from the cache.
+    # (webenv is the one saved w/ it, it may have expired on the server)
+    # ResponseCache(..., offline=True) reruns w/o the network at all.
+
+(7) store = RecordStore('/data/pubmedRecords.sqlite')
+    for pmid, rcd in getPostRecords('pubmed', ids, retmode='json',
+                                        store=store, URLReader=URLReader):
+        # rcd is this pmid's esummary json (bytes) or None if eutils had none
+        # only pmids not already in the store are posted to eutils
+
+(8) for batchIds, output, webenv in iterPostResults('pubmed', manyIds,
+                                    op='fetch', retmode='xml', URLReader=URLReader):
+        # output is the efetch xml for batchIds (up to 10000 ids)
+
+(9) summaries = getPostSummaries('pubmed', ids, URLReader=URLReader)
+    for rcd in summaries:	# SummaryRecords: rcd.uid, rcd.title, ...
+        ...
+    columns = summaries.toColumns()	# {'uid': [...], 'title': [...], ...}
+
+(10) session = EutilsSession('pubmed', URLReader=URLReader)
+    count1, key1 = session.search(query)
+    key2 = session.post(ids)
+    count, key = session.combine('#%s AND #%s' % (key1, key2))	# on server
+    output = session.getResults(key, op='summary', retmode='json')
+
+(11) harvester = Harvester('harvest.db', datetype='mdat', URLReader=URLReader)
+    for pmid, record in harvester.harvest(query, op='fetch', retmode='xml'):
+        ...	# only records added/changed since the last harvest(query)
+
+(12) index = IDIndex('ids.db')		# persistent, reused across runs
+    mappings = convertIDs(['28440906', 'PMC5506422', '10.1111/acel.12599'],
+                                            index=index, URLReader=URLReader)
+    mappings['28440906'].pmcid		# IDMapping(pmid, pmcid, doi) or None
+
+(13) for rcd in iterMedlineRecords(output, tags=['PMID', 'TI', 'AU', 'MH']):
+        rcd.get('TI'), rcd.getAll('AU')	# only these tags are looked at
+    # or stream them straight from efetch:
+    for rcd in iterMedlineResultRecords('pubmed', webenv, tags=['PMID','MH']):
+        ...
+
+(14) def sink(retstart, records):	# records from splitRecords()
+        ...				# write them out
+    stats = runResultsPipeline('pubmed', webenv, count, sink, op='fetch',
+                    fetchWorkers=3, parseWorkers=4, URLReader=URLReader)
+    # pages download, parse (in processes), & are written at the same time
+
 *** Eutils Docs ***
 https://www.ncbi.nlm.nih.gov/books/NBK25501/
 https://www.ncbi.nlm.nih.gov/books/NBK3827/#pubmedhelp.How_do_I_search_by_journal_na
@@ -83,10 +153,23 @@ Version 1.0 esummary output:
 Version 2.0 esummary output:
     https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20160609/esummary_pmc.dtd
 """
+import re
 import sys
+import json
+import array
+import mmap
+import time
+import datetime
+import hashlib
+import sqlite3
+import queue
+import threading
+import functools
+import collections
+import concurrent.futures
 import xml.dom.minidom as minidom	# try to use things in python 2.4
-#import xml.etree.ElementTree as et
-#import json
+import xml.etree.ElementTree as et
+import urllib.parse
 import simpleURLLib as surl
 
 # -------------------------
@@ -102,12 +185,43 @@ EPOST_BASE    = EUTILS_BASE + 'epost.fcgi'	# APIkey must be in post params
 EFETCH_BASE   = EUTILS_BASE + 'efetch.fcgi?&api_key='  + EUTILS_API_KEY
 ESUMMARY_BASE = EUTILS_BASE + 'esummary.fcgi?&api_key=' + EUTILS_API_KEY
 
-        # not used yet. Should implement functions for this. Correct URL?
-ID_CONVERTER_URL = ESEARCH_BASE + '&db=pubmed&term=%s[lid]'
+# PMC ID converter (PMID <-> PMCID <-> DOI), see convertIDs()
+ID_CONVERTER_URL = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/'
+ID_CONVERTER_MAX = 200		# max num of IDs per ID converter request
+
+def setEutilsBase(base,	# eutils base URL, ending in '/'
+    ):
+    """ Point all the eutils URLs at base instead of NCBI, e.g., a local
+        mirror or fake eutils server (see benchEutils.py)
+    """
+    global EUTILS_BASE, ESEARCH_BASE, EPOST_BASE, EFETCH_BASE, ESUMMARY_BASE
+    EUTILS_BASE   = base
+    ESEARCH_BASE  = EUTILS_BASE + 'esearch.fcgi?&api_key=' + EUTILS_API_KEY
+    EPOST_BASE    = EUTILS_BASE + 'epost.fcgi'
+    EFETCH_BASE   = EUTILS_BASE + 'efetch.fcgi?&api_key='  + EUTILS_API_KEY
+    ESUMMARY_BASE = EUTILS_BASE + 'esummary.fcgi?&api_key=' + EUTILS_API_KEY
+# -------------------------
 
 USEHISTORY = "&usehistory=y"	# eutils param for history
 
 DEFAULT_ENCODING = 'utf-8'      # to use when creating URLs
+
+EUTILS_REQS_PER_SEC = 10       # max request rate NCBI allows w/ an API key
+
+# XML record tags for each (db, op) output. See iterXMLRecords()
+RECORD_TAGS = {
+    ('pubmed', 'fetch')   : ('PubmedArticle', 'PubmedBookArticle'),
+    ('pubmed', 'summary') : ('DocumentSummary', 'DocSum'),	# v2.0, v1.0
+    ('pmc', 'fetch')      : ('article',),
+    ('pmc', 'summary')    : ('DocumentSummary', 'DocSum'),
+    }
+XML_CHUNK_SIZE = 64 * 1024      # bytes to read at a time when streaming
+
+CACHE_FORMAT = 2                # bump to ignore ResponseCache entries made
+                                #  by older versions of this module
+
+XML_RETMAX  = 10000             # max records eutils returns per xml request
+JSON_RETMAX =   500             # max records eutils returns per json request
 # -------------------------
 
 def getWebenv(root,	# minidom root of xml output a eutils
@@ -129,38 +243,80 @@ def codeWebenvURLParams(webenv,
     return "&webenv=%s&query_key=%s" % (webenv, query_key)
 # -------------------------
 
+def decodeWebenvURLParams(webenvURLParams,
+            ):
+    """ Return (webenv, query_key) from codeWebenvURLParams() output
+    """
+    params = dict([p.split('=', 1) for p in webenvURLParams.split('&') if p])
+    return params['webenv'], params['query_key']
+# -------------------------
+
+def getSearchURL(db,	# eutils db name ('pubmed', 'pmc', ...)
+            queryString,	# esearch query string
+            webenv=None,	# webenv (str) to add the result set to
+    ):
+    """ Return the esearch URL that leaves the result set on the history
+        server
+    """
+    url = ESEARCH_BASE + "%s&db=%s&term=%s&retmode=%s" % \
+                                        (USEHISTORY, db, queryString,'xml')
+    if webenv != None:
+        url += "&WebEnv=%s" % webenv
+    return url
+# -------------------------
+
+def parseSearchOutput(outputX,	# esearch xml output (bytes)
+    ):
+    """ Return count and webenv/query_key (as URL params) from esearch output
+    """
+    root = et.fromstring(outputX)
+    if root.findtext("Count") == None:
+        raise getErrorClass(outputX)("Esearch error: %s\n" % \
+                            (root.findtext(".//ERROR") or outputX[:200]))
+    count = int(root.findtext("Count"))
+
+    webenvURLParams = codeWebenvURLParams(root.findtext("WebEnv"),
+                                            root.findtext("QueryKey"))
+    return count, webenvURLParams
+# -------------------------
+
 def doSearch(db,		# eutils db name ('pubmed', 'pmc', ...)
             queryString,	# esearch query string
             URLReader=surl.ThrottledURLReader(),
             debug=False,
+            webenv=None,	# webenv (str) on the history server to add
+                                #  the result set to. None = start a new one
     ):
     """ do a eutils.esearch & leave result set on the eutils history server.
         Return count and webenv/query_key (as URL params) on history server.
+        queryString can refer to earlier result sets in the same webenv,
+            e.g., '%231+AND+%232' ("#1 AND #2"), so the combination is done
+            on the server.
     """
     # do search, save results in eutils history - get search output in xml
-    url = ESEARCH_BASE + "%s&db=%s&term=%s&retmode=%s" % \
-                                        (USEHISTORY, db, queryString,'xml')
+    url = getSearchURL(db, queryString, webenv=webenv)
     if debug: sys.stderr.write( "Esearch URL:\n%s\n" % url)
 
     outputX = URLReader.readURL(url) 
     if debug: sys.stderr.write( "Output from Esearch:\n%s\n" % outputX)
 
-    xmlDoc = minidom.parseString(outputX)	# what about errors?
-    count = int(xmlDoc.getElementsByTagName("Count")[0].childNodes[0].data)
-
-    # get webenv params
-    webenv, query_key = getWebenv(xmlDoc)
-    webenvURLParams = codeWebenvURLParams(webenv, query_key)
+    return parseSearchOutput(outputX)
+# -------------------------
 
-    return count, webenvURLParams
+def normalizeIDs(ids,	# list of IDs (str, bytes, or int)
+    ):
+    """ Return the ids as a list of stripped strings """
+    def toStr(x):
+        if type(x) == type(b' '): return x.decode(DEFAULT_ENCODING).strip()
+        return str(x).strip()
+    return [toStr(x) for x in ids]
 # -------------------------
 
-def doPost(db,		# eutils db name ('pubmed', 'pmc', ...)
-            ids,	# list of IDs (str or bytes) to post and get fetch for
-            URLReader=surl.ThrottledURLReader(),
-            debug=False,
+def getPostParams(db,	# eutils db name ('pubmed', 'pmc', ...)
+            ids,	# list of IDs (str or bytes) to post
+            webenv=None,	# webenv (str) to add the ids to, None = new
     ):
-    """ do a eutils.post and return webenv/query_key as eutils URL params.
+    """ Return the epost params (bytes) for posting ids
     """
     def toBytes(x):
         if type(x) == type(b' '): return x
@@ -168,8 +324,35 @@ def doPost(db,		# eutils db name ('pubmed', 'pmc', ...)
         else:                    return str(x).encode(encoding=DEFAULT_ENCODING)
     # build params for post
     idParams    = b','.join( [toBytes(x).strip() for x in ids] )
-    otherParams = b'api_key=%b&db=%b&id=' %(toBytes(EUTILS_API_KEY),toBytes(db))
-    params = otherParams + idParams
+    otherParams = b'api_key=%b&db=%b' %(toBytes(EUTILS_API_KEY),toBytes(db))
+    if webenv != None:
+        otherParams += b'&WebEnv=%b' % toBytes(webenv)
+    return otherParams + b'&id=' + idParams
+# -------------------------
+
+def parsePostOutput(outputX,	# epost xml output (bytes)
+    ):
+    """ Return webenv/query_key (as URL params) from epost output
+    """
+    root = et.fromstring(outputX)
+    if root.find(".//ERROR") != None or root.findtext("WebEnv") == None:
+        raise getErrorClass(outputX)("Epost error: %s\n" % \
+                            (root.findtext(".//ERROR") or outputX[:200]))
+    return codeWebenvURLParams(root.findtext("WebEnv"),
+                                            root.findtext("QueryKey"))
+# -------------------------
+
+def doPost(db,		# eutils db name ('pubmed', 'pmc', ...)
+            ids,	# list of IDs (str or bytes) to post and get fetch for
+            URLReader=surl.ThrottledURLReader(),
+            debug=False,
+            webenv=None,	# webenv (str) on the history server to add
+                                #  the ids to. None = start a new webenv
+    ):
+    """ do a eutils.post and return webenv/query_key as eutils URL params.
+        If webenv is given, the ids get a new query_key in that webenv.
+    """
+    params = getPostParams(db, ids, webenv=webenv)
 
     url = EPOST_BASE
     if debug:
@@ -179,33 +362,20 @@ def doPost(db,		# eutils db name ('pubmed', 'pmc', ...)
     outputX = URLReader.readURL(url, params=params, GET=False) 
     if debug: sys.stderr.write( "Output from Epost:\n%s\n" % outputX[:100])
 
-    xmlDoc = minidom.parseString(outputX)
-
-    # get webenv params
-    webenv, query_key = getWebenv(xmlDoc)
-    webenvURLParams = codeWebenvURLParams(webenv, query_key)
-
-    return webenvURLParams
+    return parsePostOutput(outputX)
 # -------------------------
 
-def getResults(db,		# eutils db name ('pubmed', 'pmc', ...)
+def getResultsURL(db,	# eutils db name ('pubmed', 'pmc', ...)
                 webenvURLParams,
                 op='summary',	# 'summary' or 'fetch' output
                 retmode='xml',	# eutils desired output format
                 rettype=None,	# eutils rettype option
                 version='2.0',	# eutils output version (affects json?)
                 retmax=None,	# max number of results to return
-                                # None of 0 means no max.
-                                # 10000 is XML output max for eutils
-                                #   500 is json output max for eutils
-                URLReader=surl.ThrottledURLReader(),
-                debug=False,
+                retstart=0,	# index of 1st result to return (paging)
     ):
-    """ Do a eutils.esearch or efetch from results on history server 
-            and return results (string)
-        Retmode/rettype: see notes above
-        Note: for json output, eutils have a 500 record output limit,
-        and you get an eutils error if you don't have &retmax
+    """ Return the esummary or efetch URL for results on history server.
+        See getResults() below.
     """
     # result type (could check for more option combination errors)
     if op == 'summary': url = ESUMMARY_BASE
@@ -220,11 +390,41 @@ def getResults(db,		# eutils db name ('pubmed', 'pmc', ...)
     if rettype != None:
         url += "&rettype=%s" % rettype
 
-    if retmax == None or retmax == 0: retmax = 10000	# eutils XML max
+    if retmax == None or retmax == 0: retmax = XML_RETMAX
     if retmode == 'json':
-        url += "&retmax=%d" % min(retmax, 500)
+        url += "&retmax=%d" % min(retmax, JSON_RETMAX)
     else: url += "&retmax=%d" % retmax
+    if retstart:
+        url += "&retstart=%d" % retstart
 
+    return url
+# -------------------------
+
+def getResults(db,		# eutils db name ('pubmed', 'pmc', ...)
+                webenvURLParams,
+                op='summary',	# 'summary' or 'fetch' output
+                retmode='xml',	# eutils desired output format
+                rettype=None,	# eutils rettype option
+                version='2.0',	# eutils output version (affects json?)
+                retmax=None,	# max number of results to return
+                                # None of 0 means no max.
+                                # 10000 is XML output max for eutils
+                                #   500 is json output max for eutils
+                retstart=0,	# index of 1st result to return (paging)
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+    ):
+    """ Do a eutils.esearch or efetch from results on history server 
+            and return results (string)
+        Retmode/rettype: see notes above
+        Note: for json output, eutils have a 500 record output limit,
+        and you get an eutils error if you don't have &retmax
+        To get more than the output limit, use retstart to page through
+        the results, or see iterResultPages() below.
+    """
+    url = getResultsURL(db, webenvURLParams, op=op, retmode=retmode,
+                    rettype=rettype, version=version, retmax=retmax,
+                    retstart=retstart)
     if debug: sys.stderr.write( "Summary/Fetch URL:\n%s\n" % url )
 
     output = URLReader.readURL(url)
@@ -232,6 +432,347 @@ def getResults(db,		# eutils db name ('pubmed', 'pmc', ...)
     return output
 # -------------------------
 
+def iterResultPages(db,		# eutils db name ('pubmed', 'pmc', ...)
+                webenvURLParams,
+                count,		# number of results in the result set
+                                #  (e.g., count returned from doSearch())
+                op='summary',	# 'summary' or 'fetch' output
+                retmode='xml',	# eutils desired output format
+                rettype=None,	# eutils rettype option
+                version='2.0',	# eutils output version (affects json?)
+                pageSize=None,	# num of results per page (request)
+                                # None means the eutils max for retmode
+                numWorkers=3,	# max num of pages to fetch concurrently
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+    ):
+    """ Generator: walk the result set on the history server in
+            retstart/retmax pages via getResults().
+        Yield (retstart, output) for each page, in retstart order.
+
+        Up to numWorkers pages are requested at the same time, all through
+        the same URLReader, so the URLReader's throttling bounds the overall
+        request rate (e.g., NCBI allows 10 req/s w/ an API key).
+        Pages that arrive early are held until the pages before them have
+        been yielded.
+    """
+    maxPage = JSON_RETMAX if retmode == 'json' else XML_RETMAX
+    if pageSize == None or pageSize <= 0 or pageSize > maxPage:
+        pageSize = maxPage
+    numWorkers = max(numWorkers, 1)
+
+    starts = iter(range(0, count, pageSize))
+    pending = collections.deque()	# (retstart, future) in retstart order
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=numWorkers)
+    def submitNext():
+        start = next(starts, None)
+        if start != None:
+            future = executor.submit(getResults, db, webenvURLParams, op=op,
+                                retmode=retmode, rettype=rettype,
+                                version=version, retmax=pageSize,
+                                retstart=start, URLReader=URLReader,
+                                debug=debug)
+            pending.append( (start, future) )
+    try:
+        for i in range(numWorkers):
+            submitNext()
+        while pending:
+            start, future = pending.popleft()
+            output = future.result()
+            submitNext()		# keep numWorkers requests in flight
+            yield start, output
+    finally:			# includes the caller abandoning us early
+        for start, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+# -------------------------
+
+def iterSearchResultPages(db,	# eutils db name ('pubmed', 'pmc', ...)
+                    queryString,	# esearch query string
+                    op='summary',	# 'summary' or 'fetch' output
+                    retmode='xml',	# eutils desired output format
+                    rettype=None,	# eutils rettype option
+                    version='2.0',	# eutils output version (affects json?)
+                    pageSize=None,	# num of results per page (request)
+                    numWorkers=3,	# max num of pages to fetch concurrently
+                    URLReader=surl.ThrottledURLReader(),
+                    debug=False,
+    ):
+    """ Do esearch and return all the results (not just the 1st 10000)
+            as esummary or efetch pages.
+        Return count of results, a generator of (retstart, output) pages
+            (see iterResultPages()), webenv/query_key as eutils URL params
+    """
+    count, webenvURLParams = doSearch(db, queryString,
+                                URLReader=URLReader, debug=debug)
+
+    pages = iterResultPages(db, webenvURLParams, count, op=op,
+                    retmode=retmode, rettype=rettype, version=version,
+                    pageSize=pageSize, numWorkers=numWorkers,
+                    URLReader=URLReader, debug=debug)
+    return count, pages, webenvURLParams
+# -------------------------
+
+def iterXMLRecords(source,	# xml as bytes, or a file-like object w/ read(n)
+                                #  (e.g., an http response from openURL()),
+                                #  or an iterable of bytes chunks
+                tags,		# record tag name or list/tuple of names
+                                #  e.g., RECORD_TAGS[('pubmed', 'fetch')]
+    ):
+    """ Generator: parse the xml incrementally and yield each record element
+            (ElementTree Element) whose tag is in 'tags' as soon as the end
+            of the record has been read.
+        Records that are yielded are removed from the tree, so memory use
+            is bounded by the size of a record (as long as the caller does
+            not keep them), not the size of the xml.
+        Records nested inside other records are not yielded separately.
+    """
+    if type(tags) == type(''): tags = (tags,)
+    tags = set(tags)
+
+    if type(source) == type(b''):
+        chunks = [source]
+    elif hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(XML_CHUNK_SIZE), b'')
+    else:
+        chunks = source
+
+    parser = et.XMLPullParser(events=('start', 'end'))
+    stack = []			# open elements, stack[-1] is the innermost
+    depth = 0			# num of open elements that are records
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag in tags: depth += 1
+            else:
+                stack.pop()
+                if elem.tag in tags:
+                    depth -= 1
+                    if depth == 0:
+                        if stack: stack[-1].remove(elem)
+                        yield elem
+    parser.close()
+# -------------------------
+
+def iterResultRecords(db,	# eutils db name ('pubmed', 'pmc', ...)
+                webenvURLParams,
+                op='summary',	# 'summary' or 'fetch' output
+                rettype=None,	# eutils rettype option
+                version='2.0',	# eutils output version (affects json?)
+                retmax=None,	# max number of results to return
+                retstart=0,	# index of 1st result to return (paging)
+                tags=None,	# record tags to yield, None=RECORD_TAGS[db,op]
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+    ):
+    """ Generator: do a eutils.esummary or efetch (retmode=xml) from results
+            on the history server and yield the records as ElementTree
+            Elements while the output is still downloading.
+        See iterXMLRecords().
+    """
+    if tags == None: tags = RECORD_TAGS[(db, op)]
+    url = getResultsURL(db, webenvURLParams, op=op, retmode='xml',
+                    rettype=rettype, version=version, retmax=retmax,
+                    retstart=retstart)
+    if debug: sys.stderr.write( "Summary/Fetch URL:\n%s\n" % url )
+
+    with URLReader.openURL(url) as response:
+        for rcd in iterXMLRecords(response, tags):
+            yield rcd
+# -------------------------
+
+# -------------------------
+# MEDLINE text (efetch rettype=medline, retmode=text)
+# -------------------------
+
+class MedlineRecord (object):
+    """
+    One MEDLINE format record. Holds the record's bytes (a memoryview into
+        the parser's buffer, not a copy) and where each tag's values are.
+        Values are only decoded to str when asked for.
+    A value that is continued on following lines is joined w/ single spaces.
+    """
+    __slots__ = ('data', 'fields')
+
+    def __init__(self, data,	# memoryview (or bytes) of the record text
+                fields,		# tag (bytes) -> list of values, each a list
+                                #   of (start, end) spans in data, 1 per line
+        ):
+        self.data = data
+        self.fields = fields
+
+    def _value(self, spans):
+        return b' '.join([bytes(self.data[start:end]).strip()
+                        for start, end in spans]).decode(DEFAULT_ENCODING)
+
+    def get(self, tag, default=None):
+        """ Return the 1st value of tag (e.g., 'TI'), or default """
+        values = self.fields.get(tag.encode())
+        if not values:
+            return default
+        return self._value(values[0])
+
+    def getAll(self, tag):
+        """ Return list of all values of tag (e.g., 'AU', 'MH') """
+        return [self._value(v) for v in self.fields.get(tag.encode(), [])]
+
+    def tags(self):
+        """ Return list of the tags (str) in the record (that were parsed) """
+        return [tag.decode() for tag in self.fields]
+
+    def __contains__(self, tag):
+        return tag.encode() in self.fields
+
+    def toBytes(self):
+        """ Return the record's MEDLINE text """
+        return bytes(self.data)
+
+    def __repr__(self):
+        return 'MedlineRecord(PMID=%s)' % self.get('PMID')
+# end class MedlineRecord -------------------------
+
+def iterMedlineRecords(source,	# MEDLINE text as bytes or mmap, or a
+                                #  file-like object w/ read(n), (e.g., an
+                                #  http response from openURL()), or an
+                                #  iterable of bytes/memoryview chunks
+                tags=None,	# tag names (str) to parse, None = all tags
+    ):
+    """ Generator: yield each MedlineRecord in the MEDLINE text as soon as
+            the end of the record (blank line) has been read.
+        Records are views into the chunks read (bytes, mmap, or the buffer
+            under a memoryview chunk), chunks are searched in place. Only a
+            record that spans chunks is copied: its part in the earlier
+            chunk(s) plus its lines in the next one.
+        Only the lines of the requested tags are looked at past their tag,
+            and values are decoded lazily.
+    """
+    wanted = None if tags == None else set([t.encode() for t in tags])
+
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        chunks = [source]
+    elif hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(XML_CHUNK_SIZE), b'')
+    else:
+        chunks = source
+
+    rest = b''			# text after the last blank line: a view into
+                                #  the last chunk, or bytes if it spans chunks
+    for chunk in chunks:
+        if isinstance(chunk, (bytearray, memoryview)):
+            chunk = memoryview(chunk).cast('B')	# no copy
+        start = 0
+        if len(rest):			# a record spans chunks, copy it
+            rest = bytes(rest)
+            cut = _endOfFirstBlankLine(rest, chunk)
+            if cut == None:			# record goes on past this chunk
+                rest += bytes(chunk)
+                continue
+            rcd = rest + bytes(chunk[:cut])
+            yield from _parseMedline(rcd, 0, len(rcd), wanted)
+            start = cut
+        cut = _endOfLastBlankLine(chunk, start)
+        yield from _parseMedline(chunk, start, cut, wanted)
+        rest = memoryview(chunk)[cut:]
+    if len(rest):
+        yield from _parseMedline(rest, 0, len(rest), wanted)
+# -------------------------
+
+BLANK_LINE_RE = re.compile(rb'\n\r?\n')
+LAST_BLANK_LINE_RE = re.compile(rb'.*\n\r?\n', re.S)
+NEWLINE_RE = re.compile(rb'\n')
+
+def _endOfLastBlankLine(buf,	# bytes, mmap or memoryview
+                start,		# where to start looking
+    ):
+    """ Return index just past the last blank line in buf[start:]
+        (start if none)
+    """
+    m = LAST_BLANK_LINE_RE.match(buf, start)	# greedy: backs up from end
+    return m.end() if m else start
+# -------------------------
+
+def _endOfFirstBlankLine(pending,	# bytes, text before buf w/o blank lines
+                buf,		# bytes, mmap or memoryview
+    ):
+    """ Return index just past the 1st blank line in buf, counting one that
+        starts at the end of pending (None if none)
+    """
+    tail = pending[-2:]
+    m = BLANK_LINE_RE.search(tail + bytes(buf[:2]))
+    if m and m.end() > len(tail):
+        return m.end() - len(tail)
+    m = BLANK_LINE_RE.search(buf)
+    return m.end() if m else None
+# -------------------------
+
+def _parseMedline(buf,		# bytes, mmap or memoryview
+                start,		# where to start in buf
+                end,		# where to stop, the end of a record
+                wanted,		# set of tags (bytes) to parse, None = all
+    ):
+    """ Generator: MedlineRecords in buf[start:end] """
+    view = memoryview(buf)
+    if isinstance(buf, memoryview):	# no find(), search it w/ re
+        def findEOL(pos):
+            m = NEWLINE_RE.search(buf, pos, end)
+            return m.start() if m else -1
+    else:
+        def findEOL(pos):
+            return buf.find(b'\n', pos, end)
+    recStart = None		# start of current record, None = between
+    fields = {}
+    spans = None		# spans of the current value, None = skipping
+    pos = start
+    while pos < end:
+        eol = findEOL(pos)
+        if eol < 0: eol = end
+        if eol == pos or (eol == pos + 1 and buf[pos] == 13):	# blank line
+            if recStart != None:
+                yield MedlineRecord(view[recStart:pos], fields)
+                recStart = None
+                fields = {}
+        else:
+            if recStart == None:
+                recStart = pos
+            if buf[pos] == 32:			# continuation line
+                if spans != None:
+                    spans.append( (pos - recStart + 6, eol - recStart) )
+            else:
+                tag = bytes(view[pos:pos+4]).rstrip()
+                if wanted == None or tag in wanted:
+                    spans = [(pos - recStart + 6, eol - recStart)]
+                    fields.setdefault(tag, []).append(spans)
+                else:
+                    spans = None
+        pos = eol + 1
+    if recStart != None:
+        yield MedlineRecord(view[recStart:end], fields)
+# -------------------------
+
+def iterMedlineResultRecords(db,	# eutils db name ('pubmed', ...)
+                webenvURLParams,
+                retmax=None,	# max number of results to return
+                retstart=0,	# index of 1st result to return (paging)
+                tags=None,	# tag names to parse, None = all tags
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+    ):
+    """ Generator: do a eutils.efetch (rettype=medline, retmode=text) from
+            results on the history server and yield the MedlineRecords while
+            the output is still downloading.
+        See iterMedlineRecords().
+    """
+    url = getResultsURL(db, webenvURLParams, op='fetch', retmode='text',
+                    rettype='medline', retmax=retmax, retstart=retstart)
+    if debug: sys.stderr.write( "Fetch URL:\n%s\n" % url )
+
+    with URLReader.openURL(url) as response:
+        yield from iterMedlineRecords(response, tags)
+# -------------------------
+
 def getSearchResults(db,		# eutils db name ('pubmed', 'pmc', ...)
                     queryString,	# esearch query string
                     op='summary',	# 'summary' or 'fetch' output
@@ -241,12 +782,27 @@ def getSearchResults(db,		# eutils db name ('pubmed', 'pmc', ...)
                     retmax=10000,	# max number of results to return
                                         # 10000 is XML output max for eutils
                     URLReader=surl.ThrottledURLReader(),
+                    cache=None,		# surl.ResponseCache, None = no cache
                     debug=False,
     ):
     """ Do esearch and get results as esummary or efetch.
         Return count of results, results (string), webenv/query_key as
             eutils URL params
+        If cache is given, results are saved in it and later calls w/ the
+            same params come from the cache (until the cache entry expires).
+            Then webenv/query_key is the one saved w/ the results. It may
+            have expired on the history server (eutils drops them after some
+            hours), then eutils output for it is an error, see
+            isHistoryError().
     """
+    if cache != None:
+        key = cache.makeKey(CACHE_FORMAT, 'search', db, queryString, op,
+                                        retmode, rettype, str(version), retmax)
+        entry = cache.getEntry(key)
+        if entry != None:
+            output, meta = entry
+            return meta['count'], output, meta['webenv']
+
     # do search, save results in eutils history
     count, webenvURLParams = doSearch(db, queryString,
                                 URLReader=URLReader, debug=debug)
@@ -255,6 +811,10 @@ def getSearchResults(db,		# eutils db name ('pubmed', 'pmc', ...)
     output = getResults(db, webenvURLParams, op=op, retmode=retmode,
                     rettype=rettype, version=version, retmax=retmax,
                     URLReader=URLReader, debug=debug)
+
+    if cache != None:
+        cache.put(key, output, meta={'count': count,
+                                                'webenv': webenvURLParams})
     return count, output, webenvURLParams
 # -------------------------
 
@@ -265,16 +825,1292 @@ def getPostResults(db,		# eutils db name ('pubmed', 'pmc', ...)
                     rettype=None,	# eutils rettype option
                     version='2.0',	# eutils output version (affects json?)
                     URLReader=surl.ThrottledURLReader(),
+                    cache=None,		# surl.ResponseCache, None = no cache
                     debug=False,
     ):
     """ do a eutils.post and return eutils.efetch for the results
+        If cache is given, results are saved in it and later calls for the
+            same ids & params come from the cache (until the cache entry
+            expires). Then webenv/query_key is the one saved w/ the results,
+            and may have expired on the history server, see
+            getSearchResults().
     """
+    if cache != None:
+        key = cache.makeKey(CACHE_FORMAT, 'post', db, normalizeIDs(ids), op,
+                                        retmode, rettype, str(version))
+        entry = cache.getEntry(key)
+        if entry != None:
+            output, meta = entry
+            return output, meta['webenv']
+
     webenvURLParams = doPost(db, ids, URLReader=URLReader, debug=debug)
 
     # get result summary or fetch
     output = getResults(db, webenvURLParams, op=op, retmode=retmode,
                     rettype=rettype, version=version, URLReader=URLReader,
                     debug=debug)
+
+    if cache != None:
+        cache.put(key, output, meta={'webenv': webenvURLParams})
+    return output, webenvURLParams
+# -------------------------
+
+def iterPostResults(db,		# eutils db name ('pubmed', 'pmc', ...)
+                    ids,	# list of IDs to post and get results for
+                    op='summary',	# 'summary' or 'fetch' output
+                    retmode='xml',	# eutils desired output format
+                    rettype=None,	# eutils rettype option
+                    version='2.0',	# eutils output version (affects json?)
+                    batchSize=None,	# num of IDs per post, None means the
+                                        #  eutils retmax for retmode
+                    oneWebenv=False,	# True = post all batches into one
+                                        #  webenv (one query_key per batch)
+                    progress=None,	# optional function called after each
+                                        #  batch: progress(batchNum,
+                                        #       numBatches, numIdsDone)
+                    URLReader=surl.ThrottledURLReader(),
+                    debug=False,
+    ):
+    """ Generator: post the ids in batches and yield
+            (batch ids, results, webenv/query_key as eutils URL params)
+            for each batch, in order.
+        Use this instead of getPostResults() for more IDs than eutils will
+            take in one post or return in one esummary/efetch.
+        The epost of batch N+1 is done (in another thread) while the
+            results of batch N are being fetched.
+    """
+    maxBatch = JSON_RETMAX if retmode == 'json' else XML_RETMAX
+    if batchSize == None or batchSize <= 0 or batchSize > maxBatch:
+        batchSize = maxBatch
+
+    batches = [ids[i:i+batchSize] for i in range(0, len(ids), batchSize)]
+    numDone = 0
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        if batches:
+            postFuture = executor.submit(doPost, db, batches[0],
+                                        URLReader=URLReader, debug=debug)
+        for n, batch in enumerate(batches):
+            webenvURLParams = postFuture.result()
+
+            if n+1 < len(batches):	# start posting the next batch
+                webenv = None
+                if oneWebenv:
+                    webenv = decodeWebenvURLParams(webenvURLParams)[0]
+                postFuture = executor.submit(doPost, db, batches[n+1],
+                            URLReader=URLReader, debug=debug, webenv=webenv)
+
+            output = getResults(db, webenvURLParams, op=op, retmode=retmode,
+                            rettype=rettype, version=version,
+                            retmax=len(batch), URLReader=URLReader,
+                            debug=debug)
+            numDone += len(batch)
+            if progress != None:
+                progress(n+1, len(batches), numDone)
+            yield batch, output, webenvURLParams
+    finally:
+        executor.shutdown(wait=True)
+# -------------------------
+
+def splitRecords(db,		# eutils db name ('pubmed', 'pmc', ...)
+                output,		# eutils output (bytes) to split
+                op='summary',	# 'summary' or 'fetch' output
+                retmode='xml',	# eutils output format
+                rettype=None,	# eutils rettype option
+    ):
+    """ Split eutils esummary/efetch output into individual records.
+        Return dict mapping each ID (str) to its record (bytes).
+        Handles: summary json (record is the json for the uid),
+                 summary xml v1.0 and v2.0, pubmed fetch xml,
+                 pubmed fetch medline text.
+    """
+    records = {}
+    if op == 'summary' and retmode == 'json':
+        result = json.loads(output).get('result', {})
+        for uid in result.get('uids', []):
+            records[uid] = json.dumps(result[uid]).encode(DEFAULT_ENCODING)
+
+    elif retmode == 'xml' and (db, op) in RECORD_TAGS and \
+                                            (db, op) != ('pmc', 'fetch'):
+        for rcd in iterXMLRecords(output, RECORD_TAGS[(db, op)]):
+            if rcd.tag == 'DocumentSummary':	# v2.0 summary
+                uid = rcd.get('uid')
+            elif rcd.tag == 'DocSum':		# v1.0 summary
+                uid = rcd.findtext('Id')
+            else:				# pubmed fetch
+                uid = rcd.findtext('.//PMID')
+            records[uid.strip()] = et.tostring(rcd, encoding=DEFAULT_ENCODING)
+
+    elif op == 'fetch' and rettype == 'medline':
+        for rcd in output.strip().split(b'\n\n'):
+            for line in rcd.split(b'\n'):
+                if line.startswith(b'PMID-'):
+                    uid = line[5:].strip().decode(DEFAULT_ENCODING)
+                    records[uid] = rcd.strip() + b'\n'
+                    break
+    else:
+        raise Exception('Cannot split %s %s output, retmode=%s rettype=%s\n' \
+                                    % (db, op, retmode, rettype))
+    return records
+# -------------------------
+
+class RecordStore (object):
+    """
+    Persistent (sqlite) store of individual eutils records by
+        (db, id, format), where format identifies the eutils output format
+        (op, retmode, rettype, version). See getPostRecords().
+    A record can be None (stored as NULL): eutils had no record for the id
+        (e.g., deleted or withdrawn), so the id need not be asked for again.
+    Can be shared by threads, and by processes (sqlite locks the file).
+    """
+    def __init__(self,
+                dbFile,		# sqlite file name, ':memory:' = no file
+                ):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbFile, timeout=60,
+                                                check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS records ' +
+                    '(db TEXT, id TEXT, format TEXT, data BLOB, saved REAL, ' +
+                    'PRIMARY KEY (db, id, format))')
+    #------------------------
+
+    def getMany(self, db, ids, format):
+        """ Return dict mapping ids (str) found in the store to their records
+            (None for ids stored as having no record)
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(ids), 500):	# sqlite max num of params
+                batch = ids[i:i+500]
+                sql = 'SELECT id, data FROM records WHERE db=? AND format=? ' \
+                        + 'AND id IN (%s)' % ','.join(['?'] * len(batch))
+                for uid, data in self.conn.execute(sql, [db, format] + batch):
+                    found[uid] = data
+        return found
+    #------------------------
+
+    def putMany(self, db, records, format):
+        """ Save records (dict mapping id to record bytes, or None if
+            eutils has no record for the id)
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO records ' +
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(db, uid, format, data, now) for uid, data in
+                                                            records.items()])
+    #------------------------
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+    #------------------------
+
+# end class RecordStore -------------------------
+
+def getPostRecords(db,		# eutils db name ('pubmed', 'pmc', ...)
+                    ids,	# list of IDs to get records for
+                    store,	# RecordStore
+                    op='summary',	# 'summary' or 'fetch' output
+                    retmode='xml',	# eutils desired output format
+                    rettype=None,	# eutils rettype option
+                    version='2.0',	# eutils output version (affects json?)
+                    URLReader=surl.ThrottledURLReader(),
+                    debug=False,
+    ):
+    """ Return list of (id, record) for the ids, in the order given.
+        Records already in the store are used as is, only the others are
+            posted to eutils (iterPostResults()). Their records are split out
+            (see splitRecords()) and added to the store.
+        Posted ids that eutils returns no record for are stored as None, so
+            they are not posted again.
+        record is bytes, or None if eutils did not return a record for the id
+    """
+    ids = normalizeIDs(ids)
+    format = '%s/%s/%s/%s' % (op, retmode, rettype, version)
+
+    records = store.getMany(db, ids, format)
+    misses = [uid for uid in collections.OrderedDict.fromkeys(ids)
+                                                    if uid not in records]
+    if debug: sys.stderr.write("%d records from store, %d to post\n" \
+                                            % (len(ids)-len(misses), len(misses)))
+    for batch, output, webenvURLParams in iterPostResults(db, misses, op=op,
+                            retmode=retmode, rettype=rettype, version=version,
+                            URLReader=URLReader, debug=debug):
+        newRecords = splitRecords(db, output, op=op, retmode=retmode,
+                                                            rettype=rettype)
+        for uid in batch:
+            newRecords.setdefault(uid, None)	# no record, don't ask again
+        store.putMany(db, newRecords, format)
+        records.update(newRecords)
+
+    return [(uid, records.get(uid)) for uid in ids]
+
+# -------------------------
+# Pipelines: overlap fetching, parsing, and writing
+# -------------------------
+
+class PipelineStopped (Exception):
+    """ Raised in a Pipeline stage thread when another stage has failed """
+    pass
+# -------------------------
+
+class Pipeline (object):
+    """
+    Runs items through three stages connected by bounded queues:
+        fetch(item) -> output		in fetchWorkers threads (I/O)
+        parse(output) -> result	in parseWorkers processes (CPU), or
+                                        threads if parseProcesses is False
+        sink(item, result)		in the thread calling run()
+    so downloading, parsing, and writing all happen at the same time.
+    A stage that gets ahead blocks when the queue to the next stage is full
+        (backpressure), so at most about queueSize items are waiting
+        between stages.
+    If ordered, sink() gets the items in the order given, else as they are
+        parsed. Items that are parsed early wait for the ones before them,
+        but at most reorderWindow items are fed in before the next item in
+        order is sunk, so a slow item does not let the others pile up.
+    parse must be picklable for processes: a module level function or a
+        functools.partial of one.
+    If a stage raises an exception, the pipeline stops and run() raises it.
+    run() returns per-stage stats: for 'fetch', 'parse', 'sink':
+        'items', 'busySeconds' (in the stage function, summed over its
+        workers), 'blockedSeconds' (waiting for room downstream),
+        'idleSeconds' (waiting for input), 'itemsPerSec' (over the run),
+        and for 'fetch', 'bytes' (of output). Plus 'seconds' for the run.
+    """
+    STAGES = ('fetch', 'parse', 'sink')
+    POLL = 0.1			# seconds between checks for a stopped pipeline
+
+    def __init__(self,
+                fetch,		# function(item) -> output
+                parse,		# function(output) -> result
+                sink,		# function(item, result)
+                fetchWorkers=3,	# num of fetch threads
+                parseWorkers=2,	# num of parse processes (or threads)
+                parseProcesses=True,	# False = parse in threads
+                queueSize=4,	# max num of items waiting between stages
+                ordered=True,	# sink items in the order given
+                reorderWindow=None,	# max items in progress if ordered,
+                                # None = max(queueSize, fetch+parse workers)
+                ):
+        self.fetch = fetch
+        self.parse = parse
+        self.sink = sink
+        self.fetchWorkers = max(1, fetchWorkers)
+        self.parseWorkers = max(1, parseWorkers)
+        self.parseProcesses = parseProcesses
+        self.queueSize = queueSize
+        self.ordered = ordered
+        if reorderWindow == None:
+            reorderWindow = max(queueSize, self.fetchWorkers+self.parseWorkers)
+        self.reorderWindow = max(1, reorderWindow)
+    #------------------------
+
+    def run(self, items,	# iterable of items to fetch
+        ):
+        """ Run all the items through the pipeline, return stats dict """
+        self.stop = threading.Event()
+        self.errors = []
+        self.statsLock = threading.Lock()
+        self.stats = {stage: {'items': 0, 'busySeconds': 0.0,
+                        'blockedSeconds': 0.0, 'idleSeconds': 0.0}
+                                                    for stage in self.STAGES}
+        self.stats['fetch']['bytes'] = 0
+        self.window = threading.Semaphore(self.reorderWindow)
+        self.maxHeld = 0		# most items waiting in the sink for order
+        fetchQ = queue.Queue(self.queueSize)	# (seq, item)
+        parseQ = queue.Queue(self.queueSize)	# (seq, item, output)
+        sinkQ  = queue.Queue(self.queueSize)	# (seq, item, result)
+        self.workersLeft = {'fetch': self.fetchWorkers,
+                            'parse': self.parseWorkers}
+        executor = None
+        if self.parseProcesses:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                                                max_workers=self.parseWorkers)
+        startTime = time.time()
+        threads = [threading.Thread(target=self._feed, args=(items, fetchQ))]
+        threads += [threading.Thread(target=self._fetchWorker,
+                        args=(fetchQ, parseQ)) for i in range(self.fetchWorkers)]
+        threads += [threading.Thread(target=self._parseWorker,
+                        args=(parseQ, sinkQ, executor))
+                        for i in range(self.parseWorkers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            self._sinkAll(sinkQ)
+        except BaseException as e:	# incl. KeyboardInterrupt
+            self.errors.append(e)
+        self.stop.set()
+        for t in threads:
+            t.join()
+        if executor != None:
+            executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+        elapsed = time.time() - startTime
+        for stage in self.STAGES:
+            self.stats[stage]['itemsPerSec'] = \
+                                self.stats[stage]['items'] / max(elapsed, 1e-9)
+        self.stats['seconds'] = elapsed
+        return self.stats
+    #------------------------
+
+    def _put(self, stage, q, x):
+        """ Put x on q, waiting for room unless the pipeline stops """
+        startTime = time.time()
+        while True:
+            if self.stop.is_set():
+                raise PipelineStopped()
+            try:
+                q.put(x, timeout=self.POLL)
+                break
+            except queue.Full:
+                pass
+        self._count(stage, 'blockedSeconds', time.time() - startTime)
+    #------------------------
+
+    def _get(self, stage, q):
+        """ Return the next thing on q, unless the pipeline stops """
+        startTime = time.time()
+        while True:
+            if self.stop.is_set():
+                raise PipelineStopped()
+            try:
+                x = q.get(timeout=self.POLL)
+                break
+            except queue.Empty:
+                pass
+        self._count(stage, 'idleSeconds', time.time() - startTime)
+        return x
+    #------------------------
+
+    def _count(self, stage, stat, value):
+        with self.statsLock:
+            self.stats[stage][stat] += value
+    #------------------------
+
+    def _runStage(self, target, *args):
+        """ Run a stage thread function, stopping the pipeline if it fails
+        """
+        try:
+            target(*args)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+    #------------------------
+
+    def _feed(self, items, fetchQ):
+        def feed():
+            for seq, item in enumerate(items):
+                if self.ordered:
+                    self._acquireWindow()
+                self._put('fetch', fetchQ, (seq, item))
+            for i in range(self.fetchWorkers):
+                self._put('fetch', fetchQ, None)	# no more items
+        self._runStage(feed)
+    #------------------------
+
+    def _acquireWindow(self):
+        """ Wait for room in the reorder window, unless the pipeline stops
+        """
+        startTime = time.time()
+        while not self.window.acquire(timeout=self.POLL):
+            if self.stop.is_set():
+                raise PipelineStopped()
+        self._count('fetch', 'blockedSeconds', time.time() - startTime)
+    #------------------------
+
+    def _fetchWorker(self, fetchQ, parseQ):
+        def work():
+            while True:
+                x = self._get('fetch', fetchQ)
+                if x == None:
+                    break
+                seq, item = x
+                startTime = time.time()
+                output = self.fetch(item)
+                self._count('fetch', 'busySeconds', time.time() - startTime)
+                self._count('fetch', 'items', 1)
+                self._count('fetch', 'bytes', len(output))
+                self._put('fetch', parseQ, (seq, item, output))
+            self._lastWorker('fetch', parseQ, self.parseWorkers)
+        self._runStage(work)
+    #------------------------
+
+    def _parseWorker(self, parseQ, sinkQ, executor):
+        def work():
+            while True:
+                x = self._get('parse', parseQ)
+                if x == None:
+                    break
+                seq, item, output = x
+                startTime = time.time()
+                if executor != None:
+                    result = executor.submit(self.parse, output).result()
+                else:
+                    result = self.parse(output)
+                self._count('parse', 'busySeconds', time.time() - startTime)
+                self._count('parse', 'items', 1)
+                self._put('parse', sinkQ, (seq, item, result))
+            self._lastWorker('parse', sinkQ, 1)
+        self._runStage(work)
+    #------------------------
+
+    def _lastWorker(self, stage, q, numEnds):
+        """ A stage worker is done. If it is the last one, put numEnds
+            end markers on the next stage's queue
+        """
+        with self.statsLock:
+            self.workersLeft[stage] -= 1
+            last = self.workersLeft[stage] == 0
+        if last:
+            for i in range(numEnds):
+                self._put(stage, q, None)
+    #------------------------
+
+    def _sinkAll(self, sinkQ):
+        held = {}		# seq -> (item, result) that came early
+        nextSeq = 0
+        while True:
+            try:
+                x = self._get('sink', sinkQ)
+            except PipelineStopped:	# another stage failed
+                return
+            if x == None:
+                break
+            seq, item, result = x
+            held[seq] = (item, result)
+            self.maxHeld = max(self.maxHeld, len(held))
+            while (nextSeq in held) if self.ordered else held:
+                if self.ordered:
+                    item, result = held.pop(nextSeq)
+                    nextSeq += 1
+                else:
+                    item, result = held.popitem()[1]
+                startTime = time.time()
+                self.sink(item, result)
+                if self.ordered:
+                    self.window.release()
+                self._count('sink', 'busySeconds', time.time() - startTime)
+                self._count('sink', 'items', 1)
+    #------------------------
+
+# end class Pipeline -------------------------
+
+def runResultsPipeline(db,	# eutils db name ('pubmed', 'pmc', ...)
+                webenvURLParams,
+                count,		# number of results in the result set
+                sink,		# function(retstart, parsed page)
+                parse=None,	# function(output) -> parsed page. Must be
+                                #  picklable if parseProcesses.
+                                #  None = splitRecords() for db/op/retmode
+                op='summary',	# 'summary' or 'fetch' output
+                retmode='xml',	# eutils desired output format
+                rettype=None,	# eutils rettype option
+                version='2.0',	# eutils output version (affects json?)
+                pageSize=None,	# num of results per page (request)
+                                # None means the eutils max for retmode
+                fetchWorkers=3,	# max num of pages to fetch concurrently
+                parseWorkers=2,	# num of parse processes (or threads)
+                parseProcesses=True,	# False = parse in threads
+                queueSize=4,	# max num of pages waiting between stages
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+    ):
+    """ Walk the result set on the history server in retstart/retmax pages
+            (like iterResultPages()) through a Pipeline: pages are fetched,
+            parsed, and passed to sink() (in retstart order) concurrently.
+        Return the Pipeline stats.
+    """
+    maxPage = JSON_RETMAX if retmode == 'json' else XML_RETMAX
+    if pageSize == None or pageSize <= 0 or pageSize > maxPage:
+        pageSize = maxPage
+    if parse == None:
+        parse = functools.partial(splitRecords, db, op=op, retmode=retmode,
+                                                            rettype=rettype)
+    def fetch(retstart):
+        return getResults(db, webenvURLParams, op=op, retmode=retmode,
+                            rettype=rettype, version=version, retmax=pageSize,
+                            retstart=retstart, URLReader=URLReader, debug=debug)
+
+    pipeline = Pipeline(fetch, parse, sink, fetchWorkers=fetchWorkers,
+                            parseWorkers=parseWorkers,
+                            parseProcesses=parseProcesses, queueSize=queueSize)
+    stats = pipeline.run(range(0, count, pageSize))
+    if debug: sys.stderr.write("Pipeline stats: %s\n" % json.dumps(stats))
+    return stats
+# -------------------------
+
+# -------------------------
+# History server sessions
+# -------------------------
+
+class EutilsSession (object):
+    """
+    Keeps one webenv on the eutils history server for a job, instead of a
+        new webenv per doSearch()/doPost().
+    search(), post() and combine() each add a result set (query_key) to the
+        webenv and return its key. combine() runs an esearch over earlier
+        keys (e.g., '#1 AND #2') so intersections/unions happen on the
+        server instead of downloading both sets.
+    The history server drops webenvs that have not been used for a while.
+        We remember how each key was made, and if the webenv has been idle
+        longer than maxIdle seconds (or the server says it does not know
+        the webenv), a new webenv is made by redoing the steps in the same
+        order, so the keys (and '#n' references to them) stay the same.
+    """
+    def __init__(self,
+                db,		# eutils db name ('pubmed', 'pmc', ...)
+                maxIdle=3600,	# seconds of non-use after which we assume
+                                #  the history server dropped our webenv
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+                ):
+        self.db = db
+        self.maxIdle = maxIdle
+        self.URLReader = URLReader
+        self.debug = debug
+        self.webenv = None	# current webenv, None = none yet
+        self.lastUsed = 0.0	# time webenv was last used
+        self.steps = []		# [(kind, what)] for each query_key, in order
+                                #   kind is 'search' or 'post'
+        self.counts = {}	# query_key (str) -> count (searches only)
+        self.numRecreated = 0	# num of times we made a new webenv
+    #------------------------
+
+    def search(self, queryString):
+        """ esearch queryString into the session's webenv
+            Return (count, query_key)
+        """
+        key = self._doStep('search', queryString)
+        return self.counts[key], key
+    #------------------------
+
+    def combine(self, expression):
+        """ esearch an expression over earlier query_keys, e.g., '#1 AND #2'
+            Return (count, query_key)
+        """
+        return self.search(urllib.parse.quote_plus(expression))
+    #------------------------
+
+    def post(self, ids):
+        """ epost ids into the session's webenv. Return query_key """
+        return self._doStep('post', normalizeIDs(ids))
+    #------------------------
+
+    def getResults(self, queryKey, **kwargs):
+        """ Return getResults() output for queryKey (str or int).
+            kwargs are passed to getResults() (op, retmode, retmax, ...)
+        """
+        kwargs.setdefault('URLReader', self.URLReader)
+        kwargs.setdefault('debug', self.debug)
+        self._checkExpired()
+        output = getResults(self.db, self.getWebenvURLParams(queryKey),
+                                                                    **kwargs)
+        if isHistoryError(output):		# server dropped our webenv
+            self._recreate()
+            output = getResults(self.db, self.getWebenvURLParams(queryKey),
+                                                                    **kwargs)
+        self.lastUsed = time.time()
+        return output
+    #------------------------
+
+    def getWebenvURLParams(self, queryKey):
+        """ Return webenv/query_key for queryKey as eutils URL params """
+        return codeWebenvURLParams(self.webenv, queryKey)
+    #------------------------
+
+    def _doStep(self, kind, what):
+        self._checkExpired()
+        try:
+            key = self._runStep(kind, what)
+        except HistoryError:
+            if self.webenv == None:
+                raise
+            self._recreate()		# the webenv was dropped
+            key = self._runStep(kind, what)
+        self.steps.append( (kind, what) )
+        return key
+    #------------------------
+
+    def _runStep(self, kind, what):
+        """ Run one search/post step in self.webenv, return its query_key """
+        if kind == 'search':
+            count, webenvURLParams = doSearch(self.db, what, webenv=self.webenv,
+                            URLReader=self.URLReader, debug=self.debug)
+        else:
+            count = None
+            webenvURLParams = doPost(self.db, what, webenv=self.webenv,
+                            URLReader=self.URLReader, debug=self.debug)
+        self.webenv, key = decodeWebenvURLParams(webenvURLParams)
+        if count != None:
+            self.counts[key] = count
+        self.lastUsed = time.time()
+        return key
+    #------------------------
+
+    def _checkExpired(self):
+        if self.webenv != None and time.time() - self.lastUsed > self.maxIdle:
+            self._recreate()
+    #------------------------
+
+    def _recreate(self):
+        """ Start a new webenv and redo all the steps in it """
+        if self.debug: sys.stderr.write("Recreating webenv\n")
+        self.webenv = None
+        self.counts = {}
+        self.numRecreated += 1
+        for kind, what in self.steps:
+            self._runStep(kind, what)
+    #------------------------
+
+# end class EutilsSession -------------------------
+
+class HistoryError (Exception):
+    """ Raised when eutils says a webenv/query_key is not on the history
+        server (anymore), see isHistoryError()
+    """
+    pass
+# -------------------------
+
+# lowercase eutils error messages that mean the history server does not know
+#  the webenv or query_key
+HISTORY_ERRORS = [b'unable to obtain query #',
+                b'invalid webenv',
+                b'webenv is expired',
+                b'cannot retrieve query from history',
+                ]
+
+def isHistoryError(output,	# eutils output (bytes)
+    ):
+    """ Return True if eutils output is an error saying the webenv/query_key
+        is not on the history server (anymore)
+    """
+    start = output[:2000].lower()
+    if b'<error>' not in start and b'"error"' not in start:
+        return False
+    for message in HISTORY_ERRORS:
+        if message in start:
+            return True
+    return False
+# -------------------------
+
+def getErrorClass(output,	# eutils output (bytes) w/ an error
+    ):
+    """ Return the exception class to raise for an eutils error """
+    if isHistoryError(output):
+        return HistoryError
+    return Exception
+# -------------------------
+
+# -------------------------
+# Incremental harvesting
+# -------------------------
+SEARCH_MAX_RESULTS = 10000	# eutils won't page past this many results
+                                #   of one search
+FIRST_DATE = datetime.date(1800, 1, 1)	# default start of 1st harvest
+
+def getDateParams(datetype,	# 'edat', 'mdat', 'pdat'
+                mindate,	# datetime.date, 1st day of the window
+                maxdate,	# datetime.date, last day of the window
+    ):
+    """ Return esearch URL params limiting the search to the date window
+    """
+    return "&datetype=%s&mindate=%s&maxdate=%s" % (datetype,
+                    mindate.strftime('%Y/%m/%d'), maxdate.strftime('%Y/%m/%d'))
+# -------------------------
+
+def iterDateWindows(db,		# eutils db name ('pubmed', 'pmc', ...)
+                queryString,	# esearch query string
+                mindate,	# datetime.date, 1st day to search
+                maxdate,	# datetime.date, last day to search
+                datetype='edat',	# 'edat', 'mdat', 'pdat'
+                maxCount=SEARCH_MAX_RESULTS,	# max results per window
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+    ):
+    """ Generator: search queryString in date windows covering mindate to
+            maxdate (in date order), each with at most maxCount results.
+        A window with too many results is split in half (and so on).
+        Yields (mindate, maxdate, count, webenvURLParams) for windows w/
+            results.
+    """
+    windows = [(mindate, maxdate)]	# stack, next window at the end
+    while windows:
+        lo, hi = windows.pop()
+        count, webenvURLParams = doSearch(db,
+                        queryString + getDateParams(datetype, lo, hi),
+                        URLReader=URLReader, debug=debug)
+        if count > maxCount:
+            if lo == hi:
+                raise Exception("%d results on %s, can only get %d\n" \
+                                                        % (count, lo, maxCount))
+            mid = lo + (hi - lo) // 2
+            if debug: sys.stderr.write("Splitting %s-%s: %d results\n" \
+                                                            % (lo, hi, count))
+            windows.append( (mid + datetime.timedelta(days=1), hi) )
+            windows.append( (lo, mid) )
+        elif count > 0:
+            yield lo, hi, count, webenvURLParams
+# -------------------------
+
+class Harvester (object):
+    """
+    Incremental harvesting of esearch results.
+    For each (db, datetype, queryString), a sqlite file keeps a high-water
+        mark (the last day harvested) and a digest of each record harvested.
+    harvest() only searches from the mark through today, and yields only
+        the records that are new or have changed since they were harvested.
+    Dates in eutils are days, so the mark day itself is searched again,
+        the digests weed out the records already harvested.
+    Use datetype 'mdat' to also get records that were modified, 'edat'
+        for only newly added records.
+    """
+    def __init__(self,
+                dbFile,		# sqlite file name, ':memory:' = no file
+                db='pubmed',	# eutils db name ('pubmed', 'pmc', ...)
+                datetype='mdat',	# 'edat', 'mdat', 'pdat'
+                maxCount=SEARCH_MAX_RESULTS,	# max results per window
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+                ):
+        self.db = db
+        self.datetype = datetype
+        self.maxCount = maxCount
+        self.URLReader = URLReader
+        self.debug = debug
+        self.conn = sqlite3.connect(dbFile, timeout=60)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS marks ' +
+                    '(harvest TEXT PRIMARY KEY, mark TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS digests ' +
+                    '(harvest TEXT, id TEXT, format TEXT, digest TEXT, ' +
+                    'PRIMARY KEY (harvest, id, format))')
+    #------------------------
+
+    def _harvestKey(self, queryString):
+        return '%s/%s/%s' % (self.db, self.datetype, queryString)
+    #------------------------
+
+    def getMark(self, queryString):
+        """ Return the last day harvested (datetime.date) or None """
+        row = self.conn.execute('SELECT mark FROM marks WHERE harvest=?',
+                                [self._harvestKey(queryString)]).fetchone()
+        if row == None:
+            return None
+        return datetime.datetime.strptime(row[0], '%Y/%m/%d').date()
+    #------------------------
+
+    def setMark(self, queryString, mark):
+        """ Set the last day harvested (datetime.date) """
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO marks VALUES (?, ?)',
+                    [self._harvestKey(queryString), mark.strftime('%Y/%m/%d')])
+    #------------------------
+
+    def harvest(self, queryString,
+                op='fetch',	# 'summary' or 'fetch' output
+                retmode='xml',	# eutils desired output format
+                rettype=None,	# eutils rettype option
+                version='2.0',	# eutils output version (affects json?)
+                since=None,	# datetime.date to start at if no mark yet
+                until=None,	# datetime.date to stop at, None = today
+                numWorkers=3,	# max num of pages to fetch concurrently
+                ):
+        """ Generator: (id, record) for new & changed records (see
+                splitRecords()).
+            The mark moves to 'until' after the last record is yielded, so
+                an interrupted harvest is redone (from the old mark) next time.
+        """
+        key = self._harvestKey(queryString)
+        format = '%s/%s/%s/%s' % (op, retmode, rettype, version)
+        mindate = self.getMark(queryString) or since or FIRST_DATE
+        maxdate = until or datetime.date.today()
+
+        for lo, hi, count, webenvURLParams in iterDateWindows(self.db,
+                        queryString, mindate, maxdate, datetype=self.datetype,
+                        maxCount=self.maxCount, URLReader=self.URLReader,
+                        debug=self.debug):
+            if self.debug: sys.stderr.write("Harvesting %s-%s: %d results\n"\
+                                                            % (lo, hi, count))
+            for start, output in iterResultPages(self.db, webenvURLParams,
+                        count, op=op, retmode=retmode, rettype=rettype,
+                        version=version, numWorkers=numWorkers,
+                        URLReader=self.URLReader, debug=self.debug):
+                records = splitRecords(self.db, output, op=op,
+                                            retmode=retmode, rettype=rettype)
+                changed = self._getChanged(key, format, records)
+                for uid, digest in changed:
+                    yield uid, records[uid]
+                with self.conn:
+                    self.conn.executemany('INSERT OR REPLACE INTO digests ' +
+                        'VALUES (?, ?, ?, ?)',
+                        [(key, uid, format, digest) for uid, digest in changed])
+        self.setMark(queryString, maxdate)
+    #------------------------
+
+    def _getChanged(self, key, format, records):
+        """ Return [(id, digest)] for records (dict id -> bytes) that are
+            new or different from when they were last harvested
+        """
+        digests = {}
+        ids = list(records.keys())
+        for i in range(0, len(ids), 500):	# sqlite max num of params
+            batch = ids[i:i+500]
+            sql = 'SELECT id, digest FROM digests WHERE harvest=? AND ' \
+                    + 'format=? AND id IN (%s)' % ','.join(['?'] * len(batch))
+            digests.update(self.conn.execute(sql, [key, format] + batch))
+        changed = []
+        for uid, rcd in records.items():
+            digest = hashlib.sha1(rcd).hexdigest()
+            if digests.get(uid) != digest:
+                changed.append( (uid, digest) )
+        return changed
+    #------------------------
+
+    def close(self):
+        self.conn.close()
+    #------------------------
+
+# end class Harvester -------------------------
+
+# -------------------------
+# ID conversion: PMID <-> PMCID <-> DOI
+# -------------------------
+IDMapping = collections.namedtuple('IDMapping', 'pmid pmcid doi')
+                                # str IDs, None if the article has none
+
+def getIDType(id,		# pmid, pmcid or doi (str or int)
+    ):
+    """ Return (idtype, normalized id): idtype is 'pmid', 'pmcid', or 'doi'.
+        PMCIDs are normalized to upper case 'PMC...', DOIs to lower case.
+    """
+    id = str(id).strip()
+    if id[:3].upper() == 'PMC':
+        return 'pmcid', 'PMC' + id[3:]
+    if id.isdigit():
+        return 'pmid', id
+    return 'doi', id.lower()
+# -------------------------
+
+def getIDConverterURL(ids,	# list of normalized IDs, all of idtype
+                idtype,		# 'pmid', 'pmcid', 'doi'
+    ):
+    return ID_CONVERTER_URL + '?ids=%s&idtype=%s&format=json' % \
+            (','.join([urllib.parse.quote(id, safe='') for id in ids]), idtype)
+# -------------------------
+
+def parseIDConverterOutput(output,	# ID converter json output (bytes)
+    ):
+    """ Return list of IDMappings for the articles found in the output
+    """
+    mappings = []
+    for rcd in json.loads(output).get('records', []):
+        if rcd.get('status') == 'error':	# unknown ID
+            continue
+        pmid, pmcid, doi = [rcd.get(f) for f in ('pmid', 'pmcid', 'doi')]
+        mappings.append(IDMapping(pmid and str(pmid), pmcid,
+                                                        doi and doi.lower()))
+    return mappings
+# -------------------------
+
+class IDIndex (object):
+    """
+    Persistent (sqlite) index of IDMappings, so IDs only need to be
+        converted once. Each mapping is indexed under each of its IDs, so
+        it can be looked up by pmid, pmcid, or doi.
+    IDs the ID converter does not know are kept too (mapping of all None),
+        so they are not asked about again.
+    Can be shared by threads, and by processes (sqlite locks the file).
+    """
+    def __init__(self,
+                dbFile,		# sqlite file name, ':memory:' = no file
+                ):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbFile, timeout=60,
+                                                check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS ids ' +
+                    '(id TEXT PRIMARY KEY, pmid TEXT, pmcid TEXT, doi TEXT)')
+    #------------------------
+
+    def getMany(self, ids,	# list of normalized IDs (see getIDType())
+        ):
+        """ Return dict mapping ids found in the index to their IDMappings
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(ids), 500):	# sqlite max num of params
+                batch = ids[i:i+500]
+                sql = 'SELECT id, pmid, pmcid, doi FROM ids WHERE id IN (%s)' \
+                                                % ','.join(['?'] * len(batch))
+                for row in self.conn.execute(sql, batch):
+                    found[row[0]] = IDMapping(*row[1:])
+        return found
+    #------------------------
+
+    def putMany(self, mappings,	# list of IDMappings
+                notFound=[],	# list of normalized IDs w/ no mapping
+        ):
+        rows = [(id, None, None, None) for id in notFound]
+        for m in mappings:
+            rows += [(id, m.pmid, m.pmcid, m.doi) for id in m if id != None]
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO ids ' +
+                                                    'VALUES (?, ?, ?, ?)', rows)
+    #------------------------
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+    #------------------------
+
+# end class IDIndex -------------------------
+
+def convertIDs(ids,		# list of pmids, pmcids, dois (can be mixed)
+                index=None,	# IDIndex to use & add to, None = no index
+                batchSize=ID_CONVERTER_MAX,	# num of IDs per request
+                numWorkers=3,	# max num of requests in progress at once
+                URLReader=surl.ThrottledURLReader(),
+                debug=False,
+    ):
+    """ Return dict mapping each ID (str, as given) to its IDMapping, or to
+            None if the ID converter does not know it.
+        IDs in the index are looked up there, the others are sent to the
+            ID converter in batches (one idtype per batch). Up to numWorkers
+            batches are requested at once, throttled by the shared URLReader.
+            Their mappings are added to the index.
+    """
+    normIds = collections.OrderedDict()		# given ID -> (idtype, norm id)
+    for id in ids:
+        normIds[str(id)] = getIDType(id)
+
+    mappings = index.getMany([n for t, n in normIds.values()]) \
+                                                if index != None else {}
+    misses = collections.OrderedDict()		# idtype -> [normalized IDs]
+    for idtype, id in collections.OrderedDict.fromkeys(normIds.values()):
+        if id not in mappings:
+            misses.setdefault(idtype, []).append(id)
+    batches = [(idtype, m[i:i+batchSize]) for idtype, m in misses.items()
+                                        for i in range(0, len(m), batchSize)]
+    if debug: sys.stderr.write("%d IDs from index, %d batches to convert\n" \
+                                % (len(mappings), len(batches)))
+
+    def convertBatch(idtype, batch):
+        output = URLReader.readURL(getIDConverterURL(batch, idtype))
+        found = {}
+        for m in parseIDConverterOutput(output):
+            found[getattr(m, idtype)] = m
+        return found, [id for id in batch if id not in found]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(numWorkers, 1))\
+                                                                as executor:
+        futures = [executor.submit(convertBatch, idtype, batch)
+                                                for idtype, batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            found, notFound = future.result()
+            if index != None:
+                index.putMany(list(found.values()), notFound)
+            mappings.update(found)
+
+    results = {}
+    for id, (idtype, normId) in normIds.items():
+        m = mappings.get(normId)
+        results[id] = m if m != None and any(m) else None
+    return results
+# -------------------------
+
+# -------------------------
+# Typed esummary records
+# -------------------------
+
+class SummaryRecord (object):
+    """
+    The commonly used fields of one esummary record (pubmed or pmc).
+    Uses __slots__, so it is much smaller than the json dict or xml element.
+    Compares and hashes by value, so can be used in sets and as dict keys.
+        uid     : int, the esummary uid: the pmid for db=pubmed, the PMC
+                    uid (the pmcid w/o "PMC") for db=pmc
+        title   : str
+        journal : str (the journal abbreviation, esummary "Source")
+        pubdate : str (as esummary gives it, e.g., "2017 Feb")
+        authors : tuple of author names (str)
+        doi     : str, or None
+    """
+    __slots__ = ('uid', 'title', 'journal', 'pubdate', 'authors', 'doi')
+
+    def __init__(self, uid, title, journal, pubdate, authors, doi):
+        self.uid     = uid
+        self.title   = title
+        self.journal = journal
+        self.pubdate = pubdate
+        self.authors = authors
+        self.doi     = doi
+
+    def toDict(self):
+        return dict([(f, getattr(self, f)) for f in self.__slots__])
+
+    def __eq__(self, other):
+        return isinstance(other, SummaryRecord) and \
+                                        self.toDict() == other.toDict()
+
+    def __hash__(self):
+        return hash(tuple([getattr(self, f) for f in self.__slots__]))
+
+    def __repr__(self):
+        return 'SummaryRecord(%s)' % \
+                    ', '.join(['%s=%r' % (f, getattr(self, f)) for f in
+                                                            self.__slots__])
+# end class SummaryRecord -------------------------
+
+class SummaryColumns (object):
+    """
+    A column-backed collection of SummaryRecords for large numbers of
+        summaries: uids are in an array of ints, journal and pubdate
+        strings are interned (shared), authors are stored as one string.
+        SummaryRecords are only built when you index or iterate.
+    toColumns() returns the fields as a dict of lists for bulk analysis.
+    """
+    AUTHOR_SEP = '|'
+
+    def __init__(self, records=[],	# SummaryRecords to start with
+                ):
+        self.uids     = array.array('q')
+        self.titles   = []
+        self.journals = []
+        self.pubdates = []
+        self.authors  = []
+        self.dois     = []
+        self.extend(records)
+
+    def append(self, rcd):
+        self.uids.append(rcd.uid)
+        self.titles.append(rcd.title)
+        self.journals.append(sys.intern(rcd.journal))
+        self.pubdates.append(sys.intern(rcd.pubdate))
+        self.authors.append(self.AUTHOR_SEP.join(rcd.authors))
+        self.dois.append(rcd.doi)
+
+    def extend(self, records):
+        for rcd in records:
+            self.append(rcd)
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __getitem__(self, i):
+        authors = self.authors[i]
+        authors = tuple(authors.split(self.AUTHOR_SEP)) if authors else ()
+        return SummaryRecord(self.uids[i], self.titles[i], self.journals[i],
+                                self.pubdates[i], authors, self.dois[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def toColumns(self):
+        """ Return dict mapping field names to lists of values """
+        return {'uid'    : self.uids.tolist(),
+                'title'  : list(self.titles),
+                'journal': list(self.journals),
+                'pubdate': list(self.pubdates),
+                'authors': [tuple(a.split(self.AUTHOR_SEP)) if a else ()
+                                                    for a in self.authors],
+                'doi'    : list(self.dois),
+                }
+# end class SummaryColumns -------------------------
+
+def parseSummaryJSON(output,	# esummary json output (bytes or str)
+    ):
+    """ Generator: yield a SummaryRecord for each esummary json record """
+    result = json.loads(output).get('result', {})
+    for uid in result.get('uids', []):
+        r = result[uid]
+        authors = tuple([a.get('name', '') for a in r.get('authors', [])
+                                    if a.get('authtype', 'Author') == 'Author'])
+        doi = None
+        for aid in r.get('articleids', []):
+            if aid.get('idtype') == 'doi':
+                doi = aid.get('value')
+                break
+        yield SummaryRecord(int(uid), r.get('title', ''), r.get('source', ''),
+                                    r.get('pubdate', ''), authors, doi)
+# -------------------------
+
+def parseSummaryXML(source,	# esummary xml output: bytes, or a file-like
+                                #  object, or iterable of bytes chunks
+    ):
+    """ Generator: yield a SummaryRecord for each esummary xml record
+            (v2.0 DocumentSummary or v1.0 DocSum).
+        Parses incrementally, see iterXMLRecords().
+    """
+    for rcd in iterXMLRecords(source, ('DocumentSummary', 'DocSum')):
+        if rcd.tag == 'DocumentSummary':		# version 2.0
+            authors = tuple([a.findtext('Name', '') for a in
+                                    rcd.findall('Authors/Author')
+                                    if a.findtext('AuthType', 'Author') ==
+                                                                    'Author'])
+            doi = None
+            for aid in rcd.findall('ArticleIds/ArticleId'):
+                if aid.findtext('IdType') == 'doi':
+                    doi = aid.findtext('Value')
+                    break
+            yield SummaryRecord(int(rcd.get('uid')), rcd.findtext('Title', ''),
+                                rcd.findtext('Source', ''),
+                                rcd.findtext('PubDate', ''), authors, doi)
+        else:						# version 1.0
+            items = {}
+            for item in rcd.findall('Item'):
+                items[item.get('Name')] = item
+            def text(name):
+                item = items.get(name)
+                return (item.text or '') if item != None else ''
+            authors = ()
+            if 'AuthorList' in items:
+                authors = tuple([a.text or '' for a in
+                                                items['AuthorList'].findall(
+                                                "Item[@Name='Author']")])
+            yield SummaryRecord(int(rcd.findtext('Id')), text('Title'),
+                                text('Source'), text('PubDate'), authors,
+                                text('DOI') or None)
+# -------------------------
+
+def parseSummary(output,	# esummary output (bytes)
+                retmode='xml',	# eutils output format: 'xml' or 'json'
+    ):
+    """ Return a SummaryColumns holding all the esummary records in output
+    """
+    if retmode == 'json':
+        return SummaryColumns(parseSummaryJSON(output))
+    return SummaryColumns(parseSummaryXML(output))
+# -------------------------
+
+def getPostSummaries(db,	# eutils db name ('pubmed', 'pmc', ...)
+                    ids,	# list of IDs to get summaries for
+                    retmode='xml',	# esummary format to request
+                    version='2.0',	# eutils output version
+                    URLReader=surl.ThrottledURLReader(),
+                    debug=False,
+    ):
+    """ Post the ids (in batches, see iterPostResults()) and return their
+            esummaries as a SummaryColumns.
+    """
+    summaries = SummaryColumns()
+    for batch, output, webenvURLParams in iterPostResults(db, ids,
+                            op='summary', retmode=retmode, version=version,
+                            URLReader=URLReader, debug=debug):
+        if retmode == 'json':
+            summaries.extend(parseSummaryJSON(output))
+        else:
+            summaries.extend(parseSummaryXML(output))
+    return summaries
+
+# -------------------------
+# Async versions
+#   Same params/return values as the functions above, but URLReader is a
+#   surl.AsyncURLReader and these are coroutines.
+#   Cancelling the calling task or hitting the URLReader timeout abandons
+#   the request (asyncio.CancelledError / asyncio.TimeoutError, neither is
+#   retried by the URLReader's RetryPolicy).
+# -------------------------
+
+async def doSearchAsync(db,	# eutils db name ('pubmed', 'pmc', ...)
+            queryString,	# esearch query string
+            URLReader=None,	# AsyncURLReader. None = a new default one
+            debug=False,
+    ):
+    """ async version of doSearch() """
+    if URLReader == None: URLReader = surl.AsyncURLReader()
+    url = getSearchURL(db, queryString)
+    if debug: sys.stderr.write( "Esearch URL:\n%s\n" % url)
+
+    outputX = await URLReader.readURL(url)
+    if debug: sys.stderr.write( "Output from Esearch:\n%s\n" % outputX)
+
+    return parseSearchOutput(outputX)
+# -------------------------
+
+async def doPostAsync(db,	# eutils db name ('pubmed', 'pmc', ...)
+            ids,		# list of IDs (str or bytes) to post
+            URLReader=None,	# AsyncURLReader. None = a new default one
+            debug=False,
+    ):
+    """ async version of doPost() """
+    if URLReader == None: URLReader = surl.AsyncURLReader()
+    params = getPostParams(db, ids)
+    if debug: sys.stderr.write( "Post Params: \n'%s'\n" % params[:200])
+
+    outputX = await URLReader.readURL(EPOST_BASE, params=params, GET=False)
+    if debug: sys.stderr.write( "Output from Epost:\n%s\n" % outputX[:100])
+
+    return parsePostOutput(outputX)
+# -------------------------
+
+async def getResultsAsync(db,	# eutils db name ('pubmed', 'pmc', ...)
+                webenvURLParams,
+                op='summary',	# 'summary' or 'fetch' output
+                retmode='xml',	# eutils desired output format
+                rettype=None,	# eutils rettype option
+                version='2.0',	# eutils output version (affects json?)
+                retmax=None,	# max number of results to return
+                retstart=0,	# index of 1st result to return (paging)
+                URLReader=None,	# AsyncURLReader. None = a new default one
+                debug=False,
+    ):
+    """ async version of getResults() """
+    if URLReader == None: URLReader = surl.AsyncURLReader()
+    url = getResultsURL(db, webenvURLParams, op=op, retmode=retmode,
+                    rettype=rettype, version=version, retmax=retmax,
+                    retstart=retstart)
+    if debug: sys.stderr.write( "Summary/Fetch URL:\n%s\n" % url )
+
+    return await URLReader.readURL(url)
+# -------------------------
+
+async def getSearchResultsAsync(db,	# eutils db name ('pubmed', 'pmc', ...)
+                    queryString,	# esearch query string
+                    op='summary',	# 'summary' or 'fetch' output
+                    retmode='xml',	# eutils desired output format
+                    rettype=None,	# eutils rettype option
+                    version='2.0',	# eutils output version (affects json?)
+                    retmax=10000,	# max number of results to return
+                    URLReader=None,	# AsyncURLReader. None = a new one
+                    debug=False,
+    ):
+    """ async version of getSearchResults() """
+    if URLReader == None: URLReader = surl.AsyncURLReader()
+    count, webenvURLParams = await doSearchAsync(db, queryString,
+                                URLReader=URLReader, debug=debug)
+
+    output = await getResultsAsync(db, webenvURLParams, op=op,
+                    retmode=retmode, rettype=rettype, version=version,
+                    retmax=retmax, URLReader=URLReader, debug=debug)
+    return count, output, webenvURLParams
+# -------------------------
+
+async def getPostResultsAsync(db,	# eutils db name ('pubmed', 'pmc', ...)
+                    ids,		# list of IDs to post and get results for
+                    op='summary',	# 'summary' or 'fetch' output
+                    retmode='xml',	# eutils desired output format
+                    rettype=None,	# eutils rettype option
+                    version='2.0',	# eutils output version (affects json?)
+                    URLReader=None,	# AsyncURLReader. None = a new one
+                    debug=False,
+    ):
+    """ async version of getPostResults() """
+    if URLReader == None: URLReader = surl.AsyncURLReader()
+    webenvURLParams = await doPostAsync(db, ids, URLReader=URLReader,
+                                                                debug=debug)
+
+    output = await getResultsAsync(db, webenvURLParams, op=op,
+                    retmode=retmode, rettype=rettype, version=version,
+                    URLReader=URLReader, debug=debug)
     return output, webenvURLParams
 
 # -------------------------
@@ -3,6 +3,8 @@
 # This module contains the definitions classes:
 #	TableDataSet
 #	TextFileTableDataSet
+#	LazyTextFileTableDataSet
+#	TDSRecordStream
 #	TableDataSetBucketizer
 #	TableDataSetBucketizerReporter
 #
@@ -11,12 +13,20 @@
 
 #import ignoreDeprecation
 #import sys
-#import os
+import os
 import string
 import types
+import array
+import mmap
+import itertools
+import cStringIO
+import multiprocessing
 
 DEBUG = 0
 
+BULK_CHUNK_SIZE = 8 * 1024 * 1024	# bytes of lines to read at a time in
+					#  TextFileTableDataSet.readRecordsBulk()
+
 #
 # Global functions that operate on TableDataSets and records of TableDataSets
 #
@@ -149,9 +159,15 @@ class TableDataSet:
 	name,			# printable name of this TableDataSet
 	fieldnames,		# list of field names in this TableDataSet
 	caseSensitive=0,	# =1 to make indexes case sensitive
-	multiValued = {}	# dict mapping fieldnames to delim string
+	multiValued = {},	# dict mapping fieldnames to delim string
 				#   for all multiValued fields
 				# Assumes the delim string is not empty.
+	columnTypes = None	# =None to keep each record as a dict.
+				# Else keep records in columns (see
+				#   TDSColumnStore), this dict maps fieldnames
+				#   to array typecodes for fields to keep in
+				#   typed arrays, e.g., {"count":"l"}
+				#   {} means no typed columns.
 	):
     # Purpose: constructor
     # Returns: nothing
@@ -163,10 +179,18 @@ class TableDataSet:
 				# the value each key is the delim string
 				# for the field.
 
-	self.records   = {}	# dict of rcds. Dict keys are record keys
+	if columnTypes == None:
+	    self.records = {}	# dict of rcds. Dict keys are record keys
+	else:			# column storage that acts like that dict
+	    self.records = TDSColumnStore(self.fieldnames, columnTypes)
 	self.nextkey   = 0	# record key to use for the next record
 	self.indexes   = {}	# dict w/ fieldname -> dict w/ value->
 				#  list of rcd keys
+	self.compactIndexes = columnTypes != None
+				# =1 to keep index values w/ one rcd key as
+				#  just the key, and w/ more keys as an
+				#  array of keys (instead of a list).
+				#  See addIndexKey()
 
 	self.caseSensitive = caseSensitive	# =1 if indexes and
 				#    index lookup are case sensitive
@@ -421,7 +445,8 @@ class TableDataSet:
 	indexValue = self.getIndexValue( inputValue)
 
 	if self.indexes[ fieldname].has_key( indexValue):	# have the key
-	    return self.sortKeys( self.indexes[ fieldname][indexValue][:], \
+	    return self.sortKeys( \
+			self.getIndexKeys( self.indexes[ fieldname][indexValue]), \
 				  sortField, cmpFunc)
 	else:
 	    return []
@@ -536,9 +561,21 @@ class TableDataSet:
 	    fields = [fieldnames]
 
         for fn in fields:
-	    self.indexes[fn] = {}
-	    for key in self.records.keys():
-		self.updateIndexForNewRecord( fn,key)
+	    index = {}
+	    multiValued = self.isMultiValued(fn)
+	    getIndexValue = self.getIndexValue
+	    if self.compactIndexes:
+		addIndexKey = self.addIndexKey
+	    else:			# plain lists of keys, skip the method call
+		addIndexKey = lambda index, value, key: \
+					index.setdefault( value, []).append( key)
+	    for key, values in self.getFieldItems( fn):
+		if not multiValued:
+		    values = [ values ]
+		for val in values:
+		    if val != None:	# we don't index "None" as a value
+			addIndexKey( index, getIndexValue( val), key)
+	    self.indexes[fn] = index
     # end addIndexes() ----------------------------------
     
     def hasIndex (self,
@@ -569,6 +606,60 @@ class TableDataSet:
 	return value
     # end getIndexValue() ----------------------------------
 
+    def addIndexKey (self,
+	index,		# dict for the index: value -> rcd key(s)
+	value,		# (index) value
+	key		# rcd key to add for the value
+        ):
+    # Purpose: add 'key' to the rcd keys for 'value' in 'index'
+    # Returns: nothing
+    # Effects: if self.compactIndexes, a value w/ one key maps to just the
+    #	       key and a value w/ more keys to an array of keys, else a value
+    #	       maps to a list of keys. Use getIndexKeys() to get the list.
+    #	       compact index values are interned.
+	if not index.has_key( value):
+	    if self.compactIndexes:
+		index[ intern(value)] = key
+	    else:
+		index[ value] = [ key]
+	else:
+	    keys = index[ value]
+	    if type(keys) == types.IntType:	# 2nd key for this value
+		index[ value] = array.array('l', [keys, key])
+	    else:
+		keys.append( key)
+    # end addIndexKey() ----------------------------------
+
+    def removeIndexKey (self,
+	index,		# dict for the index: value -> rcd key(s)
+	value,		# (index) value
+	key		# rcd key to remove for the value
+        ):
+    # Purpose: remove 'key' from the rcd keys for 'value' in 'index'
+    # Returns: nothing
+    # Effects: removes 'value' from the index if 'key' was its last key
+	if index.has_key( value):
+	    keys = index[ value]
+	    if type(keys) == types.IntType:
+		if keys == key:
+		    del index[ value]
+	    else:
+		keys.remove( key)
+		if len(keys) == 0:	# last one
+		    del index[ value]
+		elif len(keys) == 1 and self.compactIndexes:
+		    index[ value] = keys[0]
+    # end removeIndexKey() ----------------------------------
+
+    def getIndexKeys (self,
+	keys		# the rcd key(s) for a value in an index
+        ):
+    # Purpose: return a (new) list of the rcd keys for an index value
+	if type(keys) == types.IntType:
+	    return [ keys]
+	return list( keys)
+    # end getIndexKeys() ----------------------------------
+
     def updateIndexesForNewRecord (self,
         key
         ):
@@ -602,12 +693,7 @@ class TableDataSet:
 
 	    if val != None:	# we don't index "None" as a value
 		value = self.getIndexValue( val)
-		if self.indexes[fieldname].has_key( value):
-		    # add key to list
-		    self.indexes[fieldname][value].append( key)
-		else:
-		    # start list
-		    self.indexes[fieldname][value] = [ key]
+		self.addIndexKey( self.indexes[fieldname], value, key)
 
     # end updateIndexForNewRecord() ----------------------------------
 
@@ -646,10 +732,7 @@ class TableDataSet:
 	for val in values:
 	    if val != None:
 		value = self.getIndexValue( val)
-		if self.indexes[fieldname].has_key( value):
-		    self.indexes[fieldname][value].remove( key)
-		    if len(self.indexes[fieldname][value]) == 0: #last one
-			del self.indexes[fieldname][value]
+		self.removeIndexKey( self.indexes[fieldname], value, key)
 
     # end updateIndexForDeletedRecord() ----------------------------------
     
@@ -732,8 +815,9 @@ class TableDataSet:
 	for fn in fieldnames:
 	    finaldict[fn] = {}
 	    for value in self.indexes[fn].keys():
-		if len( self.indexes[fn][value]) > 1:
-		    finaldict[fn][value] = self.indexes[fn][value][:]
+		keys = self.getIndexKeys( self.indexes[fn][value])
+		if len( keys) > 1:
+		    finaldict[fn][value] = keys
 
 	return finaldict
     # end getDupsDict() ----------------------------------
@@ -760,48 +844,60 @@ class TableDataSet:
     # Assumes: if keys!=None, then every item in keys is a valid rcd key
     # Effects: sets self.sortField and self.cmpFunc.
 
-	encoding = 'utf-8'		# Unicode encoding to use,
-					# needs to become an instance var
 	if fieldnames == None:
 	    fieldnames = self.getFieldNames()
 
 	if headerline == 'y':
 	    self.printHeaders(fp, fieldnames, delim)
 
-	last = len( fieldnames) -1	# index of last field to print
 	for rcd in self.getRecords(keys, sortField, cmpFunc):
-	    i = 0			# index of field to print
-	    fieldDelim = delim		# the delim to write after a field
-	    while i < len( fieldnames):
-
-		fn = fieldnames[i]
-		if self.isMultiValued( fn):
-		    # this is what we did pre-Unicode issues (1/25/2012)
-		    #values = map(str, rcd[fn]) # convert all values to strings
-		    #value = string.join( values, self.multiValuedFields[fn])
-
-		    values = []		# list of values, converted to Unicode
-		    for v in rcd[fn]:
-			if type(v) != unicode:		# convert it
-			    v = str(v).decode( encoding)
-			values.append( v )
-
-		    # now, we can join all the unicode values
-		    value = string.join( values, self.multiValuedFields[fn])
-		else:	# single valued field
-		    value = rcd[fn]
-		    if value == None:
-			value = ''
-		if i == last:
-		    fieldDelim = '\n'	# use EOL for last field printed
-		if type(value) == unicode:	#must encode it first
-		    value = value.encode( encoding)
-		fp.write("%s%s" % (value, fieldDelim))
-
-		i = i+1
+	    fp.write( self.formatRecord( rcd, fieldnames, delim))
 	    
     # end printRecords() ----------------------------------
 
+    def formatRecord (self,
+	rcd,			# the rcd to format
+	fieldnames,		# list of fields to format
+	delim = '\t'		# field delim string
+        ):
+    # Purpose: format 'rcd' as a line for printRecords()
+    # Returns: string, the 'delim'ited values of 'fieldnames' ending in '\n'
+	encoding = 'utf-8'		# Unicode encoding to use,
+					# needs to become an instance var
+	line = []			# the pieces of the line
+	last = len( fieldnames) -1	# index of last field to print
+	i = 0				# index of field to print
+	fieldDelim = delim		# the delim to write after a field
+	while i < len( fieldnames):
+
+	    fn = fieldnames[i]
+	    if self.isMultiValued( fn):
+		# this is what we did pre-Unicode issues (1/25/2012)
+		#values = map(str, rcd[fn]) # convert all values to strings
+		#value = string.join( values, self.multiValuedFields[fn])
+
+		values = []		# list of values, converted to Unicode
+		for v in rcd[fn]:
+		    if type(v) != unicode:		# convert it
+			v = str(v).decode( encoding)
+		    values.append( v )
+
+		# now, we can join all the unicode values
+		value = string.join( values, self.multiValuedFields[fn])
+	    else:	# single valued field
+		value = rcd[fn]
+		if value == None:
+		    value = ''
+	    if i == last:
+		fieldDelim = '\n'	# use EOL for last field printed
+	    if type(value) == unicode:	#must encode it first
+		value = value.encode( encoding)
+	    line.append( "%s%s" % (value, fieldDelim))
+
+	    i = i+1
+	return string.join( line, '')
+    # end formatRecord() ----------------------------------
+
     def printHeaders (self,
 	 fp,			# open output file to write to
 	 fieldnames=None,	# list of fieldnames to write
@@ -833,6 +929,16 @@ class TableDataSet:
         return self.indexes[fieldname].keys()
     # end getValues() ----------------------------------
 
+    def getFieldItems (self,
+	fieldname	# the field to get the values of
+	):
+    # Purpose: return a list of (rcd key, value of fieldname) for all rcds
+    # Assumes: fieldname is a field of every rcd
+	if hasattr( self.records, 'getColumnItems'):	# column or lazy storage
+	    return self.records.getColumnItems( fieldname)
+	return [ (key, rcd[fieldname]) for key, rcd in self.records.items() ]
+    # end getFieldItems() ----------------------------------
+
     def getKeys (self):
     # Purpose: return the list of rcd keys in this TableDataSet
         return self.records.keys()
@@ -966,6 +1072,284 @@ class TDSRecord:
 
 # End class TDSRecord ---------------------------------------------------
 
+class TDSColumnStore:
+#
+# IS: the record storage of a TableDataSet created w/ columnTypes != None.
+#     It acts like the dict (rcd key -> rcd) that a TableDataSet normally
+#     keeps in self.records, so all the TableDataSet methods work unchanged.
+#
+# HAS: one column per field: a python list, or for fields in columnTypes,
+#	an array.array of that typecode (e.g., 'l' or 'd').
+#	A record's key is its row number in the columns, so keys are not
+#	  stored at all.
+#	String values (including the values of multiValued fields) are
+#	  interned, so repeated values (species, chromosomes...) are stored
+#	  once.
+#	Typed columns store None as a NULL value (the typecode's min int,
+#	  or NaN).
+#
+# DOES: add, replace, delete records (rows); get and set single values.
+#	Returns records as TDSRecordViews that act like record dicts.
+#	A record added is copied into the columns, so changing the dict
+#	  passed to addRecord() afterwards does not change the TableDataSet.
+#	Deleted rows keep their row numbers (keys are never reused), their
+#	  values are dropped.
+#
+    def __init__ (self,
+	fieldnames,		# list of field names (columns)
+	columnTypes		# dict mapping fieldnames to array typecodes
+				#   for fields to keep in typed arrays
+	):
+    # Purpose: constructor
+	self.fieldnames = fieldnames	# the TableDataSet's (same list)
+	self.columnTypes = columnTypes.copy()
+	self.columns = {}		# fieldname -> column
+	self.nulls = {}		# fieldname -> NULL value for typed columns
+	self.alive = bytearray()	# per row: 1 = a record, 0 = deleted
+	self.numRecords = 0
+	for fn in fieldnames:
+	    self.addColumn( fn)
+    # end __init__() class TDSColumnStore ------------------------------
+
+    def addColumn (self,
+	fieldname		# new field
+	):
+    # Purpose: add a column for fieldname, w/ None for all existing rows
+	typecode = self.columnTypes.get( fieldname)
+	if typecode == None:
+	    self.columns[fieldname] = [None] * len(self.alive)
+	else:
+	    if typecode in 'fd':
+		null = float('nan')
+	    else:
+		null = -(2 ** (8 * array.array(typecode).itemsize - 1))
+	    self.nulls[fieldname] = null
+	    self.columns[fieldname] = array.array(typecode, [null]) * \
+									len(self.alive)
+    # end addColumn() ----------------------------------
+
+    def toColumnValue (self,
+	fieldname,	# field the value is for
+	value		# value to store
+	):
+    # Purpose: return 'value' as it should be stored in fieldname's column
+	if self.nulls.has_key( fieldname):	# typed column
+	    if value == None:
+		return self.nulls[fieldname]
+	    elif self.columnTypes[fieldname] in 'fd':
+		return float(value)
+	    return int(value)
+	if type(value) == types.StringType:
+	    return intern(value)
+	if type(value) == types.ListType:
+	    return [ (type(v) == types.StringType and intern(v)) or v
+									for v in value ]
+	return value
+    # end toColumnValue() ----------------------------------
+
+    def getValue (self,
+	key,		# rcd key (row)
+	fieldname		# field to get the value of
+	):
+    # Purpose: return the value of fieldname for the rcd w/ 'key'
+    # Throws : KeyError if fieldname is not a field
+	if fieldname == '_rcdkey':
+	    return key
+	value = self.columns[fieldname][key]
+	if self.nulls.has_key( fieldname) and \
+			(value == self.nulls[fieldname] or value != value):
+	    return None
+	return value
+    # end getValue() ----------------------------------
+
+    def setValue (self,
+	key,		# rcd key (row)
+	fieldname,	# field to set, a new field gets a new column
+	value
+	):
+    # Purpose: set the value of fieldname for the rcd w/ 'key'
+	if fieldname == '_rcdkey':	# keys are implicit
+	    return
+	if not self.columns.has_key( fieldname):
+	    self.addColumn( fieldname)
+	self.columns[fieldname][key] = self.toColumnValue( fieldname, value)
+    # end setValue() ----------------------------------
+
+    def getColumnItems (self,
+	fieldname		# field to get the values of
+	):
+    # Purpose: return a list of (rcd key, value) for fieldname for all rcds
+	alive = self.alive
+	column = self.columns[fieldname]
+	if self.nulls.has_key( fieldname):
+	    return [ (k, self.getValue( k, fieldname)) for k in xrange(len(alive))
+										if alive[k] ]
+	return [ (k, column[k]) for k in xrange(len(alive)) if alive[k] ]
+    # end getColumnItems() ----------------------------------
+
+    def extend (self,
+	columns,	# dict mapping fieldnames to lists of values, all
+			#  numRows long. Fields not in it get None.
+	numRows	# num of rows (rcds) to add
+	):
+    # Purpose: add numRows rcds at the end, a column at a time
+    # Returns: the rcd key of the 1st rcd added
+	startKey = len(self.alive)
+	for fn in columns.keys():
+	    if not self.columns.has_key( fn) and fn != '_rcdkey':
+		self.addColumn( fn)
+	for fn, column in self.columns.items():
+	    values = columns.get( fn)
+	    if values == None:
+		values = [None] * numRows
+	    toColumnValue = self.toColumnValue
+	    column.extend( [ toColumnValue( fn, v) for v in values ])
+	self.alive.extend( '\x01' * numRows)
+	self.numRecords = self.numRecords + numRows
+	return startKey
+    # end extend() ----------------------------------
+
+    def isRecord (self, key):
+    # Purpose: return true if there is a (not deleted) rcd w/ 'key'
+	return type(key) in (types.IntType, types.LongType) and \
+					0 <= key < len(self.alive) and self.alive[key] == 1
+    # end isRecord() ----------------------------------
+
+    # dict methods ###############
+
+    def __getitem__ (self, key):
+	if not self.isRecord( key):
+	    raise KeyError( key)
+	return TDSRecordView( self, key)
+
+    def __setitem__ (self,
+	key,		# rcd key. Must be the next row or an existing one
+	rcd		# dict (or TDSRecordView) mapping fieldnames to values
+	):
+	if key == len(self.alive):	# new row at the end
+	    self.alive.append(1)
+	    for fn, column in self.columns.items():
+		column.append( self.toColumnValue( fn, rcd.get(fn)))
+	elif 0 <= key < len(self.alive):	# replace the row
+	    if not self.alive[key]:
+		self.alive[key] = 1
+		self.numRecords = self.numRecords -1 # added back below
+	    for fn in self.columns.keys():
+		self.setValue( key, fn, rcd.get(fn))
+	else:
+	    raise KeyError( "rcd key %s is past the next row" % str(key))
+	self.numRecords = self.numRecords +1
+	for fn in rcd.keys():	# fields the columns do not have yet
+	    if not self.columns.has_key( fn) and fn != '_rcdkey':
+		self.setValue( key, fn, rcd[fn])
+
+    def __delitem__ (self, key):
+	if not self.isRecord( key):
+	    raise KeyError( key)
+	self.alive[key] = 0
+	self.numRecords = self.numRecords -1
+	for fn in self.columns.keys():
+	    self.setValue( key, fn, None)
+
+    def has_key (self, key):
+	return self.isRecord( key)
+
+    def __contains__ (self, key):
+	return self.isRecord( key)
+
+    def __len__ (self):
+	return self.numRecords
+
+    def keys (self):
+	alive = self.alive
+	return [ k for k in xrange(len(alive)) if alive[k] ]
+
+    def __iter__ (self):
+	return iter( self.keys())
+
+    def values (self):
+	return [ TDSRecordView( self, k) for k in self.keys() ]
+
+    def items (self):
+	return [ (k, TDSRecordView( self, k)) for k in self.keys() ]
+
+# End class TDSColumnStore ------------------------------------------------
+
+class TDSRecordView:
+#
+# IS: a record in a TDSColumnStore that acts like a record dict:
+#	rcd["field"], rcd["field"] = value, rcd.has_key("field"),
+#	rcd.keys(), rcd.copy(), ...
+#
+# HAS: the store and the rcd key (row). It holds no values itself, they are
+#	read from (and written to) the store's columns when accessed.
+#
+# DOES: Like setting a field in a record dict, setting a field does NOT
+#	update the TableDataSet's indexes (use updateFields() for that).
+#	Every rcd in the store has every column, but like a record dict, a
+#	rcd only has the extra (non TableDataSet) fields, e.g., _linenumber,
+#	that are not None for it.
+#
+    def __init__ (self,
+	store,		# the TDSColumnStore
+	key		# the rcd key
+	):
+	self.store = store
+	self.key = key
+
+    def __getitem__ (self, fieldname):
+	return self.store.getValue( self.key, fieldname)
+
+    def __setitem__ (self, fieldname, value):
+	self.store.setValue( self.key, fieldname, value)
+
+    def has_key (self, fieldname):
+	store = self.store
+	return fieldname == '_rcdkey' or (store.columns.has_key( fieldname) and
+			(fieldname in store.fieldnames or
+					store.getValue( self.key, fieldname) != None))
+
+    def __contains__ (self, fieldname):
+	return self.has_key( fieldname)
+
+    def get (self, fieldname, default=None):
+	if self.has_key( fieldname):
+	    return self[fieldname]
+	return default
+
+    def keys (self):
+	return [ fn for fn in self.store.columns.keys() if self.has_key( fn) ] + \
+												['_rcdkey']
+
+    def __iter__ (self):
+	return iter( self.keys())
+
+    def __len__ (self):
+	return len(self.keys())
+
+    def values (self):
+	return [ self[fn] for fn in self.keys() ]
+
+    def items (self):
+	return [ (fn, self[fn]) for fn in self.keys() ]
+
+    def copy (self):
+    # Purpose: return the record as a (new) dict
+	return dict( self.items())
+
+    def __eq__ (self, other):
+	if isinstance( other, TDSRecordView):
+	    other = other.copy()
+	return self.copy() == other
+
+    def __ne__ (self, other):
+	return not self.__eq__( other)
+
+    def __repr__ (self):
+	return repr( self.copy())
+
+# End class TDSRecordView -------------------------------------------------
+
 class TextFileTableDataSet (TableDataSet):
 
     def __init__ (self,
@@ -984,7 +1368,9 @@ class TextFileTableDataSet (TableDataSet):
 	ignoreComments=0,	# =1 to ignore comments & blank lines as
 				#    we read the input file
 	readNow=0,		# =1 to read the file on instantiation.
-	caseSensitive=0		# =1 to make indexes case sensitive
+	caseSensitive=0,	# =1 to make indexes case sensitive
+	columnTypes=None	# =None for dict records, else column
+				#   storage, see TableDataSet.__init__()
 	):
     # Purpose: constructor
     # Assumes: if fieldnames==None, then numheaderlines>0
@@ -1012,7 +1398,8 @@ class TextFileTableDataSet (TableDataSet):
 	TableDataSet.__init__(self,name,
 				fieldnames,
 				multiValued=multiValued,
-				caseSensitive=caseSensitive)
+				caseSensitive=caseSensitive,
+				columnTypes=columnTypes)
 	if readNow:
 	    self.readRecords()
 
@@ -1063,6 +1450,355 @@ class TextFileTableDataSet (TableDataSet):
         return
     # end readRecords() ----------------------------------
 
+    def iterRecords (self):
+    # Purpose: generator: yield the records in the file one at a time,
+    #	       parsed as readRecords() does (keepLine(), parseLine(),
+    #	       _linenumber, processRecord()), w/o adding them to this
+    #	       TableDataSet. Memory use does not grow w/ the file.
+    # Returns: the records (dicts), not including rcds processRecord() drops
+    # Effects: reads the file from the start (after the header) each time,
+    #	       w/ its own file handle, so several iterations can be active
+    #	       at once. Does not change self.fp or self.numLinesRead.
+
+	fp = open( self.filename, 'r')
+	try:
+	    lineNum = 0
+	    for line in iter( fp.readline, ""):
+		lineNum = lineNum +1
+		if lineNum <= self.numheaderlines:	# skip the header
+		    continue
+		if self.keepLine(line):
+		    rcd = self.parseLine( line)
+		    rcd["_linenumber"] = lineNum
+		    rcd = self.processRecord( rcd)
+		    if (rcd != None):
+			yield rcd
+	finally:
+	    fp.close()
+    # end iterRecords() ----------------------------------
+
+    def stream (self):
+    # Purpose: return a TDSRecordStream of the records in the file
+    #	       (see iterRecords())
+	return TDSRecordStream( self.iterRecords(), self)
+    # end stream() ----------------------------------
+
+    def readRecordsBulk (self,
+	chunkSize=BULK_CHUNK_SIZE,	# approx bytes of lines to read at a time
+	hooks=None		# =1 to call keepLine() & processRecord() for
+				#   each line/rcd, =0 to not call them.
+				# =None to call them only if a subclass
+				#   overrides them
+	):
+    # Purpose: read the records from the file, if not already read.
+    #	       Same results as readRecords(), but much faster for big files:
+    #	       lines are read in chunks and split into columns a chunk at a
+    #	       time, and indexes are built once, after all rcds are read.
+    # Returns: nothing
+    # Assumes: self.records is an empty dictionary
+    # Effects: If parseLine() or splitLine() is overridden by a subclass,
+    #	       it is called for each line.
+    #	       With column storage and no processRecord() hook, the columns
+    #	       are added to the store directly, no rcd dicts are built.
+
+	if self.fp == None:		# not open yet, header not read yet
+	    self.readHeader()
+
+	if hooks == None:
+	    keepLineHook      = self.isOverridden('keepLine')
+	    processRecordHook = self.isOverridden('processRecord')
+	else:
+	    keepLineHook      = hooks
+	    processRecordHook = hooks
+
+	indexedFields = self.indexes.keys()	# indexes are rebuilt at the end
+
+	lines = self.fp.readlines( chunkSize)
+	while lines:
+	    columns = self.linesToColumns( lines, self.numLinesRead +1,
+												keepLineHook)
+	    self.numLinesRead = self.numLinesRead + len(lines)
+	    self.addColumns( columns, len(columns['_linenumber']),
+											processRecordHook)
+	    lines = self.fp.readlines( chunkSize)
+
+	self.fp.close()
+	self.addIndexes( indexedFields)
+	self.doneReading()
+
+        return
+    # end readRecordsBulk() ----------------------------------
+
+    def readRecordsParallel (self,
+	numProcesses=None,	# num of worker processes to parse the file,
+					#  =None for the num of CPUs
+	chunkSize=BULK_CHUNK_SIZE,	# approx bytes of the file per worker task
+	hooks=None			# as in readRecordsBulk()
+	):
+    # Purpose: read the records from the file, if not already read.
+    #	       Same results as readRecords(), but the file is split at line
+    #	       boundaries into byte ranges that are parsed (and indexed) in
+    #	       parallel by worker processes, then merged in file order.
+    # Returns: nothing
+    # Assumes: self.records is an empty dictionary
+    #	       The attributes of this TableDataSet (except records, indexes
+    #	         and the open file) can be pickled, so the workers can get a
+    #	         copy of it.
+    # Effects: keepLine(), parseLine() and splitLine() are called in the
+    #	         workers (when overridden, see readRecordsBulk()),
+    #	       processRecord() is called in this process, in file order.
+    #	       _linenumber is each rcd's line number in the file, as in
+    #	         readRecords().
+
+	if self.fp == None:		# not open yet, header not read yet
+	    self.readHeader()
+
+	if hooks == None:
+	    keepLineHook      = self.isOverridden('keepLine')
+	    processRecordHook = self.isOverridden('processRecord')
+	else:
+	    keepLineHook      = hooks
+	    processRecordHook = hooks
+
+	indexedFields = self.indexes.keys()
+	if processRecordHook:	# rcds may be dropped, rebuild indexes at the end
+	    workerIndexes = []
+	else:			# merge the workers' indexes
+	    workerIndexes = indexedFields
+	    for fn in indexedFields:
+		self.indexes[fn] = {}
+
+	state = {}			# the workers' copy of this TableDataSet
+	for attr, value in self.__dict__.items():
+	    if attr not in ['records', 'indexes', 'fp']:
+		state[attr] = value
+	tasks = [ (self.__class__, state, start, end, keepLineHook, workerIndexes)
+						for start, end in self.getLineRanges( chunkSize) ]
+	self.fp.close()
+
+	pool = multiprocessing.Pool( numProcesses)
+	try:
+	    for numLines, columns, indexes in pool.imap( parseFileRange, tasks):
+		lineOffset = self.numLinesRead	# line nums are relative to range
+		columns['_linenumber'] = [ n + lineOffset
+									for n in columns['_linenumber'] ]
+		keyOffset = self.nextkey		# index keys are relative too
+		self.addColumns( columns, len(columns['_linenumber']),
+											processRecordHook)
+		for fn, index in indexes.items():
+		    self.mergeIndex( fn, index, keyOffset)
+		self.numLinesRead = self.numLinesRead + numLines
+	    pool.close()
+	finally:
+	    pool.terminate()
+	    pool.join()
+
+	if processRecordHook:
+	    self.addIndexes( indexedFields)
+	self.doneReading()
+
+        return
+    # end readRecordsParallel() ----------------------------------
+
+    def getLineRanges (self,
+	chunkSize	# approx bytes per range
+	):
+    # Purpose: split the file after the header lines into byte ranges that
+    #	       start and end at line boundaries
+    # Returns: list of (start, end) file offsets
+    # Assumes: the header has been read (self.fp is just past it)
+	start = self.fp.tell()
+	size = os.path.getsize( self.filename)
+	ranges = []
+	fp = open( self.filename, 'r')
+	while start < size:
+	    end = start + max(1, chunkSize)
+	    if end >= size:
+		end = size
+	    else:			# move to the start of the next line
+		fp.seek( end)
+		fp.readline()
+		end = fp.tell()
+	    ranges.append( (start, end))
+	    start = end
+	fp.close()
+	return ranges
+    # end getLineRanges() ----------------------------------
+
+    def linesToColumns (self,
+	lines,		# list of lines read from the file
+	firstLineNum,	# line number of lines[0]
+	keepLineHook	# =1 to call keepLine() for each line
+	):
+    # Purpose: parse 'lines' a column at a time (see splitLinesToColumns()),
+    #	       dropping comment and blank lines
+    # Returns: dict mapping each fieldname and '_linenumber' to the list of
+    #	       its values for the lines kept (and '_missing', see
+    #	       recordsToColumns())
+	lineNums = xrange( firstLineNum, firstLineNum + len(lines))
+
+	# drop comment and blank lines
+	if keepLineHook:
+	    keep = [ (n, line) for n, line in zip(lineNums, lines)
+										if self.keepLine(line) ]
+	elif self.ignoreComments:
+	    keep = [ (n, line) for n, line in zip(lineNums, lines)
+					if line.strip() and line.strip()[0] != '#' ]
+	else:
+	    keep = zip(lineNums, lines)
+
+	if self.isOverridden('parseLine') or self.isOverridden('splitLine'):
+	    columns = self.recordsToColumns(
+							[ self.parseLine( line) for n, line in keep ])
+	else:
+	    columns = self.splitLinesToColumns( [ line for n, line in keep ])
+	columns['_linenumber'] = [ n for n, line in keep ]
+	return columns
+    # end linesToColumns() ----------------------------------
+
+    def indexColumn (self,
+	fieldname,	# field the values are for
+	values		# list of values of the field, one per row
+	):
+    # Purpose: index the rows of a column (see parseFileRange())
+    # Returns: dict mapping index values to lists of row numbers
+	index = {}
+	multiValued = self.isMultiValued( fieldname)
+	getIndexValue = self.getIndexValue
+	for row in xrange( len(values)):
+	    if multiValued:
+		rowValues = values[row]
+	    else:
+		rowValues = [ values[row] ]
+	    for val in rowValues:
+		if val != None:	# we don't index "None" as a value
+		    index.setdefault( getIndexValue( val), []).append( row)
+	return index
+    # end indexColumn() ----------------------------------
+
+    def mergeIndex (self,
+	fieldname,	# field of the index
+	index,		# dict mapping index values to lists of row numbers
+	keyOffset	# rcd key of row 0
+	):
+    # Purpose: add the keys of rows indexed by indexColumn() to the index
+    #	       for fieldname
+	finalIndex = self.indexes[fieldname]
+	for value, rows in index.items():
+	    keys = [ row + keyOffset for row in rows ]
+	    if self.compactIndexes:
+		for key in keys:
+		    self.addIndexKey( finalIndex, value, key)
+	    elif finalIndex.has_key( value):
+		finalIndex[value].extend( keys)
+	    else:
+		finalIndex[value] = keys
+    # end mergeIndex() ----------------------------------
+
+    def splitLinesToColumns (self,
+	lines		# list of lines to split
+	):
+    # Purpose: split 'lines' into fields and parse the values as
+    #	       parseLine() does, a column at a time.
+    # Returns: dict mapping each fieldname to the list of its values,
+    #	       parallel to 'lines'
+	numFields = len(self.fieldnames)
+	delim = self.fieldDelim
+	rows = []
+	for line in lines:
+	    row = line.rstrip('\r\n').split(delim, numFields -1)
+	    if len(row) < numFields:	# short line, missing cols are ''
+		row.extend( [''] * (numFields - len(row)))
+	    else:			# cols past the last field are dropped
+		row[-1] = row[-1].split(delim, 1)[0]
+	    rows.append( row)
+
+	columns = {}
+	if not rows:
+	    for fn in self.fieldnames:
+		columns[fn] = []
+	    return columns
+
+	for fn, values in zip(self.fieldnames, zip(*rows)):
+	    if self.isMultiValued( fn):
+		multiDelim = self.multiValuedFields[fn]
+		columns[fn] = [ [ s for s in [ s.strip() for s in v.split(multiDelim) ]
+											if s != '' ]
+									for v in values ]
+	    else:			# empty string -> None
+		columns[fn] = [ v or None for v in values ]
+	return columns
+    # end splitLinesToColumns() ----------------------------------
+
+    def recordsToColumns (self,
+	rcds		# list of rcd dicts (from parseLine())
+	):
+    # Purpose: return dict mapping each fieldname to the list of its values
+    #	       in 'rcds'. Fields a subclass's parseLine() adds to some rcds
+    #	       get columns too, and if any rcds do not have one of them,
+    #	       '_missing' maps it to the list of their rows, so addColumns()
+    #	       leaves it out of those rcds as readRecords() would.
+	columns = {}
+	for fn in self.fieldnames:
+	    columns[fn] = [ rcd.get(fn) for rcd in rcds ]
+	missing = {}
+	for rcd in rcds:
+	    for fn in rcd.keys():
+		if not columns.has_key( fn):
+		    columns[fn] = [ r.get(fn) for r in rcds ]
+		    rows = [ row for row in xrange(len(rcds))
+						if not rcds[row].has_key(fn) ]
+		    if rows:
+			missing[fn] = rows
+	if missing:
+	    columns['_missing'] = missing
+	return columns
+    # end recordsToColumns() ----------------------------------
+
+    def addColumns (self,
+	columns,	# dict mapping fieldnames to lists of values
+	numRows,	# num of rcds in the columns
+	processRecordHook	# =1 to call processRecord() for each rcd
+	):
+    # Purpose: add the rcds in 'columns' w/o updating any indexes
+    #	       (readRecordsBulk() rebuilds them at the end)
+	missing = columns.pop( '_missing', {})	# see recordsToColumns()
+	if not processRecordHook and isinstance( self.records, TDSColumnStore):
+	    key = self.records.extend( columns, numRows)
+	    assert key == self.nextkey
+	    self.nextkey = self.nextkey + numRows
+	    return
+
+	for fn in missing.keys():
+	    missing[fn] = set( missing[fn])
+	fieldnames = columns.keys()
+	rowNum = 0
+	for row in zip( *[ columns[fn] for fn in fieldnames ]):
+	    rcd = dict( zip( fieldnames, row))
+	    for fn, rows in missing.items():
+		if rowNum in rows:
+		    del rcd[fn]
+	    rowNum = rowNum +1
+	    if processRecordHook:
+		rcd = self.processRecord( rcd)
+		if rcd == None:
+		    continue
+		for fn in self.fieldnames:	# make sure rcd has all needed fields
+		    if not rcd.has_key(fn):
+			rcd[fn] = None
+	    key = self.newKey()
+	    rcd['_rcdkey'] = key
+	    self.records[key] = rcd
+    # end addColumns() ----------------------------------
+
+    def isOverridden (self,
+	methodName	# name of a TextFileTableDataSet method
+	):
+    # Purpose: return true if a subclass overrides methodName
+	return getattr( self.__class__, methodName).im_func is not \
+					getattr( TextFileTableDataSet, methodName).im_func
+    # end isOverridden() ----------------------------------
+
     def keepLine (self,
 	line		# string holding the current line read in
         ):
@@ -1121,23 +1857,23 @@ class TextFileTableDataSet (TableDataSet):
 	rcd = {}	# empty dictionary to return
 
         fieldvalues = self.splitLine(line)
+	numValues = len(fieldvalues)
 
 	# loop through the fieldnames, grabbing cooresponding values.
-	#  remove fieldvalue[0] as we go, so fieldvalue[0] is always the value
-	#  for the next field.
-	for fieldname in self.fieldnames:
+	#  fieldvalues[i] is the value for the i-th field.
+	for i in range(len(self.fieldnames)):
+	    fieldname = self.fieldnames[i]
 
 	    defaultValue = None 	# default value for this field
 	    if self.isMultiValued( fieldname):
 		defaultValue = []
 
-	    if (len(fieldvalues) > 0):  # have a col for the field on the line
-		value = fieldvalues[0]
+	    if (i < numValues):	# have a col for the field on the line
+		value = fieldvalues[i]
 		if self.isMultiValued( fieldname):
 		    value = self.parseMultiValue( fieldname, value)
 		elif value == '':	# value is empty string
 		    value = defaultValue
-		del fieldvalues[0]
 	    else:			# we've run out of cols on this line
 	        value = defaultValue	# use default value
 
@@ -1217,6 +1953,476 @@ class TextFileTableDataSet (TableDataSet):
     
 # End class TextFileTableDataSet -------------------------------------------
 
+def parseFileRange ( \
+    task	# (TextFileTableDataSet subclass, its attributes, start offset,
+		#  end offset, keepLineHook, fieldnames to index)
+    ):
+    # Purpose: worker for TextFileTableDataSet.readRecordsParallel():
+    #	       parse & index the lines in a byte range of the file
+    # Returns: (num of lines in the range,
+    #	        columns as linesToColumns() w/ line numbers from 1,
+    #	        dict mapping fieldnames to indexColumn() indexes)
+    (cls, state, start, end, keepLineHook, indexedFields) = task
+
+    ds = types.InstanceType( cls, state)
+    ds.records = {}
+    ds.indexes = {}
+    ds.fp = None
+
+    fp = open( ds.filename, 'r')
+    fp.seek( start)
+    lines = cStringIO.StringIO( fp.read( end - start)).readlines()
+    fp.close()
+
+    columns = ds.linesToColumns( lines, 1, keepLineHook)
+    indexes = {}
+    for fn in indexedFields:
+	indexes[fn] = ds.indexColumn( fn, columns[fn])
+    return (len(lines), columns, indexes)
+# end parseFileRange() ----------------------------------
+
+class LazyTextFileTableDataSet (TextFileTableDataSet):
+#
+# IS: a TextFileTableDataSet for huge files where you only need a few rcds.
+#
+# HAS: readRecords() mmaps the file and only records where each (kept) line
+#	starts. A record's key is the number of its line in this table.
+#	Records are parsed when they are accessed (getRecords(),
+#	getRecordsByIndex(), getRecordByKey()...) and kept once parsed, so
+#	changes to them stick.
+#	Indexes are built when first used (getKeysByIndex(),
+#	getRecordsByIndex(), getDupsDict(), getValues(), and
+#	selectKeysWhere() for fields named in addIndexes()), from just the
+#	indexed field of each line for rcds not parsed yet.
+#	addIndexes() (before or after readRecords()) just names the fields,
+#	hasIndex() is true for them.
+#
+# DOES: Same methods as a TextFileTableDataSet. keepLine() is called for
+#	each line as the line table is built, parseLine() & processRecord()
+#	when a record is parsed.
+#	processRecord() must not return None (rcds can't be dropped lazily).
+#	Memory use is proportional to the num of lines plus the rcds parsed.
+#	getRecords() w/o keys parses (and keeps) every record.
+#
+    def __init__ (self,
+	name,			# string;the name for this TableDataSet.
+	filename,		# string; name of the file to read.
+	fieldnames=None,	# see TextFileTableDataSet.__init__()
+	multiValued = {},
+	numheaderlines=1,
+	fieldDelim='\t',
+	ignoreComments=0,
+	readNow=0,		# =1 to build the line table on instantiation.
+	caseSensitive=0
+	):
+    # Purpose: constructor
+	self.mm = None			# the mmapped file, once read
+	self.indexFields = []		# fields named in addIndexes(), indexes
+						#   built on demand, see ensureIndex()
+	TextFileTableDataSet.__init__(self, name, filename,
+				fieldnames=fieldnames,
+				multiValued=multiValued,
+				numheaderlines=numheaderlines,
+				fieldDelim=fieldDelim,
+				ignoreComments=ignoreComments,
+				readNow=readNow,
+				caseSensitive=caseSensitive)
+    # end __init__() class LazyTextFileTableDataSet ------------------------
+
+    def readRecords (self,
+	chunkSize=BULK_CHUNK_SIZE	# approx bytes of lines to scan at a time
+	):
+    # Purpose: build the table of line offsets and mmap the file, if not
+    #	       already read. No records are parsed.
+    # Returns: nothing
+    # Assumes: no records have been added
+	if self.fp == None:		# not open yet, header not read yet
+	    self.readHeader()
+
+	checkLines = self.ignoreComments or self.isOverridden('keepLine')
+	offsets  = array.array('l')	# file offset of each kept line
+	lineNums = array.array('l')	# its line number in the file
+	pos = self.fp.tell()
+	lines = self.fp.readlines( chunkSize)
+	while lines:
+	    for line in lines:
+		self.numLinesRead = self.numLinesRead +1
+		if not checkLines or self.keepLine( line):
+		    offsets.append( pos)
+		    lineNums.append( self.numLinesRead)
+		pos = pos + len(line)
+	    lines = self.fp.readlines( chunkSize)
+
+	if pos > 0:			# can't mmap an empty file
+	    self.mm = mmap.mmap( self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+	self.fp.close()
+
+	self.records = TDSLazyStore( self, offsets, lineNums)
+	self.nextkey = len(offsets)
+	self.indexes = {}		# built on demand, see ensureIndex()
+	self.doneReading()
+
+        return
+    # end readRecords() ----------------------------------
+
+    def readRecordsBulk (self, chunkSize=BULK_CHUNK_SIZE, hooks=None):
+    # Purpose: same as readRecords(), there is nothing to bulk load
+	self.readRecords( chunkSize)
+    # end readRecordsBulk() ----------------------------------
+
+    def readRecordsParallel (self, numProcesses=None,
+						chunkSize=BULK_CHUNK_SIZE, hooks=None):
+    # Purpose: same as readRecords(), there is nothing to parse in parallel
+	self.readRecords( chunkSize)
+    # end readRecordsParallel() ----------------------------------
+
+    def getLine (self,
+	offset		# file offset of the start of a line
+	):
+    # Purpose: return the line (w/ its line terminator) at 'offset'
+	end = self.mm.find( '\n', offset)
+	if end == -1:		# last line w/o a line terminator
+	    end = len(self.mm)
+	else:
+	    end = end +1
+	return self.mm[offset:end]
+    # end getLine() ----------------------------------
+
+    def addIndexes (self,
+	fieldnames	# list fieldnames to add indexes for
+			#  or a single string = name of a field
+        ):
+    # Purpose: (re)build indexes for the specified fieldnames.
+    # Effects: just names the fields (and drops any index already built
+    #	       for them), the indexes are built on demand, see ensureIndex()
+	if type(fieldnames) != types.ListType:
+	    fieldnames = [fieldnames]
+	for fn in fieldnames:
+	    if fn not in self.indexFields:
+		self.indexFields.append( fn)
+	    if self.indexes.has_key( fn):
+		del self.indexes[fn]
+    # end addIndexes() ----------------------------------
+
+    def buildIndexes (self,
+	fieldnames	# list of field names to build indexes for
+			#  or a single string = name of a field
+			# or [] to delete/remove all indexes
+	):
+    # Purpose: replace all indexes by indexes for fieldnames (on demand)
+	self.indexFields = []
+	self.indexes = {}
+	self.addIndexes( fieldnames)
+    # end buildIndexes() ----------------------------------
+
+    def hasIndex (self,
+	fieldname	# fieldname to check index for
+        ):
+    # Purpose: return 1 if we have an index (maybe not built yet) for
+    #	       the specified fieldname
+	return fieldname in self.indexFields or self.indexes.has_key( fieldname)
+    # end hasIndex() ----------------------------------
+
+    def ensureIndex (self,
+	fieldname	# field that needs an index
+	):
+    # Purpose: build the index for 'fieldname' if we don't have it yet
+    # Effects: adds fieldname to the fields named by addIndexes().
+    #	       Before readRecords() there are no rcds to index.
+	if fieldname not in self.indexFields:
+	    self.indexFields.append( fieldname)
+	if not self.indexes.has_key( fieldname) and \
+							isinstance( self.records, TDSLazyStore):
+	    TextFileTableDataSet.addIndexes( self, [fieldname])
+    # end ensureIndex() ----------------------------------
+
+    def selectKeysWhere (self,
+	fieldName,		# field to select on
+	value,			# select rcds whose field == this value
+	sortField = None,	# see TableDataSet.selectKeysWhere()
+	cmpFunc = None
+	):
+    # Purpose: TableDataSet.selectKeysWhere(), building the index if
+    #	       fieldName is named in addIndexes()
+	if fieldName in self.indexFields and value != None:
+	    self.ensureIndex( fieldName)
+	return TextFileTableDataSet.selectKeysWhere( self, fieldName, value,
+											sortField, cmpFunc)
+    # end selectKeysWhere() ----------------------------------
+
+    def getValues (self,
+	fieldname	# field to get the distinct values of
+	):
+    # Purpose: TableDataSet.getValues(), building the index if needed
+	self.ensureIndex( fieldname)
+	return TextFileTableDataSet.getValues( self, fieldname)
+    # end getValues() ----------------------------------
+
+    def getKeysByIndex (self,
+	fieldname,		# fieldname to look up
+	inputValue,		# find rcds w/ this value
+	sortField = None,	# see TableDataSet.getKeysByIndex()
+	cmpFunc = None
+        ):
+    # Purpose: TableDataSet.getKeysByIndex(), building the index if needed
+	self.ensureIndex( fieldname)
+	return TextFileTableDataSet.getKeysByIndex( self, fieldname, inputValue,
+											sortField, cmpFunc)
+    # end getKeysByIndex() ----------------------------------
+
+    def getDupsDict (self,
+	fieldnames	# list of fieldnames to report dups for
+        ):
+    # Purpose: TableDataSet.getDupsDict(), building the indexes if needed
+	for fn in fieldnames:
+	    self.ensureIndex( fn)
+	return TextFileTableDataSet.getDupsDict( self, fieldnames)
+    # end getDupsDict() ----------------------------------
+
+    def close (self):
+    # Purpose: close the mmapped file. Records already parsed are still
+    #	       available.
+	if self.mm != None:
+	    self.mm.close()
+	    self.mm = None
+    # end close() ----------------------------------
+
+# End class LazyTextFileTableDataSet -------------------------------------
+
+class TDSLazyStore:
+#
+# IS: the record storage of a LazyTextFileTableDataSet. It acts like the
+#     dict (rcd key -> rcd) a TableDataSet keeps in self.records.
+#
+# HAS: the file offset & line number of each kept line, the rcds parsed
+#	so far (and rcds added later), the keys of lines deleted.
+#
+# DOES: parses a line into a rcd the first time the rcd is accessed.
+#
+    def __init__ (self,
+	ds,		# the LazyTextFileTableDataSet
+	offsets,	# array of file offsets of the lines (rcd key -> offset)
+	lineNums	# array of their line numbers
+	):
+    # Purpose: constructor
+	self.ds = ds
+	self.offsets = offsets
+	self.lineNums = lineNums
+	self.parsed = {}		# rcd key -> rcd, rcds parsed or added
+	self.deleted = {}		# rcd key -> 1 for lines deleted
+    # end __init__() class TDSLazyStore ------------------------------
+
+    def isLine (self, key):
+    # Purpose: return true if 'key' is a line in the file, not deleted
+	return type(key) in (types.IntType, types.LongType) and \
+			0 <= key < len(self.offsets) and not self.deleted.has_key( key)
+    # end isLine() ----------------------------------
+
+    def parseRecord (self,
+	key		# rcd key (line table index)
+	):
+    # Purpose: parse the rcd for 'key' from the file
+    # Returns: the rcd (dict), not kept
+	ds = self.ds
+	rcd = ds.parseLine( ds.getLine( self.offsets[key]))
+	rcd["_linenumber"] = self.lineNums[key]
+	rcd = ds.processRecord( rcd)
+	for f in ds.getFieldNames():	# make sure rcd has all needed fields
+	    if not rcd.has_key(f):
+		rcd[f] = None
+	rcd['_rcdkey'] = key
+	return rcd
+    # end parseRecord() ----------------------------------
+
+    def getColumnItems (self,
+	fieldname		# field to get the values of
+	):
+    # Purpose: return a list of (rcd key, value) for fieldname for all rcds.
+    #	       For lines not parsed yet, only the field's value is parsed
+    #	       (unless parseLine(), splitLine() or processRecord() is
+    #	       overridden, then the whole rcd is parsed, but not kept).
+	ds = self.ds
+	if ds.isOverridden('parseLine') or ds.isOverridden('splitLine') or \
+		ds.isOverridden('processRecord') or fieldname not in ds.fieldnames:
+	    items = [ (k, self.parsed.get( k) or self.parseRecord( k))
+										for k in self.keys() ]
+	    return [ (k, rcd[fieldname]) for k, rcd in items ]
+
+	i = ds.fieldnames.index( fieldname)
+	multiValued = ds.isMultiValued( fieldname)
+	items = []
+	for k in self.keys():
+	    if self.parsed.has_key( k):
+		items.append( (k, self.parsed[k][fieldname]))
+		continue
+	    values = ds.getLine( self.offsets[k]).rstrip('\r\n').split(
+											ds.fieldDelim, i +1)
+	    if len(values) > i:
+		value = values[i]
+	    else:			# we've run out of cols on this line
+		value = ''
+	    if multiValued:
+		value = ds.parseMultiValue( fieldname, value)
+	    elif value == '':
+		value = None
+	    items.append( (k, value))
+	return items
+    # end getColumnItems() ----------------------------------
+
+    # dict methods ###############
+
+    def __getitem__ (self, key):
+	if self.parsed.has_key( key):
+	    return self.parsed[key]
+	if not self.isLine( key):
+	    raise KeyError( key)
+	rcd = self.parseRecord( key)
+	self.parsed[key] = rcd
+	return rcd
+
+    def __setitem__ (self, key, rcd):
+	self.parsed[key] = rcd
+	if self.deleted.has_key( key):
+	    del self.deleted[key]
+
+    def __delitem__ (self, key):
+	if not self.has_key( key):
+	    raise KeyError( key)
+	if self.parsed.has_key( key):
+	    del self.parsed[key]
+	if 0 <= key < len(self.offsets):
+	    self.deleted[key] = 1
+
+    def has_key (self, key):
+	return self.parsed.has_key( key) or self.isLine( key)
+
+    def __contains__ (self, key):
+	return self.has_key( key)
+
+    def __len__ (self):
+	numLines = len(self.offsets)
+	return numLines - len(self.deleted) + \
+			len([ k for k in self.parsed.keys() if k >= numLines ])
+
+    def keys (self):
+	numLines = len(self.offsets)
+	deleted = self.deleted
+	keys = [ k for k in xrange(numLines) if not deleted.has_key(k) ]
+	added = [ k for k in self.parsed.keys() if k >= numLines ]
+	added.sort()
+	return keys + added
+
+    def __iter__ (self):
+	return iter( self.keys())
+
+    def values (self):
+	return [ self[k] for k in self.keys() ]
+
+    def items (self):
+	return [ (k, self[k]) for k in self.keys() ]
+
+# End class TDSLazyStore --------------------------------------------------
+
+class TDSRecordStream:
+#
+# IS: a single pass, constant memory pipeline over a stream of records
+#     (dicts), e.g., from TextFileTableDataSet.stream().
+#
+# HAS: an iterator of records and the TableDataSet they are from (for its
+#	fieldnames, multiValued fields and output format).
+#
+# DOES: filter(), project() and transform() each return a new stream w/
+#	that step added, so they can be chained. Nothing is read until the
+#	stream is iterated or written.
+#	write() writes the records as printRecords() does.
+#
+# Example:
+#	ds = TextFileTableDataSet( "genes", "genes.txt", multiValued=multi)
+#	n = ds.stream() \
+#		.filter( lambda rcd: rcd["Chr"] == "X") \
+#		.transform( fixSymbol) \
+#		.project( ["MGI ID", "Symbol"]) \
+#		.write( sys.stdout, headerline='y')
+#
+    def __init__ (self,
+	records,	# iterable of records (dicts)
+	ds,		# TableDataSet the records are from
+	fieldnames=None	# fields the records have, =None for ds's fields
+	):
+    # Purpose: constructor
+	self.records = iter( records)
+	self.ds = ds
+	if fieldnames == None:
+	    fieldnames = ds.getFieldNames()
+	self.fieldnames = fieldnames
+    # end __init__() class TDSRecordStream ------------------------------
+
+    def __iter__ (self):
+	return self.records
+
+    def filter (self,
+	func		# function( rcd), returns true to keep the rcd
+	):
+    # Purpose: return a stream of the rcds 'func' keeps
+	return TDSRecordStream( itertools.ifilter( func, self.records),
+								self.ds, self.fieldnames)
+    # end filter() ----------------------------------
+
+    def project (self,
+	fieldnames	# list of fields to keep
+	):
+    # Purpose: return a stream of rcds w/ just 'fieldnames' (and
+    #	       _linenumber if the rcds have it). Missing fields are None.
+	def projectRecord( rcd):
+	    newRcd = {}
+	    for fn in fieldnames:
+		newRcd[fn] = rcd.get(fn)
+	    if rcd.has_key( "_linenumber"):
+		newRcd["_linenumber"] = rcd["_linenumber"]
+	    return newRcd
+	return TDSRecordStream( itertools.imap( projectRecord, self.records),
+								self.ds, fieldnames)
+    # end project() ----------------------------------
+
+    def transform (self,
+	func,		# function( rcd), returns the new or updated rcd,
+			#  or None to drop the rcd (like processRecord())
+	fieldnames=None	# fields of the new rcds, =None if unchanged
+	):
+    # Purpose: return a stream of the rcds as changed by 'func'
+	if fieldnames == None:
+	    fieldnames = self.fieldnames
+	records = itertools.ifilter( lambda rcd: rcd != None,
+								itertools.imap( func, self.records))
+	return TDSRecordStream( records, self.ds, fieldnames)
+    # end transform() ----------------------------------
+
+    def write (self,
+	fp,			# open output file to write to
+	fieldnames=None,	# list of fields to write, =None for the
+				#   stream's fields
+	delim = '\t',		# optional field delim string
+	headerline = 'n'	# ='y' to write a header line w/ field names
+	):
+    # Purpose: write the rcds in the stream to fp, formatted as
+    #	       printRecords() does
+    # Returns: the num of rcds written
+	if fieldnames == None:
+	    fieldnames = self.fieldnames
+
+	if headerline == 'y':
+	    self.ds.printHeaders( fp, fieldnames, delim)
+
+	numRecords = 0
+	formatRecord = self.ds.formatRecord
+	for rcd in self.records:
+	    fp.write( formatRecord( rcd, fieldnames, delim))
+	    numRecords = numRecords +1
+	return numRecords
+    # end write() ----------------------------------
+
+# End class TDSRecordStream -----------------------------------------------
+
 class TableDataSetBucketizer:
 # IS:   an object that knows how to "bucketize" two TableDataSets
 #
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+"""
+Compressed, memory-mappable archive of records (bytes) keyed by int ID,
+    e.g., PubMed records split out of eutils output by
+    NCBIutilsLib.splitRecords(), so downstream steps don't re-fetch or
+    re-split them.
+
+ArchiveWriter class
+  - writes records into zlib compressed blocks + a sorted ID index
+ArchiveReader class
+  - mmaps an archive: get(id) decompresses only the one block holding the
+    record, iterRecords() decompresses blocks in parallel (threads, zlib
+    releases the GIL) for full scans.
+
+*** Examples ***
+    with ArchiveWriter('pubmed.arc') as writer:
+        for retstart, output in pages:	# see NCBIutilsLib.iterResultPages()
+            records = eulib.splitRecords('pubmed', output, op='fetch')
+            writer.addMany(records.items())
+
+    with ArchiveReader('pubmed.arc') as reader:
+        rcd = reader.get(28440906)		# bytes or None
+        for pmid, rcd in reader.iterRecords(numWorkers=4):
+            ...
+
+*** File format *** (all ints little endian)
+    MAGIC
+    blocks: each zlib compressed. Uncompressed, a block is a sequence of
+            (id uint64, record length uint32, record bytes)
+    index: one INDEX_ENTRY (id, block num, offset of the record in the
+            uncompressed block, record length) per record, sorted by id
+    block table: one BLOCK_ENTRY (file offset, compressed length,
+            uncompressed length) per block
+    TRAILER: index offset, num of records, block table offset,
+            num of blocks, MAGIC
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import threading
+import collections
+import concurrent.futures
+
+MAGIC = b'RCDARC01'
+RECORD_HEADER = struct.Struct('<QI')	# id, record length
+INDEX_ENTRY   = struct.Struct('<QIII')	# id, block num, offset, length
+BLOCK_ENTRY   = struct.Struct('<QII')	# file offset, compressed len, raw len
+TRAILER       = struct.Struct('<QQQQ8s')
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024	# uncompressed bytes per block
+
+class ArchiveWriter (object):
+    """
+    Writes an archive (see module doc). Records are buffered until a block
+        is full, then compressed and written. close() writes the index.
+    The archive is written to a temp file and renamed when closed, so
+        readers never see a partly written archive.
+    If an id is added more than once, the last record added is kept (the
+        earlier ones still take space in their blocks).
+    """
+    def __init__(self,
+                filename,
+                blockSize=DEFAULT_BLOCK_SIZE,	# uncompressed bytes/block
+                level=6,	# zlib compression level
+                ):
+        self.filename = filename
+        self.tmpFilename = filename + '.tmp'
+        self.blockSize = blockSize
+        self.level = level
+        self.fp = open(self.tmpFilename, 'wb')
+        self.fp.write(MAGIC)
+        self.block = []		# record headers & records of current block
+        self.blockLen = 0	# uncompressed length of current block
+        self.index = {}		# id -> (block num, offset, length)
+        self.blockTable = []	# [(file offset, compressed len, raw len)]
+    #------------------------
+
+    def add(self, id,		# int (or str of digits)
+                record,		# bytes
+        ):
+        id = int(id)
+        self.index[id] = (len(self.blockTable),
+                                self.blockLen + RECORD_HEADER.size, len(record))
+        self.block.append(RECORD_HEADER.pack(id, len(record)))
+        self.block.append(record)
+        self.blockLen += RECORD_HEADER.size + len(record)
+        if self.blockLen >= self.blockSize:
+            self._writeBlock()
+    #------------------------
+
+    def addMany(self, records,	# iterable of (id, record bytes)
+        ):
+        for id, record in records:
+            self.add(id, record)
+    #------------------------
+
+    def _writeBlock(self):
+        if not self.block:
+            return
+        raw = b''.join(self.block)
+        data = zlib.compress(raw, self.level)
+        self.blockTable.append( (self.fp.tell(), len(data), len(raw)) )
+        self.fp.write(data)
+        self.block = []
+        self.blockLen = 0
+    #------------------------
+
+    def close(self):
+        """ Write the last block, the index, and rename into place """
+        if self.fp == None:
+            return
+        self._writeBlock()
+        indexOffset = self.fp.tell()
+        self.fp.write(b''.join([INDEX_ENTRY.pack(id, *self.index[id])
+                                            for id in sorted(self.index)]))
+        blockTableOffset = self.fp.tell()
+        self.fp.write(b''.join([BLOCK_ENTRY.pack(*b)
+                                            for b in self.blockTable]))
+        self.fp.write(TRAILER.pack(indexOffset, len(self.index),
+                            blockTableOffset, len(self.blockTable), MAGIC))
+        self.fp.close()
+        self.fp = None
+        os.replace(self.tmpFilename, self.filename)
+    #------------------------
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType == None:
+            self.close()
+        else:			# don't leave a partial archive behind
+            self.fp.close()
+            self.fp = None
+            os.remove(self.tmpFilename)
+    #------------------------
+
+# end class ArchiveWriter -------------------------
+
+class ArchiveReader (object):
+    """
+    Random access and full scans of an archive (see module doc) via mmap.
+    The index is binary searched in the mmap, so opening an archive does
+        not read the index into memory.
+    The last few decompressed blocks are kept (cacheBlocks) so reading
+        records in id or block order does not decompress a block repeatedly.
+    Safe to share between threads.
+    """
+    def __init__(self,
+                filename,
+                cacheBlocks=4,	# num of decompressed blocks to keep
+                ):
+        notArchive = '%s is not a record archive\n' % filename
+        self.fp = open(filename, 'rb')
+        if os.fstat(self.fp.fileno()).st_size < len(MAGIC) + TRAILER.size:
+            self.fp.close()		# empty or truncated, can't mmap empty
+            raise Exception(notArchive)
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC or self.mm[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise Exception(notArchive)
+        self.indexOffset, self.numRecords, self.blockTableOffset, \
+                self.numBlocks, magic = TRAILER.unpack_from(self.mm,
+                                                len(self.mm) - TRAILER.size)
+        self.cacheBlocks = cacheBlocks
+        self.cache = collections.OrderedDict()	# block num -> raw block
+        self.lock = threading.Lock()
+    #------------------------
+
+    def __len__(self):
+        return self.numRecords
+    #------------------------
+
+    def __contains__(self, id):
+        return self._find(int(id)) != None
+    #------------------------
+
+    def _getIndexEntry(self, i):
+        return INDEX_ENTRY.unpack_from(self.mm,
+                                        self.indexOffset + i * INDEX_ENTRY.size)
+    #------------------------
+
+    def _getBlockEntry(self, n):
+        return BLOCK_ENTRY.unpack_from(self.mm,
+                                    self.blockTableOffset + n * BLOCK_ENTRY.size)
+    #------------------------
+
+    def _find(self, id):
+        """ Return the index entry for id, or None """
+        lo, hi = 0, self.numRecords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._getIndexEntry(mid)[0] < id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.numRecords:
+            entry = self._getIndexEntry(lo)
+            if entry[0] == id:
+                return entry
+        return None
+    #------------------------
+
+    def ids(self):
+        """ Generator: the ids in the archive, in sorted order """
+        for i in range(self.numRecords):
+            yield self._getIndexEntry(i)[0]
+    #------------------------
+
+    def get(self, id,		# int (or str of digits)
+        ):
+        """ Return the record (bytes) for id, or None """
+        entry = self._find(int(id))
+        if entry == None:
+            return None
+        id, blockNum, offset, length = entry
+        return self._getBlock(blockNum)[offset:offset+length]
+    #------------------------
+
+    def _getBlock(self, n):
+        """ Return uncompressed block n, from the cache if we can """
+        with self.lock:
+            if n in self.cache:
+                self.cache.move_to_end(n)
+                return self.cache[n]
+        raw = self._decompress(n)
+        with self.lock:
+            self.cache[n] = raw
+            while len(self.cache) > self.cacheBlocks:
+                self.cache.popitem(last=False)
+        return raw
+    #------------------------
+
+    def _decompress(self, n):
+        offset, compressedLen, rawLen = self._getBlockEntry(n)
+        with memoryview(self.mm) as view:
+            with view[offset:offset+compressedLen] as data:
+                return zlib.decompress(data, bufsize=rawLen)
+    #------------------------
+
+    def iterRecords(self,
+                numWorkers=1,	# num of threads decompressing blocks
+        ):
+        """ Generator: (id, record bytes) for all the records, in the order
+                they were added (including replaced duplicates).
+            Up to 2 * numWorkers blocks are decompressed ahead in threads.
+        """
+        def parseBlock(n):
+            raw = self._decompress(n)
+            records = []
+            pos = 0
+            while pos < len(raw):
+                id, length = RECORD_HEADER.unpack_from(raw, pos)
+                pos += RECORD_HEADER.size
+                records.append( (id, raw[pos:pos+length]) )
+                pos += length
+            return records
+
+        if numWorkers <= 1:
+            for n in range(self.numBlocks):
+                yield from parseBlock(n)
+            return
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=numWorkers)
+        pending = collections.deque()
+        try:
+            for n in range(self.numBlocks):
+                pending.append(executor.submit(parseBlock, n))
+                if len(pending) >= 2 * numWorkers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+    #------------------------
+
+    def close(self):
+        self.mm.close()
+        self.fp.close()
+    #------------------------
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+    #------------------------
+
+# end class ArchiveReader -------------------------
@@ -6,17 +6,103 @@
 """
 Simple Library for reading URLs.
 Simple readURL(url, ...) function
+openURL(url, ...) function - like readURL but returns the response stream
 Simple ThrottledURLReader class
   - read from URLs with a min number of seconds between reads.
+ConnectionPool class
+  - keep-alive HTTP(S) connections reused per host, optional gzip/deflate
+AsyncURLReader class
+  - asyncio (non-blocking socket) version of ThrottledURLReader
+ResponseCache class
+  - on-disk cache of responses w/ TTL and size bound, safe across processes
+RateLimiter class
+  - token bucket shared by threads, asyncio tasks, and (via a lock file)
+    processes. Can be plugged into a ThrottledURLReader.
+RetryPolicy and CircuitBreaker classes
+  - retry w/ exponential backoff, and pause all readers sharing a breaker
+    when a server keeps failing. Can be plugged into a ThrottledURLReader.
+Instrumentation and Histogram classes
+  - per-request timings (throttle wait, connect, time to first byte,
+    download), byte counts and status codes from a ThrottledURLReader,
+    dumpable as JSON or Prometheus text, w/ an optional slow request log.
+URLReadError - the Exception raised for URL read failures
 """
 
+import os
+import re
+import sys
+import ssl
+import json
 import time
+import random
+import bisect
+import itertools
+import email.utils
+import hashlib
+import tempfile
+import gzip
+import zlib
+import fcntl
+import asyncio
+import weakref
+import threading
+import http.client
 import urllib.request, urllib.parse, urllib.error
 
+class URLReadError (Exception):
+    """
+    Raised for URL read failures. (a subclass of Exception so code that
+        catches "Exception" still works)
+    code is the http status code, or None if we did not get a response
+        (could not reach the server, connection dropped, timeout, ...).
+    retryAfter is the seconds from the http Retry-After header, or None.
+    """
+    def __init__(self, url, code=None, reason=None, retryAfter=None):
+        if code == None:
+            msg = "Failed to reach server, reason: %s\nURL: '%s'\n" \
+                                                % (reason,url)
+        else:
+            msg = "Cannot fulfill request, code: %s\nURL: '%s'\n" \
+                                                % (code,url)
+        Exception.__init__(self, msg)
+        self.url = url
+        self.code = code
+        self.reason = reason
+        self.retryAfter = retryAfter
+# end class URLReadError -------------------------
+
+def parseRetryAfter(value,	# str, http Retry-After header value (or None)
+            ):
+    """ Return the Retry-After value as seconds from now (float), or None
+        Retry-After can be seconds or an http date.
+    """
+    if value == None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(when - time.time(), 0.0)
+# -------------------------
+
+def _urllibError(e, url):
+    """ Return URLReadError for urllib URLError e """
+    if isinstance(e, urllib.error.HTTPError):	# has .code & .reason
+        return URLReadError(url, code=e.code, reason=e.reason,
+                        retryAfter=parseRetryAfter(e.headers.get('Retry-After')))
+    return URLReadError(url, reason=e.reason)
+# -------------------------
+
 def readURL(url,                # str
             GET=True,
             params=None,        # bytes if doing a post
             headers={},
+            pool=None,		# ConnectionPool to use, None = new connection
+            timings=None,	# dict to fill in w/ request timings, see
+                                #   Instrumentation
             ):
     """ Return results (bytes) of the response from the URL.
         If params == None, we assume everything is encoded in the url.
@@ -25,39 +111,851 @@ def readURL(url,                # str
         Else do a post with params. 
 
         Can pass in http headers if you like.
-        Raises "Exception" with helpful msges for url errors.
+        If pool is given, the request goes over one of its keep-alive
+            connections instead of opening a new one.
+        Raises URLReadError with helpful msges for url errors.
+    """
+    data = params
+    if params != None and GET == True: # need to encode params in the URL
+        url = url + '?' +  urllib.parse.urlencode(params)
+        data = None
+
+    if pool != None:
+        return pool.readURL(url, data=data, headers=headers, timings=timings)
+
+    response = _urlopen(url, data, headers, timings)
+    readStart = time.time()
+    try:
+        responseText = response.read()
+    except (OSError, http.client.HTTPException) as e:	# dropped connection
+        raise URLReadError(url, reason=e)
+    finally:
+        response.close()
+    if timings != None:
+        timings['download'] = time.time() - readStart
+        timings['bytes'] = len(responseText)
+
+    return responseText
+# -------------------------
+
+def openURL(url,                # str
+            GET=True,
+            params=None,        # bytes if doing a post
+            headers={},
+            timings=None,	# dict to fill in w/ request timings, see
+                                #   Instrumentation (no download timing)
+            ):
+    """ Like readURL(), but return the open response (a file-like object w/
+            read(n)) without reading it, so the caller can process the body
+            while it is still arriving.
+        The caller should close the response (or use it in a 'with').
+        Always opens a new connection.
+        Raises URLReadError with helpful msges for url errors.
     """
     data = params
     if params != None and GET == True: # need to encode params in the URL
         url = url + '?' +  urllib.parse.urlencode(params)
         data = None
 
+    return _urlopen(url, data, headers, timings)
+# -------------------------
+
+def _urlopen(url, data, headers, timings):
+    """ Return urlopen() response. Fill in timings: urllib does not tell us
+        when the connection is made, so 'ttfb' includes connecting.
+    """
     request = urllib.request.Request(url, data, headers )
+    startTime = time.time()
     try:
         response = urllib.request.urlopen(request)
-        responseText = response.read()
     except urllib.error.URLError as e:
-        if hasattr(e, 'reason'):
-            raise Exception("Failed to reach server, reason: %s\nURL: '%s'\n" \
-                                                % (e.reason,url))
-        elif hasattr(e, 'code'):
-            raise Exception("Cannot fulfill request, code: %s\nURL: '%s'\n" \
-                                                % (e.code,url))
-    response.close()
+        raise _urllibError(e, url)
+    except (OSError, http.client.HTTPException) as e:	# dropped connection,
+        raise URLReadError(url, reason=e)		#  timeout, bad reply
+    if timings != None:
+        timings['ttfb'] = time.time() - startTime
+        timings['status'] = response.status
+    return response
+# -------------------------
 
-    return responseText
+def decodeBody(body,		# bytes, http response body
+            encoding,		# str, http Content-Encoding of the body
+            ):
+    """ Return the body w/ its http Content-Encoding (gzip/deflate) undone
+    """
+    encoding = encoding.strip().lower()
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    elif encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:	# some servers send raw deflate
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
 # -------------------------
 
+class ConnectionPool (object):
+    """
+    Keeps HTTP/1.1 keep-alive connections open and reuses them for later
+        requests to the same (scheme, host, port), so we only pay for the
+        TCP and TLS handshakes once per connection instead of once per request.
+    Holds up to maxPerHost idle connections per host. Safe to share between
+        threads: a connection is only used by one request at a time.
+    If compress is true, asks for gzip/deflate responses and decodes them.
+    getStats() returns counts of requests, new connections, reused
+        connections, bytes received and bytes after decoding.
+    """
+    REDIRECTS = (301, 302, 303, 307, 308)
+    MAX_REDIRECTS = 5
+
+    def __init__(self,
+                maxPerHost=4,	# max num of idle connections kept per host
+                timeout=60,	# socket timeout (seconds)
+                compress=True,	# ask for gzip/deflate compressed responses
+                ):
+        self.maxPerHost = maxPerHost
+        self.timeout = timeout
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.idle = {}		# (scheme, host, port) -> [idle connections]
+        self.stats = {'requests': 0, 'connections': 0, 'reused': 0,
+                        'bytesReceived': 0, 'bytesDecoded': 0, }
+    #------------------------
+
+    def readURL(self, url,	# str, w/ any GET params already encoded
+                data=None,	# bytes, if doing a post
+                headers={},
+                timings=None,	# dict to fill in w/ request timings, see
+                                #   Instrumentation (of the last redirect)
+                ):
+        """ Return results (bytes) of the response from the URL.
+            Does a POST if data != None, else a GET.
+            Follows redirects.
+            Raises URLReadError with helpful msges for url errors like
+            readURL() above.
+        """
+        for i in range(self.MAX_REDIRECTS + 1):
+            status, respHeaders, body = self.request(url, data, headers,
+                                                                    timings)
+            if status in self.REDIRECTS and 'location' in respHeaders:
+                url = urllib.parse.urljoin(url, respHeaders['location'])
+                if status == 303:
+                    data = None
+                continue
+            break
+        if status >= 400:
+            raise URLReadError(url, code=status,
+                    retryAfter=parseRetryAfter(respHeaders.get('retry-after')))
+        return body
+    #------------------------
+
+    def request(self, url, data=None, headers={}, timings=None):
+        """ Send one request (no redirect handling)
+            Return (status, response headers dict w/ lower case names, body)
+            If timings (dict) is given, fill in 'connect' (0 for a reused
+            connection), 'ttfb', 'download', 'status', 'bytes' (received)
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        reqHeaders = {'Connection': 'keep-alive'}
+        if self.compress:
+            reqHeaders['Accept-Encoding'] = 'gzip, deflate'
+        if data != None:
+            reqHeaders['Content-Type'] = 'application/x-www-form-urlencoded'
+        reqHeaders.update(headers)
+        method = 'GET' if data == None else 'POST'
+
+        conn, reused = self._getConnection(key)
+        try:
+            try:
+                response = self._send(conn, method, path, data, reqHeaders,
+                                                                    timings)
+            except (http.client.HTTPException, ConnectionError):
+                if not reused:
+                    raise
+                # server closed the idle connection on us, try a new one
+                conn.close()
+                conn, reused = self._newConnection(key), False
+                response = self._send(conn, method, path, data, reqHeaders,
+                                                                    timings)
+            readStart = time.time()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise URLReadError(url, reason=e)
+        respHeaders = {k.lower(): v for k, v in response.getheaders()}
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._releaseConnection(key, conn)
+
+        bytesReceived = len(body)
+        if timings != None:
+            timings['download'] = time.time() - readStart
+            timings['status'] = response.status
+            timings['bytes'] = bytesReceived
+        body = decodeBody(body, respHeaders.get('content-encoding', ''))
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['reused'] += int(reused)
+            self.stats['bytesReceived'] += bytesReceived
+            self.stats['bytesDecoded'] += len(body)
+
+        return response.status, respHeaders, body
+    #------------------------
+
+    def _send(self, conn, method, path, data, headers, timings=None):
+        if timings != None:
+            timings['connect'] = 0.0
+            if conn.sock == None:	# new connection, time the handshakes
+                startTime = time.time()
+                conn.connect()
+                timings['connect'] = time.time() - startTime
+        sentTime = time.time()
+        conn.request(method, path, body=data, headers=headers)
+        response = conn.getresponse()
+        if timings != None:
+            timings['ttfb'] = time.time() - sentTime
+        return response
+    #------------------------
+
+    def _getConnection(self, key):
+        """ Return (connection, reused flag) for key """
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self._newConnection(key), False
+    #------------------------
+
+    def _newConnection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port,timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        with self.lock:
+            self.stats['connections'] += 1
+        return conn
+    #------------------------
+
+    def _releaseConnection(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.maxPerHost:
+                conns.append(conn)
+                conn = None
+        if conn != None:
+            conn.close()
+    #------------------------
+
+    def getStats(self):
+        """ Return dict of pool statistics (see class doc) """
+        with self.lock:
+            stats = dict(self.stats)
+            stats['idle'] = sum([len(c) for c in self.idle.values()])
+        return stats
+    #------------------------
+
+    def close(self):
+        """ Close all idle connections """
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+    #------------------------
+
+# end class ConnectionPool -------------------------
+
+class ResponseCache (object):
+    """
+    On-disk cache of responses (bytes), content addressed:
+        an entry's filename is the sha256 of its key, where a key is made
+        from any json-able values by makeKey(). Entries live in 256
+        subdirectories of cacheDir.
+    Each entry has its own expiration time (ttl seconds after it was saved).
+    The cache is bounded by maxBytes: when it gets too big, the least
+        recently used entries (oldest file mtimes, touched on each hit) are
+        deleted.
+    Entries are written to a temp file and renamed into place, so
+        concurrent processes sharing cacheDir never see partial entries.
+    If offline is true, a miss raises an Exception instead of returning
+        None, so callers never fall through to the network.
+    getStats() returns hit/miss/expired/store/eviction counts.
+    """
+    def __init__(self,
+                cacheDir,		# directory to keep the cache in
+                ttl=7*24*3600,		# default seconds an entry is good for
+                maxBytes=1024**3,	# max total size of the entries
+                offline=False,		# True = cache only, a miss is an error
+                ):
+        self.cacheDir = cacheDir
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0,
+                        'evictions': 0, }
+        os.makedirs(cacheDir, exist_ok=True)
+        self.totalBytes = self._scan()[1]	# estimate, other processes
+                                                #  may add entries too
+    #------------------------
+
+    def makeKey(self, *parts):
+        """ Return a key (hex str) for parts (json-able values)"""
+        normalized = json.dumps(parts, sort_keys=True, separators=(',',':'))
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    #------------------------
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key[:2], key)
+    #------------------------
+
+    def get(self, key):
+        """ Return the cached bytes for key, or None if not cached/expired
+            (or raise Exception if not cached and offline)
+        """
+        entry = self.getEntry(key)
+        return entry[0] if entry != None else None
+    #------------------------
+
+    def getEntry(self, key):
+        """ Return (cached bytes, meta dict) for key, or None.
+            (or raise Exception if not cached and offline)
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                header = json.loads(fp.readline())
+                data = fp.read()
+        except (OSError, ValueError):
+            header = None
+
+        if header != None and header['expires'] < time.time() \
+                                                        and not self.offline:
+            self._count('expired')
+            self._remove(path)
+            header = None
+
+        if header == None:
+            self._count('misses')
+            if self.offline:
+                raise Exception("Not in cache (offline mode), key: %s\n" \
+                                                                    % key)
+            return None
+
+        self._count('hits')
+        try:
+            os.utime(path)		# most recently used
+        except OSError:
+            pass
+        return data, header.get('meta', {})
+    #------------------------
+
+    def put(self, key,
+            data,		# bytes to cache
+            ttl=None,		# seconds. None = self.ttl
+            meta=None,		# optional json-able dict to keep w/ data
+            ):
+        """ Save data in the cache for key """
+        if ttl == None: ttl = self.ttl
+        header = {'expires': time.time() + ttl, 'meta': meta or {}}
+        header = json.dumps(header).encode('utf-8') + b'\n'
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path),
+                                                            prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(header)
+                fp.write(data)
+            os.replace(tmpPath, path)	# atomic
+        except BaseException:
+            self._remove(tmpPath)
+            raise
+
+        with self.lock:
+            self.stats['stores'] += 1
+            self.totalBytes += len(header) + len(data)
+            tooBig = self.totalBytes > self.maxBytes
+        if tooBig:
+            self.evict()
+    #------------------------
+
+    def evict(self):
+        """ Delete least recently used entries until the cache is down
+            to 90% of maxBytes.
+        """
+        entries, totalBytes = self._scan()
+        entries.sort()			# oldest mtime first
+        target = 0.9 * self.maxBytes
+        for mtime, size, path in entries:
+            if totalBytes <= target:
+                break
+            if self._remove(path):
+                totalBytes -= size
+                self._count('evictions')
+        with self.lock:
+            self.totalBytes = totalBytes
+    #------------------------
+
+    def _scan(self):
+        """ Return ([(mtime, size, path) for each entry], total size) """
+        entries = []
+        totalBytes = 0
+        for subdir in os.listdir(self.cacheDir):
+            subdir = os.path.join(self.cacheDir, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for fn in os.listdir(subdir):
+                if fn.startswith('.tmp'):
+                    continue
+                path = os.path.join(subdir, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:		# another process removed it
+                    continue
+                entries.append( (st.st_mtime, st.st_size, path) )
+                totalBytes += st.st_size
+        return entries, totalBytes
+    #------------------------
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+    #------------------------
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+    #------------------------
+
+    def getStats(self):
+        """ Return dict of cache counters (see class doc) """
+        with self.lock:
+            stats = dict(self.stats)
+            stats['bytes'] = self.totalBytes
+        return stats
+    #------------------------
+
+# end class ResponseCache -------------------------
+
+class RateLimiter (object):
+    """
+    Token bucket rate limiter.
+    Tokens accumulate at 'rate' per second, up to 'burst' tokens, so after
+        an idle spell up to 'burst' requests can go at once, but the long
+        term rate is never more than 'rate' per second.
+    Each acquire() takes a token, sleeping until one is available.
+        Tokens are reserved under a lock, so one RateLimiter can be shared by
+        many threads (acquire()) and asyncio tasks (acquireAsync()).
+    If lockFile is specified, the bucket state is kept in that file (locked
+        w/ flock while it is updated), so RateLimiters in different processes
+        on one host that use the same lockFile share one budget.
+    """
+    def __init__(self,
+                rate=3.0,	# float, tokens (requests) per second
+                burst=1,	# max num of tokens that can accumulate
+                lockFile=None,	# pathname of file to share the bucket
+                                #  across processes. None = this process only
+                ):
+        self.rate = float(rate)
+        self.burst = burst
+        self.lockFile = lockFile
+        self.lock = threading.Lock()
+        self.tokens = float(burst)	# bucket starts full
+        self.lastTime = time.time()	# when self.tokens was computed
+    #------------------------
+
+    def reserve(self, tokens=1):
+        """ Take 'tokens' from the bucket.
+            Return how long (float seconds) the caller needs to wait before
+            it can use them. (the bucket goes negative to hold reservations)
+        """
+        with self.lock:
+            if self.lockFile == None:
+                self.tokens, self.lastTime, wait = \
+                            self._take(self.tokens, self.lastTime, tokens)
+            else:
+                wait = self._reserveShared(tokens)
+        return wait
+    #------------------------
+
+    def acquire(self, tokens=1):
+        """ Block until 'tokens' are available """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+    #------------------------
+
+    async def acquireAsync(self, tokens=1):
+        """ asyncio version of acquire().
+            With a lockFile, the flock can be held by another process for a
+            while, so it is taken in the loop's default executor, not on the
+            event loop thread.
+        """
+        if self.lockFile == None:
+            wait = self.reserve(tokens)
+        else:
+            loop = asyncio.get_running_loop()
+            wait = await loop.run_in_executor(None, self.reserve, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+    #------------------------
+
+    def _take(self, curTokens, lastTime, tokens):
+        """ Refill the bucket since lastTime & take 'tokens' from it.
+            Return new (curTokens, lastTime, wait seconds)
+        """
+        now = time.time()
+        elapsed = max(now - lastTime, 0.0)
+        curTokens = min(float(self.burst), curTokens + elapsed * self.rate)
+        curTokens -= tokens
+        wait = 0.0
+        if curTokens < 0:
+            wait = -curTokens / self.rate
+        return curTokens, now, wait
+    #------------------------
+
+    def _reserveShared(self, tokens):
+        """ Reserve tokens from the bucket state saved in self.lockFile.
+            The file holds "tokens lastTime", an empty file is a full bucket.
+        """
+        fd = os.open(self.lockFile, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            state = os.read(fd, 100).split()
+            if len(state) == 2:
+                curTokens, lastTime = float(state[0]), float(state[1])
+            else:
+                curTokens, lastTime = float(self.burst), time.time()
+
+            curTokens, lastTime, wait = self._take(curTokens, lastTime, tokens)
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, b'%r %r' % (curTokens, lastTime))
+        finally:
+            os.close(fd)		# releases the flock
+        return wait
+    #------------------------
+
+# end class RateLimiter -------------------------
+
+class RetryPolicy (object):
+    """
+    Decides which failed URL reads to retry and how long to wait first.
+    Retries up to maxRetries times w/ exponential backoff:
+        backoff * 2**attempt seconds (at most maxBackoff), plus up to
+        'jitter' fraction of random extra so workers don't retry in lockstep.
+        If the server sent Retry-After, we wait at least that long.
+    Idempotency: 429 (too many requests) and 503 (unavailable) mean the server
+        did not process the request, so those are always retried.
+        Other failures (other retryCodes, no response at all) are only
+        retried for GETs, unless retryPosts is true.
+    """
+    def __init__(self,
+                maxRetries=5,		# max num of retries per read
+                backoff=1.0,		# seconds to wait before 1st retry
+                maxBackoff=60.0,	# max seconds to wait between retries
+                jitter=0.5,		# random extra wait, fraction of wait
+                retryCodes=(429, 500, 502, 503, 504),	# http codes to retry
+                retryPosts=False,	# True = retry all failed POSTs too
+                ):
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.jitter = jitter
+        self.retryCodes = retryCodes
+        self.retryPosts = retryPosts
+    #------------------------
+
+    def shouldRetry(self,
+                error,		# URLReadError
+                GET,		# True if the read was a GET
+                attempt,	# num of retries done already
+                ):
+        """ Return True if the read should be retried """
+        if attempt >= self.maxRetries:
+            return False
+        if error.code in (429, 503):	# not processed, safe to retry
+            return True
+        if error.code != None and error.code not in self.retryCodes:
+            return False		# e.g., 404, retrying won't help
+        return GET or self.retryPosts
+    #------------------------
+
+    def getDelay(self,
+                error,		# URLReadError
+                attempt,	# num of retries done already
+                ):
+        """ Return seconds to wait before the next retry """
+        wait = min(self.backoff * (2 ** attempt), self.maxBackoff)
+        wait += wait * self.jitter * random.random()
+        if error.retryAfter != None:
+            wait = max(wait, error.retryAfter)
+        return wait
+    #------------------------
+
+# end class RetryPolicy -------------------------
+
+class CircuitBreaker (object):
+    """
+    Pauses all the readers (and their threads) that share it when a server
+        keeps failing, instead of each of them hammering it.
+    After failureThreshold failures in a row, the circuit "opens" for
+        resetSeconds: getWait() tells every reader to wait until then.
+        After that, reads are let through again ("half open"); a success
+        closes the circuit, a failure opens it again.
+    Only server trouble counts as failure: no response, 429, and 5xx codes.
+    """
+    def __init__(self,
+                failureThreshold=5,	# num of failures in a row to open
+                resetSeconds=30.0,	# seconds to stay open
+                ):
+        self.failureThreshold = failureThreshold
+        self.resetSeconds = resetSeconds
+        self.lock = threading.Lock()
+        self.failures = 0	# num of failures in a row
+        self.openUntil = 0.0	# time the circuit closes (half opens)
+        self.halfOpen = False	# opened, and no success since
+        self.numOpens = 0	# num of times the circuit has opened
+    #------------------------
+
+    def getWait(self):
+        """ Return seconds to wait before reading (0 if circuit is closed) """
+        with self.lock:
+            return max(self.openUntil - time.time(), 0.0)
+    #------------------------
+
+    def wait(self):
+        """ Block until the circuit is not open """
+        wait = self.getWait()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.getWait()	# may have opened again meanwhile
+    #------------------------
+
+    async def waitAsync(self):
+        """ asyncio version of wait() """
+        wait = self.getWait()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.getWait()
+    #------------------------
+
+    def recordSuccess(self):
+        with self.lock:
+            self.failures = 0
+            self.halfOpen = False
+    #------------------------
+
+    def recordFailure(self,
+                error,		# URLReadError
+                ):
+        if error.code != None and error.code != 429 and error.code < 500:
+            return			# the request's problem, not the server's
+        with self.lock:
+            now = time.time()
+            if self.halfOpen:
+                if now < self.openUntil:
+                    return		# a read started before it opened
+                self._open(now)		# the trial read after opening failed
+                return
+            self.failures += 1
+            if self.failures >= self.failureThreshold:
+                self._open(now)
+    #------------------------
+
+    def _open(self, now):
+        """ Open the circuit. Call w/ self.lock held """
+        self.openUntil = now + self.resetSeconds
+        self.failures = 0
+        self.halfOpen = True
+        self.numOpens += 1
+    #------------------------
+
+# end class CircuitBreaker -------------------------
+
+class Histogram (object):
+    """
+    Counts of observed values in cumulative buckets (value <= bound), plus
+        their count and sum, like a Prometheus histogram.
+    Not thread safe by itself, see Instrumentation.
+    """
+    def __init__(self,
+                buckets,	# increasing upper bounds of the buckets
+                ):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)	# per bucket, not cumulative
+        self.count = 0
+        self.sum = 0.0
+    #------------------------
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            self.counts[i] += 1
+    #------------------------
+
+    def getCumulative(self):
+        """ Return [(upper bound, num of values <= bound)] incl. +Inf """
+        cumulative = list(itertools.accumulate(self.counts))
+        return list(zip(self.buckets, cumulative)) + [('+Inf', self.count)]
+    #------------------------
+
+    def toDict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': {str(b): n for b, n in self.getCumulative()}}
+    #------------------------
+
+# end class Histogram -------------------------
+
+class Instrumentation (object):
+    """
+    Collects per-request timings from a ThrottledURLReader (which calls
+        recordRequest(timings) for each request attempt, incl. retries).
+    timings is a dict w/ (when known):
+        'url', 'attempt' (0 = 1st try), 'status' (http code, None = no
+            response), 'error' (str), 'bytes' (received),
+        and seconds: 'throttleWait' (circuit breaker + rate limiter),
+            'connect' (TCP/TLS setup, 0 if connection reused, only w/ a
+            ConnectionPool), 'ttfb' (request sent to response headers
+            received, incl. connect w/o a ConnectionPool), 'download'
+            (reading the body), 'total' (the request, w/o throttleWait).
+    Keeps counters (requests by status, bytes) and a Histogram for each
+        time. Dump them w/ toJSON() or toPrometheus().
+    If slowSeconds is given, requests w/ throttleWait + total >= slowSeconds
+        are written (as json lines) to traceFile.
+    hooks are functions called w/ each timings dict.
+    Safe to share between threads and readers.
+    """
+    TIMES = ('throttleWait', 'connect', 'ttfb', 'download', 'total')
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                                                        10.0, 30.0, 60.0)
+    def __init__(self,
+                slowSeconds=None,	# trace requests slower than this.
+                                        #   None = no tracing
+                traceFile=None,		# file for traced requests, None=stderr
+                buckets=BUCKETS,	# histogram bucket bounds (seconds)
+                hooks=[],		# functions to call w/ each timings
+                ):
+        self.slowSeconds = slowSeconds
+        self.traceFile = traceFile
+        self.hooks = list(hooks)
+        self.lock = threading.Lock()
+        self.requests = {}		# str(status) -> num of requests
+        self.bytes = 0
+        self.histograms = {name: Histogram(buckets) for name in self.TIMES}
+    #------------------------
+
+    def recordRequest(self, timings):
+        with self.lock:
+            status = str(timings.get('status'))
+            self.requests[status] = self.requests.get(status, 0) + 1
+            self.bytes += timings.get('bytes', 0)
+            for name in self.TIMES:
+                if timings.get(name) != None:
+                    self.histograms[name].observe(timings[name])
+        for hook in self.hooks:
+            hook(timings)
+        if self.slowSeconds != None and timings.get('throttleWait', 0) + \
+                                timings.get('total', 0) >= self.slowSeconds:
+            line = json.dumps(timings, sort_keys=True) + '\n'
+            fp = self.traceFile or sys.stderr
+            with self.lock:			# one whole line at a time
+                fp.write(line)
+                fp.flush()
+    #------------------------
+
+    def getStats(self):
+        """ Return dict of the counters and histograms """
+        with self.lock:
+            return {'requests': dict(self.requests), 'bytes': self.bytes,
+                    'seconds': {name: h.toDict() for name, h in
+                                                    self.histograms.items()}}
+    #------------------------
+
+    def toJSON(self):
+        return json.dumps(self.getStats(), sort_keys=True)
+    #------------------------
+
+    def toPrometheus(self,
+                prefix='http_client',	# metric name prefix
+                ):
+        """ Return the counters and histograms in Prometheus text format """
+        lines = []
+        with self.lock:
+            name = prefix + '_requests_total'
+            lines += ['# HELP %s Requests by http status.' % name,
+                        '# TYPE %s counter' % name]
+            for status, n in sorted(self.requests.items()):
+                lines.append('%s{status="%s"} %d' % (name, status, n))
+            name = prefix + '_received_bytes_total'
+            lines += ['# HELP %s Response bytes received.' % name,
+                        '# TYPE %s counter' % name, '%s %d' % (name, self.bytes)]
+            for timeName in self.TIMES:
+                h = self.histograms[timeName]
+                name = '%s_%s_seconds' % (prefix,
+                                re.sub('([A-Z])', r'_\1', timeName).lower())
+                lines += ['# HELP %s Request %s time.' % (name, timeName),
+                            '# TYPE %s histogram' % name]
+                for bound, n in h.getCumulative():
+                    lines.append('%s_bucket{le="%s"} %d' % (name, bound, n))
+                lines += ['%s_sum %s' % (name, repr(h.sum)),
+                            '%s_count %d' % (name, h.count)]
+        return '\n'.join(lines) + '\n'
+    #------------------------
+
+# end class Instrumentation -------------------------
+
 class ThrottledURLReader (object):
     """
     Provides a "read from a URL" method with a specified number (float) of
         seconds between reads so we don't overwhelm our welcome at a site.
+    Can be shared by several threads: each read reserves the next available
+        start time, so reads are spaced across all the threads.
+    Instead of a fixed spacing, you can pass a RateLimiter to allow bursts
+        or to share the rate budget with other readers and processes.
+    Pass a ConnectionPool to reuse keep-alive connections across reads.
+    Pass a RetryPolicy to retry failed reads, and a CircuitBreaker (which
+        may be shared by several readers) to pause when a server is down.
+    Pass an Instrumentation (or any object w/ a recordRequest(timings)
+        method) to get the timings of each request (attempt).
+    getStats() returns read/failure/retry counts and read latencies.
     """
     def __init__(self,
-                seconds=0.5	# float, minimum num of seconds between reads
+                seconds=0.5,	# float, minimum num of seconds between reads
+                rateLimiter=None,	# RateLimiter to use instead of seconds
+                pool=None,	# ConnectionPool to use, None = new connections
+                retryPolicy=None,	# RetryPolicy, None = no retries
+                circuitBreaker=None,	# CircuitBreaker, None = no breaker
+                instrumentation=None,	# Instrumentation, None = none
                 ):
         self.minSeconds = seconds
-        self.lastReadTime = 0.0	# initial last read was the beginning of time!
+        self.instrumentation = instrumentation
+        self.pool = pool
+        if rateLimiter == None and seconds > 0:
+            rateLimiter = RateLimiter(rate=1.0/seconds, burst=1)
+        self.rateLimiter = rateLimiter	# None means don't throttle
+        self.retryPolicy = retryPolicy
+        self.circuitBreaker = circuitBreaker
+        self.statsLock = threading.Lock()
+        self.stats = {'reads': 0, 'failures': 0, 'retries': 0,
+                    'failuresByCode': {}, 'latencySum': 0.0, 'latencyMax': 0.0, }
     #------------------------
 
     def readURL(self, url,
@@ -66,19 +964,272 @@ class ThrottledURLReader (object):
                 headers={},
                 ):
         """ see readURL() above"""
-        secondsSinceLast = time.time() - self.lastReadTime
-        if secondsSinceLast < self.minSeconds:
-            #print "sleeping for %10.7f" % (self.minSeconds - secondsSinceLast)
-            time.sleep(self.minSeconds - secondsSinceLast)
+        return self._withRetries(url, GET, lambda timings: readURL(url,
+                            GET=GET, params=params, headers=headers,
+                            pool=self.pool, timings=timings))
+    #------------------------
+
+    def openURL(self, url,
+                GET=True,
+                params=None,
+                headers={},
+                ):
+        """ see openURL() above. (throttled, but does not use self.pool)"""
+        return self._withRetries(url, GET, lambda timings: openURL(url,
+                            GET=GET, params=params, headers=headers,
+                            timings=timings))
+    #------------------------
+
+    def _withRetries(self, url, GET, read):
+        """ Return read(timings) result, after throttling. Retry as needed.
+        """
+        attempt = 0
+        while True:
+            waitStart = time.time()
+            if self.circuitBreaker != None:
+                self.circuitBreaker.wait()
+            if self.rateLimiter != None:
+                self.rateLimiter.acquire()
+
+            startTime = time.time()
+            timings = None
+            if self.instrumentation != None:
+                timings = {'url': url, 'attempt': attempt,
+                                        'throttleWait': startTime - waitStart}
+            try:
+                output = read(timings)
+            except URLReadError as e:
+                self._countRead(startTime, e)
+                if timings != None:
+                    timings['status'] = e.code
+                    timings['error'] = str(e)
+                    timings['total'] = time.time() - startTime
+                    self.instrumentation.recordRequest(timings)
+                if self.circuitBreaker != None:
+                    self.circuitBreaker.recordFailure(e)
+                if self.retryPolicy == None or \
+                            not self.retryPolicy.shouldRetry(e, GET, attempt):
+                    raise
+                with self.statsLock:
+                    self.stats['retries'] += 1
+                time.sleep(self.retryPolicy.getDelay(e, attempt))
+                attempt += 1
+                continue
 
-        output = readURL(url, GET=GET, params=params, headers=headers)
-        self.lastReadTime = time.time()
+            self._countRead(startTime)
+            if timings != None:
+                timings['total'] = time.time() - startTime
+                self.instrumentation.recordRequest(timings)
+            if self.circuitBreaker != None:
+                self.circuitBreaker.recordSuccess()
+            return output
+    #------------------------
+
+    def _countRead(self, startTime, error=None):
+        latency = time.time() - startTime
+        with self.statsLock:
+            self.stats['reads'] += 1
+            self.stats['latencySum'] += latency
+            self.stats['latencyMax'] = max(self.stats['latencyMax'], latency)
+            if error != None:
+                self.stats['failures'] += 1
+                byCode = self.stats['failuresByCode']
+                code = str(error.code)		# 'None' = no response
+                byCode[code] = byCode.get(code, 0) + 1
+    #------------------------
 
-        return output
+    def getStats(self):
+        """ Return dict of read statistics.
+            'failuresByCode' counts failed reads by http code ('None' = no
+            response). 'retries' = num of failed reads that were retried.
+            latencies are in seconds.
+        """
+        with self.statsLock:
+            stats = dict(self.stats)
+            stats['failuresByCode'] = dict(stats['failuresByCode'])
+        if stats['reads']:
+            stats['latencyAvg'] = stats['latencySum'] / stats['reads']
+        if self.circuitBreaker != None:
+            stats['circuitOpens'] = self.circuitBreaker.numOpens
+        return stats
     #------------------------
 
 # end class ThrottledURLReader -------------------------
 
+class AsyncURLReader (object):
+    """
+    asyncio counterpart of ThrottledURLReader: 'await reader.readURL(url...)'
+    Uses non-blocking sockets (asyncio streams), so many reads can be in
+        progress at once in one thread. At most maxConcurrent reads have
+        connections open at a time, and reads are throttled by the
+        rateLimiter (which may be shared with threads and other processes).
+    Each read is limited to 'timeout' seconds (raises asyncio.TimeoutError,
+        not a URLReadError, so it is not retried).
+        Cancelling the task doing a read closes its connection.
+    Only does HTTP/1.1 with one request per connection.
+    Follows up to MAX_REDIRECTS redirects like urllib (a POST redirected
+        w/ 301/302/303 becomes a GET), and raises URLReadError w/ the 3xx
+        code if there are more.
+    Takes a RetryPolicy and CircuitBreaker like ThrottledURLReader.
+    Can be used from more than one event loop (e.g., successive
+        asyncio.run() calls), maxConcurrent applies per loop.
+    """
+    MAX_REDIRECTS = 5
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+    def __init__(self,
+                seconds=0.5,	# float, minimum num of seconds between reads
+                rateLimiter=None,	# RateLimiter to use instead of seconds
+                maxConcurrent=10,	# max num of reads in progress at once
+                timeout=60,	# max seconds for a read, None = no timeout
+                retryPolicy=None,	# RetryPolicy, None = no retries
+                circuitBreaker=None,	# CircuitBreaker, None = no breaker
+                ):
+        self.retryPolicy = retryPolicy
+        self.circuitBreaker = circuitBreaker
+        if rateLimiter == None and seconds > 0:
+            rateLimiter = RateLimiter(rate=1.0/seconds, burst=1)
+        self.rateLimiter = rateLimiter	# None means don't throttle
+        self.maxConcurrent = maxConcurrent
+        self.timeout = timeout
+        self.semaphores = weakref.WeakKeyDictionary()	# event loop ->
+                                # Semaphore, as they belong to one loop
+    #------------------------
+
+    async def readURL(self, url,
+                GET=True,
+                params=None,
+                headers={},
+                ):
+        """ see readURL() above"""
+        data = params
+        if params != None and GET == True:
+            url = url + '?' +  urllib.parse.urlencode(params)
+            data = None
+
+        attempt = 0
+        while True:
+            if self.circuitBreaker != None:
+                await self.circuitBreaker.waitAsync()
+            try:
+                body = await self._read(url, data, headers)
+            except URLReadError as e:
+                if self.circuitBreaker != None:
+                    self.circuitBreaker.recordFailure(e)
+                if self.retryPolicy == None or \
+                    not self.retryPolicy.shouldRetry(e, data == None, attempt):
+                    raise
+                await asyncio.sleep(self.retryPolicy.getDelay(e, attempt))
+                attempt += 1
+                continue
+            if self.circuitBreaker != None:
+                self.circuitBreaker.recordSuccess()
+            return body
+    #------------------------
+
+    def _getSemaphore(self):
+        """ Return the semaphore for the running event loop """
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore == None:
+            semaphore = asyncio.Semaphore(self.maxConcurrent)
+            self.semaphores[loop] = semaphore
+        return semaphore
+    #------------------------
+
+    async def _read(self, url, data, headers):
+        """ One throttled read (following redirects), return body """
+        numRedirects = 0
+        while True:
+            async with self._getSemaphore():
+                if self.rateLimiter != None:
+                    await self.rateLimiter.acquireAsync()
+                try:
+                    status, respHeaders, body = await asyncio.wait_for(
+                            self._request(url, data, headers), self.timeout)
+                except asyncio.TimeoutError:	# an OSError in python 3.11+
+                    raise
+                except (OSError, ValueError, IndexError,
+                                        asyncio.IncompleteReadError) as e:
+                    raise URLReadError(url, reason=e)
+            if status in self.REDIRECT_CODES and 'location' in respHeaders \
+                                    and numRedirects < self.MAX_REDIRECTS:
+                url = urllib.parse.urljoin(url, respHeaders['location'])
+                if status in (301, 302, 303):
+                    data = None		# becomes a GET
+                numRedirects += 1
+                continue
+            if status >= 300:
+                raise URLReadError(url, code=status,
+                    retryAfter=parseRetryAfter(respHeaders.get('retry-after')))
+            return body
+    #------------------------
+
+    async def _request(self, url, data, headers):
+        """ Send one request, return (status, response headers dict, body) """
+        parts = urllib.parse.urlsplit(url)
+        isHttps = parts.scheme == 'https'
+        port = parts.port or (443 if isHttps else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        reqHeaders = {'Host': parts.netloc, 'Connection': 'close',
+                        'Accept-Encoding': 'gzip, deflate', }
+        if data != None:
+            reqHeaders['Content-Type'] = 'application/x-www-form-urlencoded'
+            reqHeaders['Content-Length'] = str(len(data))
+        reqHeaders.update(headers)
+        method = 'GET' if data == None else 'POST'
+
+        request = '%s %s HTTP/1.1\r\n' % (method, path)
+        request += ''.join(['%s: %s\r\n' % h for h in reqHeaders.items()])
+        request = request.encode('latin-1') + b'\r\n' + (data or b'')
+
+        sslContext = ssl.create_default_context() if isHttps else None
+        reader, writer = await asyncio.open_connection(parts.hostname, port,
+                                                            ssl=sslContext)
+        try:
+            writer.write(request)
+            await writer.drain()
+
+            statusLine = await reader.readline()
+            status = int(statusLine.split()[1])
+            respHeaders = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, value = line.decode('latin-1').split(':', 1)
+                respHeaders[name.strip().lower()] = value.strip()
+
+            if respHeaders.get('transfer-encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b';')[0], 16)
+                    if size == 0:
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readline()		# CRLF after chunk
+                body = b''.join(chunks)
+            elif 'content-length' in respHeaders:
+                body = await reader.readexactly(
+                                        int(respHeaders['content-length']))
+            else:
+                body = await reader.read()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass			# already dropped, nothing to close
+
+        body = decodeBody(body, respHeaders.get('content-encoding', ''))
+        return status, respHeaders, body
+    #------------------------
+
+# end class AsyncURLReader -------------------------
+
 if __name__ == "__main__":	# test code
     r = ThrottledURLReader(seconds=0.5)
     for i in [1,2,3,4]:
@@ -86,3 +1237,10 @@ if __name__ == "__main__":	# test code
         print("read %d, time: %10.7f" % (i,time.time()))
         print(x[:100])
 
+    r = ThrottledURLReader(seconds=0.5, pool=ConnectionPool())
+    for i in [1,2,3,4]:
+        x = r.readURL("https://www.python.org")
+        print("pooled read %d, time: %10.7f" % (i,time.time()))
+        print(x[:100])
+    print(r.pool.getStats())
+
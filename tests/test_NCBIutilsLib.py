@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+
+import sys
+import unittest
+import threading
+import asyncio
+import json
+import time
+import tempfile
+import datetime
+import urllib.parse
+import simpleURLLib as surl
+from NCBIutilsLib import *
+
+"""
+These are tests for NCBIutilsLib.py
+They do not talk to NCBI, they use FakeURLReader below instead.
+
+Usage:   python test_NCBIutilsLib.py [-v]
+"""
+######################################
+
+class FakeURLReader (object):
+    """ Stands in for a ThrottledURLReader.
+        Remembers the URLs it is asked to read and returns the url as bytes
+        (or epost style xml for epost).
+    """
+    def __init__(self):
+        self.urls = []
+        self.lock = threading.Lock()
+
+    def readURL(self, url, GET=True, params=None, headers={}):
+        with self.lock:
+            self.urls.append(url)
+        if url == EPOST_BASE:
+            return b'<ePostResult><QueryKey>1</QueryKey>' + \
+                    b'<WebEnv>W</WebEnv></ePostResult>'
+        return url.encode()
+# end class FakeURLReader
+
+class FakeAsyncURLReader (FakeURLReader):
+    """ async version of FakeURLReader """
+    async def readURL(self, url, GET=True, params=None, headers={}):
+        return FakeURLReader.readURL(self, url, GET, params, headers)
+# end class FakeAsyncURLReader
+
+class getResults_tests(unittest.TestCase):
+    def setUp(self):
+        self.reader = FakeURLReader()
+
+    def test_getResults_retmax(self):
+        getResults('pubmed', '&webenv=W&query_key=1', retmode='json',
+                                    retmax=10000, URLReader=self.reader)
+        self.assertIn('&retmax=500', self.reader.urls[0])
+        self.assertNotIn('retstart', self.reader.urls[0])
+
+    def test_getResults_retstart(self):
+        getResults('pubmed', '&webenv=W&query_key=1', retstart=20000,
+                                                    URLReader=self.reader)
+        self.assertIn('&retmax=10000&retstart=20000', self.reader.urls[0])
+# end class getResults_tests
+
+class iterResultPages_tests(unittest.TestCase):
+    def setUp(self):
+        self.reader = FakeURLReader()
+
+    def test_iterResultPages_order(self):
+        pages = list(iterResultPages('pubmed', '&webenv=W&query_key=1', 25,
+                        pageSize=10, numWorkers=3, URLReader=self.reader))
+        self.assertEqual([start for start, output in pages], [0, 10, 20])
+        self.assertIn(b'&retstart=10', pages[1][1])
+        self.assertEqual(len(self.reader.urls), 3)
+
+    def test_iterResultPages_pageSize(self):
+        pages = list(iterResultPages('pubmed', '&webenv=W&query_key=1', 1200,
+                        retmode='json', URLReader=self.reader))
+        self.assertEqual([start for start, output in pages], [0, 500, 1000])
+
+    def test_iterResultPages_empty(self):
+        pages = list(iterResultPages('pubmed', '&webenv=W&query_key=1', 0,
+                        URLReader=self.reader))
+        self.assertEqual(pages, [])
+
+    def test_iterResultPages_noWorkers(self):
+        pages = list(iterResultPages('pubmed', '&webenv=W&query_key=1', 25,
+                        pageSize=10, numWorkers=0, URLReader=self.reader))
+        self.assertEqual([start for start, output in pages], [0, 10, 20])
+# end class iterResultPages_tests
+
+class parseOutput_tests(unittest.TestCase):
+    def test_parseSearchOutput(self):
+        output = b'<eSearchResult><Count>42</Count><RetMax>20</RetMax>' + \
+                b'<QueryKey>1</QueryKey><WebEnv>MCID_X</WebEnv></eSearchResult>'
+        count, webenv = parseSearchOutput(output)
+        self.assertEqual(count, 42)
+        self.assertEqual(webenv, '&webenv=MCID_X&query_key=1')
+
+    def test_parsePostOutput(self):
+        output = b'<ePostResult><QueryKey>1</QueryKey>' + \
+                b'<WebEnv>MCID_X</WebEnv></ePostResult>'
+        self.assertEqual(parsePostOutput(output), '&webenv=MCID_X&query_key=1')
+
+    def test_parsePostOutput_error(self):
+        output = b'<ePostResult><ERROR>Invalid WebEnv</ERROR></ePostResult>'
+        with self.assertRaisesRegex(Exception, 'Invalid WebEnv'):
+            parsePostOutput(output)
+        with self.assertRaises(Exception):
+            parsePostOutput(b'<ePostResult></ePostResult>')
+# end class parseOutput_tests
+
+class iterXMLRecords_tests(unittest.TestCase):
+    def setUp(self):
+        self.xml = b'<?xml version="1.0" ?>\n<PubmedArticleSet>' + \
+            b'<PubmedArticle><MedlineCitation><PMID>1</PMID>' + \
+            b'</MedlineCitation></PubmedArticle>' + \
+            b'<PubmedArticle><MedlineCitation><PMID>2</PMID>' + \
+            b'<PubmedArticle><PMID>nested</PMID></PubmedArticle>' + \
+            b'</MedlineCitation></PubmedArticle>' + \
+            b'<PubmedBookArticle><PMID>3</PMID></PubmedBookArticle>' + \
+            b'</PubmedArticleSet>'
+        self.tags = RECORD_TAGS[('pubmed', 'fetch')]
+
+    def test_iterXMLRecords_bytes(self):
+        pmids = [r.findtext('.//PMID') for r in
+                                    iterXMLRecords(self.xml, self.tags)]
+        self.assertEqual(pmids, ['1', '2', '3'])
+
+    def test_iterXMLRecords_chunks(self):
+        chunks = [self.xml[i:i+7] for i in range(0, len(self.xml), 7)]
+        rcds = list(iterXMLRecords(chunks, 'PubmedArticle'))
+        self.assertEqual([r.tag for r in rcds], ['PubmedArticle']*2)
+        self.assertEqual(rcds[1].findtext('MedlineCitation/PMID'), '2')
+
+    def test_iterXMLRecords_file(self):
+        import io
+        rcds = list(iterXMLRecords(io.BytesIO(self.xml), self.tags))
+        self.assertEqual(len(rcds), 3)
+# end class iterXMLRecords_tests
+
+class cache_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cache = surl.ResponseCache(self.tmpDir.name)
+        self.reader = FakeURLReader()
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_getPostResults_cache(self):
+        output1, webenv1 = getPostResults('pubmed', [1, b'2'],
+                                cache=self.cache, URLReader=self.reader)
+        self.assertEqual(len(self.reader.urls), 2)
+        output2, webenv2 = getPostResults('pubmed', ['1', '2'],
+                                cache=self.cache, URLReader=self.reader)
+        self.assertEqual(len(self.reader.urls), 2)	# no new requests
+        self.assertEqual(output1, output2)
+        self.assertEqual(webenv2, webenv1)		# saved w/ the output
+        self.assertIn('webenv=W', webenv2)
+
+        getPostResults('pubmed', [1, 2], retmode='json', cache=self.cache,
+                                                    URLReader=self.reader)
+        self.assertEqual(len(self.reader.urls), 4)	# different params
+# end class cache_tests
+
+class FakeSummaryReader (FakeURLReader):
+    """ FakeURLReader that returns esummary json for the posted ids
+        (except id 999, that eutils "does not know")
+    """
+    def readURL(self, url, GET=True, params=None, headers={}):
+        if url == EPOST_BASE:
+            self.posted = params.split(b'&id=')[1].decode().split(',')
+        output = FakeURLReader.readURL(self, url, GET, params, headers)
+        if url == EPOST_BASE:
+            return output
+        uids = [uid for uid in self.posted if uid != '999']
+        result = {'uids': uids}
+        for uid in uids:
+            result[uid] = {'uid': uid, 'title': 'title ' + uid}
+        return json.dumps({'result': result}).encode()
+# end class FakeSummaryReader
+
+class RecordStore_tests(unittest.TestCase):
+    def setUp(self):
+        self.store = RecordStore(':memory:')
+        self.reader = FakeSummaryReader()
+
+    def test_getPostRecords(self):
+        rcds = getPostRecords('pubmed', [1, 2], self.store, retmode='json',
+                                                    URLReader=self.reader)
+        self.assertEqual([uid for uid, rcd in rcds], ['1', '2'])
+        self.assertEqual(json.loads(rcds[1][1])['title'], 'title 2')
+        self.assertEqual(self.reader.posted, ['1', '2'])
+
+        rcds = getPostRecords('pubmed', [3, 2, 999, 1], self.store,
+                                    retmode='json', URLReader=self.reader)
+        self.assertEqual(self.reader.posted, ['3', '999'])	# just misses
+        self.assertEqual([uid for uid, rcd in rcds], ['3', '2', '999', '1'])
+        self.assertEqual(json.loads(rcds[0][1])['title'], 'title 3')
+        self.assertEqual(rcds[2][1], None)
+
+        self.reader.posted = None
+        rcds = getPostRecords('pubmed', [999, 2], self.store,
+                                    retmode='json', URLReader=self.reader)
+        self.assertEqual(self.reader.posted, None)	# nothing posted
+        self.assertEqual(rcds[0], ('999', None))
+
+    def test_splitRecords_xml(self):
+        output = b'<eSummaryResult><DocumentSummarySet>' + \
+                b'<DocumentSummary uid="11"><Title>a</Title></DocumentSummary>'+\
+                b'<DocumentSummary uid="12"><Title>b</Title></DocumentSummary>'+\
+                b'</DocumentSummarySet></eSummaryResult>'
+        rcds = splitRecords('pubmed', output)
+        self.assertEqual(sorted(rcds.keys()), ['11', '12'])
+        self.assertIn(b'<Title>b</Title>', rcds['12'])
+
+    def test_splitRecords_medline(self):
+        output = b'\nPMID- 1\nTI  - one\n\nPMID- 2\nTI  - two\n      more\n'
+        rcds = splitRecords('pubmed', output, op='fetch', retmode='text',
+                                                            rettype='medline')
+        self.assertEqual(rcds['2'], b'PMID- 2\nTI  - two\n      more\n')
+# end class RecordStore_tests
+
+class iterPostResults_tests(unittest.TestCase):
+    def setUp(self):
+        self.reader = FakeURLReader()
+
+    def test_iterPostResults(self):
+        done = []
+        def progress(batchNum, numBatches, numIds):
+            done.append( (batchNum, numBatches, numIds) )
+        batches = list(iterPostResults('pubmed', list(range(25)), batchSize=10,
+                                progress=progress, URLReader=self.reader))
+        self.assertEqual([b[0] for b in batches],
+                    [list(range(10)), list(range(10,20)), list(range(20,25))])
+        self.assertIn(b'&retmax=5', batches[2][1])
+        self.assertEqual(done, [(1, 3, 10), (2, 3, 20), (3, 3, 25)])
+        self.assertEqual(self.reader.urls.count(EPOST_BASE), 3)
+
+    def test_getPostParams_webenv(self):
+        params = getPostParams('pubmed', [1, 2], webenv='W')
+        self.assertTrue(params.endswith(b'&db=pubmed&WebEnv=W&id=1,2'))
+        self.assertEqual(decodeWebenvURLParams('&webenv=W&query_key=3'),
+                                                                ('W', '3'))
+# end class iterPostResults_tests
+
+class summary_tests(unittest.TestCase):
+    def setUp(self):
+        self.rcd = SummaryRecord(28440906, 'A title', 'Aging Cell', '2017 Jun',
+                                    ('Smith J', 'Jones K'), '10.1111/acel.12599')
+
+    def test_parseSummaryJSON(self):
+        output = json.dumps({'result': {'uids': ['28440906'],
+                '28440906': {'uid': '28440906', 'title': 'A title',
+                'source': 'Aging Cell', 'pubdate': '2017 Jun',
+                'authors': [{'name': 'Smith J', 'authtype': 'Author'},
+                            {'name': 'Jones K', 'authtype': 'Author'},
+                            {'name': 'Some Group', 'authtype': 'CollectiveName'}],
+                'articleids': [{'idtype': 'pubmed', 'value': '28440906'},
+                            {'idtype': 'doi', 'value': '10.1111/acel.12599'}],
+                }}})
+        summaries = parseSummary(output, retmode='json')
+        self.assertEqual(list(summaries), [self.rcd])
+
+    def test_parseSummaryXML_v2(self):
+        output = b'<eSummaryResult><DocumentSummarySet>' + \
+            b'<DocumentSummary uid="28440906"><Title>A title</Title>' + \
+            b'<Source>Aging Cell</Source><PubDate>2017 Jun</PubDate>' + \
+            b'<Authors><Author><Name>Smith J</Name><AuthType>Author</AuthType>'+\
+            b'</Author><Author><Name>Jones K</Name></Author></Authors>' + \
+            b'<ArticleIds><ArticleId><IdType>doi</IdType>' + \
+            b'<Value>10.1111/acel.12599</Value></ArticleId></ArticleIds>' + \
+            b'</DocumentSummary></DocumentSummarySet></eSummaryResult>'
+        self.assertEqual(list(parseSummaryXML(output)), [self.rcd])
+
+    def test_parseSummaryXML_v1(self):
+        output = b'<eSummaryResult><DocSum><Id>28440906</Id>' + \
+            b'<Item Name="PubDate" Type="Date">2017 Jun</Item>' + \
+            b'<Item Name="Source" Type="String">Aging Cell</Item>' + \
+            b'<Item Name="AuthorList" Type="List">' + \
+            b'<Item Name="Author" Type="String">Smith J</Item>' + \
+            b'<Item Name="Author" Type="String">Jones K</Item></Item>' + \
+            b'<Item Name="Title" Type="String">A title</Item>' + \
+            b'<Item Name="DOI" Type="String">10.1111/acel.12599</Item>' + \
+            b'</DocSum></eSummaryResult>'
+        self.assertEqual(list(parseSummaryXML(output)), [self.rcd])
+
+    def test_SummaryColumns(self):
+        other = SummaryRecord(1, 'T', 'Aging Cell', '2017 Jun', (), None)
+        summaries = SummaryColumns([self.rcd, other])
+        self.assertEqual(len(summaries), 2)
+        self.assertEqual(summaries[1], other)
+        columns = summaries.toColumns()
+        self.assertEqual(columns['uid'], [28440906, 1])
+        self.assertEqual(columns['authors'], [('Smith J', 'Jones K'), ()])
+        self.assertIs(summaries.journals[0], summaries.journals[1]) # interned
+
+    def test_SummaryRecord_hash(self):
+        same = SummaryRecord(28440906, 'A title', 'Aging Cell', '2017 Jun',
+                                ('Smith J', 'Jones K'), '10.1111/acel.12599')
+        self.assertEqual(hash(same), hash(self.rcd))
+        self.assertEqual(len(set([self.rcd, same])), 1)
+        self.assertEqual(self.rcd.uid, 28440906)
+# end class summary_tests
+
+class FakeHistoryServer (FakeURLReader):
+    """ Keeps webenvs and their query_keys like the eutils history server.
+        forget() drops all webenvs, like the server does after a while.
+    """
+    def __init__(self):
+        FakeURLReader.__init__(self)
+        self.webenvs = {}		# webenv -> num of query_keys
+
+    def forget(self):
+        self.webenvs = {}
+
+    def readURL(self, url, GET=True, params=None, headers={}):
+        FakeURLReader.readURL(self, url, GET, params, headers)
+        if 'term=bad' in url:
+            return b'<eSearchResult><ERROR>Invalid query</ERROR>' + \
+                    b'</eSearchResult>'
+        if url.startswith(ESUMMARY_BASE):
+            webenv = url.split('webenv=')[1].split('&')[0]
+            if webenv not in self.webenvs:
+                return b'<eSummaryResult><ERROR>Unable to obtain query #1' + \
+                        b'</ERROR></eSummaryResult>'
+            return url.encode()
+        if url == EPOST_BASE:
+            webenv = params.decode().split('WebEnv=')[-1].split('&')[0]
+        else:
+            webenv = url.split('WebEnv=')[-1] if 'WebEnv=' in url else ''
+        if webenv not in self.webenvs:
+            if webenv:
+                return b'<eSearchResult><ERROR>Invalid WebEnv</ERROR>' + \
+                        b'</eSearchResult>'
+            webenv = 'W%d' % (len(self.urls))
+            self.webenvs[webenv] = 0
+        self.webenvs[webenv] += 1
+        key = self.webenvs[webenv]
+        return ('<r><Count>%d</Count><QueryKey>%d</QueryKey>' \
+                '<WebEnv>%s</WebEnv></r>' % (10 * key, key, webenv)).encode()
+# end class FakeHistoryServer
+
+class EutilsSession_tests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeHistoryServer()
+        self.session = EutilsSession('pubmed', URLReader=self.server)
+
+    def test_one_webenv(self):
+        count, key1 = self.session.search('cancer')
+        key2 = self.session.post([1, 2])
+        count, key3 = self.session.combine('#1 AND #2')
+        self.assertEqual((key1, key2, key3), ('1', '2', '3'))
+        self.assertEqual(count, 30)
+        self.assertEqual(len(self.server.webenvs), 1)
+        self.assertIn('term=%231+AND+%232', self.server.urls[-1])
+
+    def test_recreate_when_forgotten(self):
+        self.session.search('cancer')
+        self.session.post([1, 2])
+        self.server.forget()
+        output = self.session.getResults('2')
+        self.assertIn(b'query_key=2', output)
+        self.assertEqual(self.session.numRecreated, 1)
+        self.assertIn(self.session.webenv, self.server.webenvs)
+
+    def test_recreate_when_idle(self):
+        self.session.search('cancer')
+        self.session.lastUsed -= 2 * self.session.maxIdle
+        count, key = self.session.search('aging')
+        self.assertEqual(key, '2')
+        self.assertEqual(self.session.numRecreated, 1)
+        self.assertEqual(len(self.server.webenvs), 2)
+
+    def test_recreate_when_post_expired(self):
+        self.session.search('cancer')
+        self.server.forget()
+        key = self.session.post([1, 2])
+        self.assertEqual(key, '2')
+        self.assertEqual(self.session.numRecreated, 1)
+        self.assertIn(self.session.webenv, self.server.webenvs)
+
+    def test_no_recreate_for_other_errors(self):
+        self.session.search('cancer')
+        with self.assertRaisesRegex(Exception, 'Invalid query'):
+            self.session.search('bad')
+        self.assertEqual(self.session.numRecreated, 0)
+        self.assertEqual(len(self.server.urls), 2)
+
+    def test_isHistoryError(self):
+        self.assertTrue(isHistoryError(b'<eSummaryResult><ERROR>' +
+                    b'Unable to obtain query #1</ERROR></eSummaryResult>'))
+        self.assertFalse(isHistoryError(
+                    b'<eSearchResult><ERROR>Invalid query</ERROR>'))
+        self.assertFalse(isHistoryError(b'<r>query WebEnv</r>'))
+# end class EutilsSession_tests
+
+class FakeDatedServer (FakeURLReader):
+    """ esearch/efetch over self.records: {pmid: (datetime.date, text)}.
+        The webenv is the date window searched.
+    """
+    def __init__(self, records):
+        FakeURLReader.__init__(self)
+        self.records = records
+
+    def readURL(self, url, GET=True, params=None, headers={}):
+        FakeURLReader.readURL(self, url, GET, params, headers)
+        p = dict(urllib.parse.parse_qsl(url.split('?')[1]))
+        if url.startswith(ESEARCH_BASE):
+            webenv = p['mindate'] + '-' + p['maxdate']
+            return ('<r><Count>%d</Count><QueryKey>1</QueryKey>' \
+                    '<WebEnv>%s</WebEnv></r>' % (len(self._search(webenv)),
+                                                        webenv)).encode()
+        pmids = self._search(p['webenv'])
+        start = int(p.get('retstart', 0))
+        pmids = pmids[start:start + int(p['retmax'])]
+        return b'<PubmedArticleSet>' + b''.join([('<PubmedArticle>' \
+                    '<MedlineCitation><PMID>%s</PMID><T>%s</T>' \
+                    '</MedlineCitation></PubmedArticle>' % (pmid,
+                    self.records[pmid][1])).encode() for pmid in pmids]) + \
+                b'</PubmedArticleSet>'
+
+    def _search(self, webenv):
+        lo, hi = webenv.split('-')
+        return sorted([pmid for pmid, (date, text) in self.records.items()
+                    if lo <= date.strftime('%Y/%m/%d') <= hi])
+# end class FakeDatedServer
+
+class Harvester_tests(unittest.TestCase):
+    def setUp(self):
+        day = datetime.date(2020, 1, 1)
+        self.records = {str(i): (day + datetime.timedelta(days=i), 'v1')
+                                                            for i in range(10)}
+        self.server = FakeDatedServer(self.records)
+        self.harvester = Harvester(':memory:', maxCount=3,
+                                                    URLReader=self.server)
+        self.until = datetime.date(2020, 1, 10)
+
+    def harvest(self):
+        return dict(self.harvester.harvest('q', since=datetime.date(2020,1,1),
+                                                            until=self.until))
+
+    def test_iterDateWindows_split(self):
+        windows = list(iterDateWindows('pubmed', 'q', datetime.date(2020,1,1),
+                            self.until, maxCount=3, URLReader=self.server))
+        self.assertEqual(sum([w[2] for w in windows]), 10)
+        self.assertTrue(all([w[2] <= 3 for w in windows]))
+        self.assertEqual([w[0] for w in windows],
+                                            sorted([w[0] for w in windows]))
+
+    def test_harvest_incremental(self):
+        self.assertEqual(sorted(self.harvest()), sorted(self.records))
+        self.assertEqual(self.harvester.getMark('q'), self.until)
+
+        self.records['3'] = (self.until, 'v2')		# changed
+        self.records['10'] = (self.until, 'v1')		# new
+        self.until = datetime.date(2020, 1, 11)
+        numURLs = len(self.server.urls)
+        records = self.harvest()
+        self.assertEqual(sorted(records), ['10', '3'])
+        self.assertIn(b'<T>v2</T>', records['3'])
+        self.assertEqual(self.harvester.getMark('q'), self.until)
+        # only the window since the mark was searched
+        self.assertIn('mindate=2020/01/10', self.server.urls[numURLs])
+
+    def test_harvest_too_many_in_a_day(self):
+        for i in range(10, 14):
+            self.records[str(i)] = (self.until, 'v1')
+        with self.assertRaises(Exception):
+            self.harvest()
+        self.assertEqual(self.harvester.getMark('q'), None)
+# end class Harvester_tests
+
+class FakeIDConverter (FakeURLReader):
+    """ ID converter: pmid n <-> PMCn <-> 10.1/N. pmid 999 is unknown. """
+    def readURL(self, url, GET=True, params=None, headers={}):
+        FakeURLReader.readURL(self, url, GET, params, headers)
+        p = dict(urllib.parse.parse_qsl(url.split('?')[1]))
+        records = []
+        for id in p['ids'].split(','):
+            n = {'pmid': id, 'pmcid': id[3:], 'doi': id[6:]}[p['idtype']]
+            if n == '999':
+                records.append({'pmid': id, 'status': 'error'})
+            else:
+                records.append({'pmid': int(n), 'pmcid': 'PMC' + n,
+                                                        'doi': '10.1/N' + n})
+        return json.dumps({'status': 'ok', 'records': records}).encode()
+# end class FakeIDConverter
+
+class convertIDs_tests(unittest.TestCase):
+    def setUp(self):
+        self.reader = FakeIDConverter()
+        self.index = IDIndex(':memory:')
+
+    def test_getIDType(self):
+        self.assertEqual(getIDType(123), ('pmid', '123'))
+        self.assertEqual(getIDType('pmc55 '), ('pmcid', 'PMC55'))
+        self.assertEqual(getIDType('10.1/N5'), ('doi', '10.1/n5'))
+
+    def test_convertIDs(self):
+        mappings = convertIDs([1, '2', 'pmc3', '10.1/N4', '999'], batchSize=2,
+                                    index=self.index, URLReader=self.reader)
+        self.assertEqual(mappings['1'], IDMapping('1', 'PMC1', '10.1/n1'))
+        self.assertEqual(mappings['pmc3'].pmid, '3')
+        self.assertEqual(mappings['10.1/N4'].pmcid, 'PMC4')
+        self.assertEqual(mappings['999'], None)
+        self.assertEqual(len(self.reader.urls), 4)	# 3 pmids, pmcid, doi
+
+    def test_convertIDs_index(self):
+        convertIDs([1, '999'], index=self.index, URLReader=self.reader)
+        mappings = convertIDs(['PMC1', '10.1/n1', '999'], index=self.index,
+                                                    URLReader=self.reader)
+        self.assertEqual(len(self.reader.urls), 1)	# all from the index
+        self.assertEqual(mappings['PMC1'], IDMapping('1', 'PMC1', '10.1/n1'))
+        self.assertEqual(mappings['999'], None)
+# end class convertIDs_tests
+
+class medline_tests(unittest.TestCase):
+    def setUp(self):
+        self.text = b"""
+PMID- 28440906
+TI  - Aging: a long
+      title.
+AU  - Smith J
+AU  - Jones K
+MH  - Aging/*genetics
+
+PMID- 28256074
+TI  - Short \xc3\xa9
+AB  - abstract
+"""
+
+    def test_iterMedlineRecords(self):
+        rcds = list(iterMedlineRecords(self.text))
+        self.assertEqual([r.get('PMID') for r in rcds], ['28440906','28256074'])
+        self.assertEqual(rcds[0].get('TI'), 'Aging: a long title.')
+        self.assertEqual(rcds[0].getAll('AU'), ['Smith J', 'Jones K'])
+        self.assertEqual(rcds[0].getAll('MH'), ['Aging/*genetics'])
+        self.assertEqual(rcds[1].get('TI'), 'Short \u00e9')
+        self.assertEqual(rcds[1].getAll('AU'), [])
+        self.assertTrue(rcds[1].toBytes().endswith(b'AB  - abstract\n'))
+
+    def test_iterMedlineRecords_tags(self):
+        rcd = next(iterMedlineRecords(self.text, tags=['PMID', 'AU']))
+        self.assertEqual(rcd.tags(), ['PMID', 'AU'])
+        self.assertNotIn('TI', rcd)
+        self.assertEqual(rcd.get('TI', 'none'), 'none')
+
+    def test_iterMedlineRecords_chunks(self):
+        expected = [r.toBytes() for r in iterMedlineRecords(self.text)]
+        for size in (1, 7, 50):
+            chunks = [memoryview(self.text)[i:i+size]
+                                for i in range(0, len(self.text), size)]
+            rcds = list(iterMedlineRecords(chunks))
+            self.assertEqual([r.toBytes() for r in rcds], expected)
+            self.assertEqual(rcds[0].get('TI'), 'Aging: a long title.')
+
+    def test_iterMedlineRecords_noCopy(self):
+        buf = bytearray(self.text * 3)
+        size = len(self.text) + 10	# 3rd, 5th records span chunks
+        chunks = [memoryview(buf)[i:i+size] for i in range(0, len(buf), size)]
+        rcds = list(iterMedlineRecords(chunks))
+        self.assertEqual([r.toBytes() for r in rcds],
+                    [r.toBytes() for r in iterMedlineRecords(bytes(buf))])
+        inBuf = [r.data.obj is buf for r in rcds]
+        self.assertEqual(inBuf, [True, True, False, True, False, True])
+        self.assertEqual(rcds[2].get('TI'), 'Aging: a long title.')
+        self.assertEqual(rcds[5].get('TI'), 'Short \u00e9')
+
+    def test_iterMedlineRecords_crlf(self):
+        rcds = list(iterMedlineRecords(self.text.replace(b'\n', b'\r\n')))
+        self.assertEqual(len(rcds), 2)
+        self.assertEqual(rcds[0].get('TI'), 'Aging: a long title.')
+# end class medline_tests
+
+class Pipeline_tests(unittest.TestCase):
+    def test_Pipeline_ordered(self):
+        out = []
+        def fetch(item):
+            time.sleep(0.01 * (item % 3))	# finish out of order
+            return b'x' * item
+        pipeline = Pipeline(fetch, len, lambda item, n: out.append((item, n)),
+                        fetchWorkers=3, parseProcesses=False, queueSize=2)
+        stats = pipeline.run(range(10))
+        self.assertEqual(out, [(i, i) for i in range(10)])
+        self.assertEqual(stats['fetch']['bytes'], sum(range(10)))
+        for stage in Pipeline.STAGES:
+            self.assertEqual(stats[stage]['items'], 10)
+
+    def test_Pipeline_reorderWindow(self):
+        out = []
+        def fetch(item):
+            if item == 0: time.sleep(0.5)	# everything else gets ahead
+            return b'x'
+        pipeline = Pipeline(fetch, len, lambda item, n: out.append(item),
+                    fetchWorkers=3, parseProcesses=False, queueSize=2)
+        pipeline.run(range(50))
+        self.assertEqual(out, list(range(50)))
+        self.assertLessEqual(pipeline.maxHeld, pipeline.reorderWindow)
+        self.assertEqual(pipeline.reorderWindow, 5)
+
+    def test_Pipeline_unordered(self):
+        out = []
+        pipeline = Pipeline(str, int, lambda item, n: out.append(n),
+                                        parseProcesses=False, ordered=False)
+        pipeline.run(range(20))
+        self.assertEqual(sorted(out), list(range(20)))
+
+    def test_Pipeline_error(self):
+        def fetch(item):
+            if item == 5: raise ValueError('bad item')
+            return b''
+        pipeline = Pipeline(fetch, len, lambda item, n: None,
+                                                        parseProcesses=False)
+        with self.assertRaises(ValueError):
+            pipeline.run(range(100))
+
+    def test_runResultsPipeline(self):
+        reader = FakeURLReader()
+        pages = []
+        stats = runResultsPipeline('pubmed', '&webenv=W&query_key=1', 25,
+                    lambda retstart, n: pages.append((retstart, n)),
+                    parse=len, pageSize=10, URLReader=reader)
+        self.assertEqual([p[0] for p in pages], [0, 10, 20])
+        self.assertEqual(pages[1][1], len(getResultsURL('pubmed',
+                    '&webenv=W&query_key=1', retmax=10, retstart=10)))
+        self.assertEqual(stats['parse']['items'], 3)
+# end class Pipeline_tests
+
+class async_tests(unittest.TestCase):
+    def test_getPostResultsAsync(self):
+        reader = FakeAsyncURLReader()
+        output, webenv = asyncio.run(getPostResultsAsync('pubmed', [1, 2],
+                                                        URLReader=reader))
+        self.assertEqual(webenv, '&webenv=W&query_key=1')
+        self.assertEqual(output, getResultsURL('pubmed', webenv).encode())
+        self.assertEqual(len(reader.urls), 2)
+# end class async_tests
+
+if __name__ == '__main__':
+    unittest.main()
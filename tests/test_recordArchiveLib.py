@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import sys
+import unittest
+import os
+import os.path
+import tempfile
+from recordArchiveLib import *
+
+"""
+These are tests for recordArchiveLib.py
+
+Usage:   python test_recordArchiveLib.py [-v]
+"""
+######################################
+
+class archive_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpDir.name, 'test.arc')
+        self.records = [(i, b'<PubmedArticle>%d</PubmedArticle>' % i * (i % 7))
+                                                    for i in range(100, 0, -1)]
+        with ArchiveWriter(self.filename, blockSize=500) as writer:
+            writer.addMany(self.records)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_get(self):
+        with ArchiveReader(self.filename) as reader:
+            self.assertGreater(reader.numBlocks, 1)
+            self.assertEqual(len(reader), 100)
+            self.assertEqual(reader.get(42), dict(self.records)[42])
+            self.assertEqual(reader.get('7'), b'')
+            self.assertEqual(reader.get(101), None)
+            self.assertIn(1, reader)
+            self.assertNotIn(0, reader)
+            self.assertEqual(list(reader.ids()), list(range(1, 101)))
+
+    def test_iterRecords(self):
+        with ArchiveReader(self.filename) as reader:
+            self.assertEqual(list(reader.iterRecords()), self.records)
+            self.assertEqual(list(reader.iterRecords(numWorkers=3)),
+                                                                self.records)
+
+    def test_duplicates(self):
+        with ArchiveWriter(self.filename) as writer:
+            writer.add(1, b'old')
+            writer.add(1, b'new')
+        with ArchiveReader(self.filename) as reader:
+            self.assertEqual(len(reader), 1)
+            self.assertEqual(reader.get(1), b'new')
+
+    def test_failed_write(self):
+        try:
+            with ArchiveWriter(self.filename) as writer:
+                writer.add(1, b'x')
+                raise ValueError('oops')
+        except ValueError:
+            pass
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+        with ArchiveReader(self.filename) as reader:	# old one still there
+            self.assertEqual(len(reader), 100)
+
+    def test_notArchive(self):
+        with open(self.filename, 'wb') as fp:
+            fp.write(b'not an archive')
+        with self.assertRaises(Exception):
+            ArchiveReader(self.filename)
+
+    def test_emptyFile(self):
+        data = open(self.filename, 'rb').read()
+        for size in (0, 20):			# empty, truncated
+            with open(self.filename, 'wb') as fp:
+                fp.write(data[:size])
+            with self.assertRaisesRegex(Exception, 'not a record archive'):
+                ArchiveReader(self.filename)
+# end class archive_tests
+
+if __name__ == '__main__':
+    unittest.main()
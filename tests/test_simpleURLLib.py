@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+
+import sys
+import unittest
+import io
+import os
+import json
+import os.path
+import time
+import socket
+import asyncio
+import tempfile
+import threading
+import gzip
+import http.server
+from simpleURLLib import *
+
+"""
+These are tests for simpleURLLib.py
+(only the parts that do not need a network)
+
+Usage:   python test_simpleURLLib.py [-v]
+"""
+######################################
+
+class LocalHandler (http.server.BaseHTTPRequestHandler):
+    """ Local HTTP/1.1 server that echos the request path (and post body),
+        gzip'ed if the client asks for it.
+        /status/code        - returns that http status code
+        /flaky/n/code/name  - returns status code the 1st n times, then 200
+                              (code 'drop': closes the connection w/o a reply)
+        /redirect/code/path - returns status code redirecting to /path
+    """
+    protocol_version = 'HTTP/1.1'
+    flakyCounts = {}		# /flaky/ path -> num of times requested
+
+    def do_GET(self):
+        self.reply(self.path.encode())
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.reply(self.path.encode() + b' ' + self.rfile.read(length))
+
+    def reply(self, body):
+        parts = self.path.split('/')
+        if parts[1] == 'status':
+            self.send_response(int(parts[2]))
+        elif parts[1] == 'redirect':
+            self.send_response(int(parts[2]))
+            self.send_header('Location', '/' + '/'.join(parts[3:]))
+        elif parts[1] == 'flaky':
+            count = self.flakyCounts.get(self.path, 0)
+            self.flakyCounts[self.path] = count + 1
+            if count < int(parts[2]) and parts[3] == 'drop':
+                self.close_connection = True
+                return
+            if count < int(parts[2]):
+                self.send_response(int(parts[3]))
+                self.send_header('Retry-After', '0')
+            else:
+                self.send_response(200)
+        else:
+            self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def startLocalServer():
+    """ Return (server, base url) for a LocalHandler server thread """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), LocalHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                                    args=(0.05,), daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+class RateLimiter_tests(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_RateLimiter_burst(self):
+        rl = RateLimiter(rate=10, burst=3)
+        waits = [rl.reserve() for i in range(5)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(waits[3], 0.1, delta=0.02)
+        self.assertAlmostEqual(waits[4], 0.2, delta=0.02)
+
+    def test_RateLimiter_refill(self):
+        rl = RateLimiter(rate=100, burst=1)
+        rl.acquire()
+        time.sleep(0.02)
+        self.assertEqual(rl.reserve(), 0.0)
+
+    def test_RateLimiter_async(self):
+        rl = RateLimiter(rate=50, burst=1)
+        async def useIt():
+            for i in range(3):
+                await rl.acquireAsync()
+        start = time.time()
+        asyncio.run(useIt())
+        self.assertGreaterEqual(time.time() - start, 0.035)
+
+    def test_RateLimiter_lockFile(self):
+        with tempfile.TemporaryDirectory() as dir:
+            lockFile = os.path.join(dir, 'rate')
+            rl1 = RateLimiter(rate=10, burst=2, lockFile=lockFile)
+            rl2 = RateLimiter(rate=10, burst=2, lockFile=lockFile)
+            self.assertEqual(rl1.reserve(), 0.0)
+            self.assertEqual(rl2.reserve(), 0.0)
+            self.assertAlmostEqual(rl1.reserve(), 0.1, delta=0.02) # shared
+
+    def test_RateLimiter_lockFile_async(self):
+        # while another process holds the flock, the event loop keeps running
+        import fcntl
+        with tempfile.TemporaryDirectory() as dir:
+            lockFile = os.path.join(dir, 'rate')
+            rl = RateLimiter(rate=10, burst=2, lockFile=lockFile)
+            fd = os.open(lockFile, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            timer = threading.Timer(1.0, os.close, (fd,))  # in case it blocks
+            timer.start()
+            async def useIt():
+                task = asyncio.ensure_future(rl.acquireAsync())
+                start = time.time()
+                await asyncio.sleep(0.05)
+                elapsed = time.time() - start
+                timer.cancel()
+                os.close(fd)			# releases the flock
+                await task
+                return elapsed
+            self.assertLess(asyncio.run(useIt()), 0.5)
+# end class RateLimiter_tests
+
+class ConnectionPool_tests(unittest.TestCase):
+    def setUp(self):
+        self.server, self.baseURL = startLocalServer()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_ConnectionPool_reuse(self):
+        pool = ConnectionPool()
+        for i in range(3):
+            output = readURL(self.baseURL + '/x%d' % i, pool=pool)
+            self.assertEqual(output, b'/x%d' % i)
+        stats = pool.getStats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 2)
+        pool.close()
+        self.assertEqual(pool.getStats()['idle'], 0)
+
+    def test_ConnectionPool_post(self):
+        pool = ConnectionPool(compress=False)
+        output = readURL(self.baseURL + '/post', params=b'id=1,2', GET=False,
+                                                                pool=pool)
+        self.assertEqual(output, b'/post id=1,2')
+        stats = pool.getStats()
+        self.assertEqual(stats['bytesReceived'], stats['bytesDecoded'])
+
+    def test_ConnectionPool_gzip(self):
+        pool = ConnectionPool(compress=True)
+        output = readURL(self.baseURL + '/' + 'a' * 1000, pool=pool)
+        self.assertEqual(output, b'/' + b'a' * 1000)
+        stats = pool.getStats()
+        self.assertLess(stats['bytesReceived'], stats['bytesDecoded'])
+
+    def test_ConnectionPool_error(self):
+        pool = ConnectionPool()
+        with self.assertRaises(Exception):
+            readURL(self.baseURL + '/status/404', pool=pool)
+# end class ConnectionPool_tests
+
+class AsyncURLReader_tests(unittest.TestCase):
+    def setUp(self):
+        self.server, self.baseURL = startLocalServer()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_AsyncURLReader_gather(self):
+        reader = AsyncURLReader(seconds=0, maxConcurrent=3)
+        async def readThem():
+            return await asyncio.gather(*[reader.readURL(self.baseURL +
+                                            '/x%d' % i) for i in range(6)])
+        outputs = asyncio.run(readThem())
+        self.assertEqual(outputs, [b'/x%d' % i for i in range(6)])
+
+    def test_AsyncURLReader_post(self):
+        reader = AsyncURLReader(seconds=0)
+        output = asyncio.run(reader.readURL(self.baseURL + '/post',
+                                                params=b'id=1,2', GET=False))
+        self.assertEqual(output, b'/post id=1,2')
+
+    def test_AsyncURLReader_error(self):
+        reader = AsyncURLReader(seconds=0)
+        with self.assertRaises(Exception):
+            asyncio.run(reader.readURL(self.baseURL + '/status/500'))
+
+    def test_AsyncURLReader_two_loops(self):
+        reader = AsyncURLReader(seconds=0, maxConcurrent=2)
+        for i in range(2):		# each asyncio.run() is a new loop
+            output = asyncio.run(reader.readURL(self.baseURL + '/x%d' % i))
+            self.assertEqual(output, b'/x%d' % i)
+
+    def test_AsyncURLReader_redirect(self):
+        reader = AsyncURLReader(seconds=0)
+        output = asyncio.run(reader.readURL(self.baseURL + '/redirect/302/y'))
+        self.assertEqual(output, b'/y')
+        output = asyncio.run(reader.readURL(self.baseURL + '/redirect/303/z',
+                                                params=b'id=1', GET=False))
+        self.assertEqual(output, b'/z')			# now a GET
+        output = asyncio.run(reader.readURL(self.baseURL + '/redirect/307/p',
+                                                params=b'id=1', GET=False))
+        self.assertEqual(output, b'/p id=1')		# still a POST
+        url = self.baseURL + '/redirect/302' * 6 + '/end'
+        with self.assertRaises(URLReadError) as cm:
+            asyncio.run(reader.readURL(url))
+        self.assertEqual(cm.exception.code, 302)
+
+    def test_AsyncURLReader_timeout(self):
+        silent = socket.socket()	# accepts connections, never replies
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(5)
+        url = 'http://127.0.0.1:%d/x' % silent.getsockname()[1]
+        reader = AsyncURLReader(seconds=0, timeout=0.2,
+                        retryPolicy=RetryPolicy(maxRetries=3, backoff=0))
+        try:
+            start = time.time()
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(reader.readURL(url))
+            self.assertLess(time.time() - start, 0.5)	# not retried
+        finally:
+            silent.close()
+# end class AsyncURLReader_tests
+
+class ResponseCache_tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cacheDir = self.tmpDir.name
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_ResponseCache_getPut(self):
+        cache = ResponseCache(self.cacheDir)
+        key = cache.makeKey('pubmed', ['1', '2'], 'summary')
+        self.assertEqual(key, cache.makeKey('pubmed', ['1', '2'], 'summary'))
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, b'output', meta={'count': 2})
+        self.assertEqual(cache.getEntry(key), (b'output', {'count': 2}))
+        stats = cache.getStats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        # another cache instance (process) sees it
+        self.assertEqual(ResponseCache(self.cacheDir).get(key), b'output')
+
+    def test_ResponseCache_ttl(self):
+        cache = ResponseCache(self.cacheDir)
+        key = cache.makeKey('x')
+        cache.put(key, b'output', ttl=-1)
+        self.assertEqual(cache.get(key), None)
+        self.assertEqual(cache.getStats()['expired'], 1)
+
+    def test_ResponseCache_evict(self):
+        cache = ResponseCache(self.cacheDir, maxBytes=1000)
+        keys = [cache.makeKey(i) for i in range(5)]
+        for i, key in enumerate(keys):
+            cache.put(key, b'x' * 300)
+            os.utime(cache._path(key), (i, i))	# deterministic LRU order
+        self.assertGreater(cache.getStats()['evictions'], 0)
+        self.assertLessEqual(cache.getStats()['bytes'], 1000)
+        self.assertEqual(cache.get(keys[0]), None)
+        self.assertEqual(cache.get(keys[-1]), b'x' * 300)
+
+    def test_ResponseCache_offline(self):
+        cache = ResponseCache(self.cacheDir, offline=True)
+        with self.assertRaises(Exception):
+            cache.get(cache.makeKey('not there'))
+# end class ResponseCache_tests
+
+class retry_tests(unittest.TestCase):
+    def setUp(self):
+        self.server, self.baseURL = startLocalServer()
+        self.retryPolicy = RetryPolicy(maxRetries=3, backoff=0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_readURL_URLReadError(self):
+        with self.assertRaises(URLReadError) as cm:
+            readURL(self.baseURL + '/status/429')
+        self.assertEqual(cm.exception.code, 429)
+        with self.assertRaises(URLReadError) as cm:
+            readURL('http://127.0.0.1:1/nothing/there')
+        self.assertEqual(cm.exception.code, None)
+
+    def test_retry_success(self):
+        r = ThrottledURLReader(seconds=0, retryPolicy=self.retryPolicy,
+                                                        pool=ConnectionPool())
+        output = r.readURL(self.baseURL + '/flaky/2/503/a')
+        self.assertEqual(output, b'/flaky/2/503/a')
+        stats = r.getStats()
+        self.assertEqual((stats['reads'], stats['retries']), (3, 2))
+        self.assertEqual(stats['failuresByCode'], {'503': 2})
+
+    def test_retry_giveUp(self):
+        r = ThrottledURLReader(seconds=0, retryPolicy=self.retryPolicy)
+        with self.assertRaises(URLReadError):
+            r.readURL(self.baseURL + '/flaky/5/500/b')
+        self.assertEqual(r.getStats()['retries'], 3)
+        with self.assertRaises(URLReadError):
+            r.readURL(self.baseURL + '/status/404')	# not retried
+        self.assertEqual(r.getStats()['retries'], 3)
+
+    def test_retry_dropped(self):
+        r = ThrottledURLReader(seconds=0, retryPolicy=self.retryPolicy)
+        output = r.readURL(self.baseURL + '/flaky/2/drop/d')
+        self.assertEqual(output, b'/flaky/2/drop/d')
+        self.assertEqual(r.getStats()['retries'], 2)
+        with self.assertRaises(URLReadError) as cm:
+            r.readURL(self.baseURL + '/flaky/5/drop/e')
+        self.assertIsInstance(cm.exception.reason, http.client.HTTPException)
+        self.assertEqual(r.getStats()['retries'], 5)
+
+    def test_retry_post(self):
+        r = ThrottledURLReader(seconds=0, retryPolicy=self.retryPolicy)
+        with self.assertRaises(URLReadError):		# POST 500 not retried
+            r.readURL(self.baseURL + '/flaky/1/500/c', params=b'x', GET=False)
+        output = r.readURL(self.baseURL + '/flaky/1/429/c', params=b'x',
+                                                                GET=False)
+        self.assertEqual(output, b'/flaky/1/429/c x')
+
+    def test_parseRetryAfter(self):
+        self.assertEqual(parseRetryAfter('7'), 7.0)
+        self.assertEqual(parseRetryAfter(None), None)
+        self.assertEqual(parseRetryAfter('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+    def test_CircuitBreaker(self):
+        breaker = CircuitBreaker(failureThreshold=2, resetSeconds=0.2)
+        r = ThrottledURLReader(seconds=0, circuitBreaker=breaker)
+        for i in range(2):
+            with self.assertRaises(URLReadError):
+                r.readURL(self.baseURL + '/status/502')
+        self.assertGreater(breaker.getWait(), 0)
+        start = time.time()
+        r.readURL(self.baseURL + '/ok')			# waits for breaker
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertEqual(r.getStats()['circuitOpens'], 1)
+
+    def test_CircuitBreaker_halfOpen(self):
+        breaker = CircuitBreaker(failureThreshold=3, resetSeconds=0.1)
+        error = URLReadError('http://x', code=503)
+        for i in range(3):
+            breaker.recordFailure(error)
+        self.assertEqual(breaker.numOpens, 1)
+        breaker.recordFailure(error)		# in flight when it opened
+        self.assertEqual(breaker.numOpens, 1)
+        time.sleep(0.15)
+        self.assertEqual(breaker.getWait(), 0)
+        breaker.recordFailure(error)		# 1st failure when half open
+        self.assertEqual(breaker.numOpens, 2)
+        self.assertGreater(breaker.getWait(), 0)
+        time.sleep(0.15)
+        breaker.recordSuccess()			# closes it
+        breaker.recordFailure(error)
+        self.assertEqual(breaker.numOpens, 2)
+# end class retry_tests
+
+class ThrottledURLReader_tests(unittest.TestCase):
+    def test_ThrottledURLReader_noThrottle(self):
+        r = ThrottledURLReader(seconds=0)
+        self.assertEqual(r.rateLimiter, None)
+
+    def test_ThrottledURLReader_seconds(self):
+        r = ThrottledURLReader(seconds=0.25)
+        self.assertEqual(r.rateLimiter.reserve(), 0.0)
+        self.assertAlmostEqual(r.rateLimiter.reserve(), 0.25, delta=0.02)
+# end class ThrottledURLReader_tests
+
+class Instrumentation_tests(unittest.TestCase):
+    def setUp(self):
+        self.server, self.base = startLocalServer()
+        self.inst = Instrumentation()
+        self.reader = ThrottledURLReader(seconds=0, pool=ConnectionPool(),
+                        retryPolicy=RetryPolicy(backoff=0, jitter=0),
+                        instrumentation=self.inst)
+
+    def tearDown(self):
+        self.reader.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_Instrumentation_timings(self):
+        seen = []
+        self.inst.hooks.append(seen.append)
+        self.reader.readURL(self.base + '/a')
+        self.reader.readURL(self.base + '/b')
+        self.assertEqual([t['status'] for t in seen], [200, 200])
+        self.assertGreater(seen[0]['connect'], 0)
+        self.assertEqual(seen[1]['connect'], 0)		# reused connection
+        for name in ('throttleWait', 'ttfb', 'download', 'total'):
+            self.assertIn(name, seen[0])
+        self.assertEqual(seen[0]['bytes'] + seen[1]['bytes'],
+                            self.reader.pool.getStats()['bytesReceived'])
+
+    def test_Instrumentation_counters(self):
+        self.reader.readURL(self.base + '/flaky/1/503/inst')
+        stats = self.inst.getStats()
+        self.assertEqual(stats['requests'], {'200': 1, '503': 1})
+        self.assertEqual(stats['seconds']['total']['count'], 2)
+        self.assertEqual(json.loads(self.inst.toJSON()), stats)
+        text = self.inst.toPrometheus(prefix='eutils')
+        self.assertIn('eutils_requests_total{status="503"} 1\n', text)
+        self.assertIn('eutils_throttle_wait_seconds_bucket{le="+Inf"} 2\n',
+                                                                        text)
+
+    def test_Instrumentation_slowLog(self):
+        self.inst.slowSeconds = 0
+        self.inst.traceFile = io.StringIO()
+        self.reader.readURL(self.base + '/slow')
+        trace = json.loads(self.inst.traceFile.getvalue())
+        self.assertEqual(trace['url'], self.base + '/slow')
+
+    def test_Instrumentation_slowLog_threads(self):
+        class SlowFile (io.StringIO):	# a write that can be interleaved
+            def write(self, text):
+                for c in text:
+                    io.StringIO.write(self, c)
+                    time.sleep(0)
+        self.inst.slowSeconds = 0
+        self.inst.traceFile = SlowFile()
+        def record(i):
+            for j in range(20):
+                self.inst.recordRequest({'url': 'u%d' % i, 'total': 1})
+        threads = [threading.Thread(target=record, args=(i,)) for i in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        lines = self.inst.traceFile.getvalue().splitlines()
+        self.assertEqual(len(lines), 80)
+        for line in lines:
+            self.assertEqual(json.loads(line)['total'], 1)
+
+    def test_Histogram(self):
+        h = Histogram([1, 2])
+        for value in (0.5, 1, 1.5, 3):
+            h.observe(value)
+        self.assertEqual(h.getCumulative(), [(1, 2), (2, 3), ('+Inf', 4)])
+        self.assertEqual(h.sum, 6.0)
+# end class Instrumentation_tests
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python2
+
+import sys
+import unittest
+import os
+import os.path
+import tempfile
+import shutil
+import array
+import types
+if sys.version_info[0] == 2:
+    import StringIO
+
+"""
+These are tests for Old/tabledatasetlib4.py
+
+tabledatasetlib4 is python 2, so these tests only run under python 2,
+    under python 3 they are skipped.
+
+Usage:   python2 test_tabledatasetlib4.py [-v]
+"""
+PY2 = sys.version_info[0] == 2
+if PY2:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                    '..', 'lib', 'python', 'Old'))
+    from tabledatasetlib4 import *
+######################################
+
+FIELDS = ['id', 'sym', 'syns', 'count']
+MULTI  = {'syns': ','}
+SYMBOLS = ['Pax6', 'Shh', '', 'PAX6', 'Kit']
+SYNONYMS = ['', 'a', 'a, b', ' c ,,d', 'b']
+
+def writeDataFile(filename,
+                numLines=300,
+    ):
+    """ Write a test file: header, comments, blank lines, short lines,
+        extra columns, multi-valued fields w/ blanks
+    """
+    fp = open(filename, 'w')
+    fp.write('\t'.join(FIELDS) + '\n')
+    for i in range(numLines):
+        if i % 37 == 0:
+            fp.write('# comment %d\n' % i)
+        if i % 41 == 0:
+            fp.write('\n')
+        cols = [str(i), SYMBOLS[i % 5], SYNONYMS[i % 4], str(i % 7)]
+        numCols = [2, 3, 4, 4, 4, 4][i % 6]
+        line = '\t'.join(cols[:numCols])
+        if numCols == 4 and i % 9 == 0:
+            line += '\textra'
+        fp.write(line + '\n')
+    fp.close()
+
+def plainRecords(ds):
+    """ Return the records of ds as plain dicts, in key order """
+    rcds = []
+    for key in sorted(ds.getKeys()):
+        rcd = ds.getRecordByKey(key)
+        if not isinstance(rcd, dict):		# a TDSRecordView
+            rcd = rcd.copy()
+        rcds.append(rcd)
+    return rcds
+
+def plainIndexes(ds):
+    """ Return ds's indexes as {fieldname: {value: sorted list of keys}} """
+    indexes = {}
+    for fn in ds.indexes.keys():
+        indexes[fn] = {}
+        for value, keys in ds.indexes[fn].items():
+            indexes[fn][value] = sorted(ds.getIndexKeys(keys))
+    return indexes
+
+@unittest.skipUnless(PY2, "tabledatasetlib4 is python 2")
+class TDSTestCase(unittest.TestCase):
+    """ Base class: a data file to read & helpers to compare datasets """
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpDir, 'data.txt')
+        writeDataFile(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def load(self, cls=None, read='readRecords', indexes=['sym', 'syns'],
+                                                    readArgs={}, **kwargs):
+        """ Return a dataset of cls for the data file, read w/ 'read' """
+        if cls == None:
+            cls = TextFileTableDataSet
+        ds = cls('test', self.filename, multiValued=MULTI, **kwargs)
+        ds.addIndexes(indexes)
+        getattr(ds, read)(**readArgs)
+        return ds
+
+    def assertSameDataSet(self, ds1, ds2):
+        self.assertEqual(plainRecords(ds1), plainRecords(ds2))
+        self.assertEqual(plainIndexes(ds1), plainIndexes(ds2))
+        self.assertEqual(ds1.getNumRecords(), ds2.getNumRecords())
+
+    def assertSameUpdates(self, ds1, ds2):
+        """ Make the same updates, deletes, and adds to ds1 and ds2 and
+            check they are still the same
+        """
+        for ds in (ds1, ds2):
+            keys = sorted(ds.getKeys())
+            ds.updateFields(keys[3], ['sym', 'syns'], ['Zz', ['x', 'a']])
+            ds.deleteRecords(keys[5:8])
+            ds.addRecord({'id': 'new', 'sym': 'Kit', 'syns': ['b']})
+        self.assertSameDataSet(ds1, ds2)
+        self.assertEqual(ds1.getKeysByIndex('sym', 'zz'),
+                                            ds2.getKeysByIndex('sym', 'zz'))
+        self.assertEqual(ds1.getDupsDict(['sym', 'syns']),
+                                            ds2.getDupsDict(['sym', 'syns']))
+# end class TDSTestCase
+
+class columnStore_tests(TDSTestCase):
+    def newDataSet(self, columnTypes):
+        ds = TableDataSet('t', ['id', 'sym', 'count', 'syns'],
+                                multiValued=MULTI, columnTypes=columnTypes)
+        ds.addIndexes(['sym', 'syns'])
+        ds.addRecord({'id': '1', 'sym': 'A', 'count': 3, 'syns': ['x', 'y']})
+        ds.addRecord({'id': '2', 'sym': 'a', 'count': None, 'syns': []})
+        ds.addRecord({'id': '3', 'sym': 'B', 'count': 7, 'syns': ['y']})
+        for i in range(4, 12):
+            ds.addRecord({'id': str(i), 'sym': SYMBOLS[i % 5] or None,
+                            'count': i, 'syns': [SYNONYMS[i % 4] or 'a']})
+        return ds
+
+    def test_matches_dict_records(self):
+        for columnTypes in ({}, {'count': 'l'}):
+            ds1 = self.newDataSet(None)
+            ds2 = self.newDataSet(columnTypes)
+            self.assertSameDataSet(ds1, ds2)
+            self.assertEqual(ds1.getRecordsByIndex('sym', 'a'),
+                                        ds2.getRecordsByIndex('sym', 'a'))
+            self.assertSameUpdates(ds1, ds2)
+
+    def test_compactIndexes(self):
+        ds = self.newDataSet({})
+        self.assertEqual(type(ds.indexes['syns']['x']), types.IntType)
+        self.assertEqual(type(ds.indexes['sym']['a']), array.array)
+        ds.deleteRecords(1)
+        self.assertEqual(ds.indexes['sym']['a'], 0)	# back to just the key
+        self.assertEqual(ds.getKeysByIndex('sym', 'A'), [0])
+
+    def test_TDSRecordView(self):
+        ds = self.newDataSet({'count': 'l'})
+        rcd = ds.getRecordByKey(1)
+        self.assertEqual(rcd['count'], None)		# NULL in a typed column
+        self.assertEqual(rcd['_rcdkey'], 1)
+        self.assertTrue(rcd.has_key('syns'))
+        rcd['count'] = 5
+        self.assertEqual(ds.getRecordByKey(1)['count'], 5)
+        self.assertEqual(type(rcd.copy()), dict)
+        self.assertEqual(rcd, rcd.copy())
+        self.assertEqual(type(ds.records.columns['count']), array.array)
+
+    def test_TextFileTableDataSet(self):
+        ds1 = self.load(ignoreComments=1)
+        ds2 = self.load(ignoreComments=1, columnTypes={})
+        self.assertSameDataSet(ds1, ds2)
+        self.assertSameUpdates(ds1, ds2)
+
+    def test_typed_columns(self):
+        ds1 = self.load(ignoreComments=1)
+        ds2 = self.load(ignoreComments=1, columnTypes={'count': 'l'})
+        for rcd1, rcd2 in zip(plainRecords(ds1), plainRecords(ds2)):
+            if rcd1['count'] != None:
+                rcd1['count'] = int(rcd1['count'])
+            self.assertEqual(rcd1, rcd2)
+# end class columnStore_tests
+
+class DropSomeDataSet (TextFileTableDataSet if PY2 else object):
+    """ Overrides processRecord() and keepLine() """
+    def processRecord(self, rcd):
+        if rcd['count'] == '3':
+            return None
+        rcd['extra'] = 'x'
+        return rcd
+
+    def keepLine(self, line):
+        return not line.startswith('1') and \
+                                TextFileTableDataSet.keepLine(self, line)
+# end class DropSomeDataSet
+
+class DropNothingDataSet (TextFileTableDataSet if PY2 else object):
+    """ Overrides parseLine() (w/o changing it) """
+    def parseLine(self, line):
+        return TextFileTableDataSet.parseLine(self, line)
+# end class DropNothingDataSet
+
+class ExtraFieldDataSet (TextFileTableDataSet if PY2 else object):
+    """ Overrides parseLine() to add fields to some rcds """
+    def parseLine(self, line):
+        rcd = TextFileTableDataSet.parseLine(self, line)
+        if not (rcd['id'] or '').isdigit():	# comment or blank line
+            return rcd
+        if int(rcd['id']) % 3 == 0:
+            rcd['extra'] = 'x' + rcd['id']
+        if int(rcd['id']) % 5 == 0:
+            rcd['note'] = None
+        return rcd
+# end class ExtraFieldDataSet
+
+class readRecordsBulk_tests(TDSTestCase):
+    read = 'readRecordsBulk'
+    readArgs = {'chunkSize': 500}		# many chunks
+
+    def checkRead(self, cls=None, **kwargs):
+        """ Check reading w/ self.read gives what readRecords() gives """
+        for ignoreComments in (0, 1):
+            ds1 = self.load(cls, ignoreComments=ignoreComments, **kwargs)
+            ds2 = self.load(cls, read=self.read, readArgs=self.readArgs,
+                                    ignoreComments=ignoreComments, **kwargs)
+            self.assertSameDataSet(ds1, ds2)
+            self.assertEqual(ds1.getNumLinesRead(), ds2.getNumLinesRead())
+            self.assertSameUpdates(ds1, ds2)
+
+    def test_dict_records(self):
+        self.checkRead()
+
+    def test_column_storage(self):
+        self.checkRead(columnTypes={})
+        self.checkRead(columnTypes={'count': 'l'})
+
+    def test_hooks(self):
+        self.checkRead(DropSomeDataSet)
+        self.checkRead(DropSomeDataSet, columnTypes={})
+        self.checkRead(DropNothingDataSet)
+
+    def test_parseLine_extra_fields(self):
+        self.checkRead(ExtraFieldDataSet)
+        self.checkRead(ExtraFieldDataSet, columnTypes={})
+        ds = self.load(ExtraFieldDataSet, read=self.read,
+                                                readArgs=self.readArgs)
+        rcds = dict([(r['id'], r) for r in plainRecords(ds)])
+        self.assertEqual(rcds['3']['extra'], 'x3')
+        self.assertFalse('extra' in rcds['1'])
+        self.assertTrue('note' in rcds['5'] and rcds['5']['note'] == None)
+
+    def test_linenumbers(self):
+        ds = self.load(read=self.read, readArgs=self.readArgs,
+                                                            ignoreComments=1)
+        lines = open(self.filename).readlines()
+        for rcd in plainRecords(ds):
+            self.assertTrue(lines[rcd['_linenumber'] -1].startswith(
+                                                            rcd['id'] + '\t'))
+# end class readRecordsBulk_tests
+
+class readRecordsParallel_tests(readRecordsBulk_tests):
+    read = 'readRecordsParallel'
+    readArgs = {'numProcesses': 3, 'chunkSize': 500}	# many ranges
+
+    def test_getLineRanges(self):
+        ds = TextFileTableDataSet('t', self.filename, multiValued=MULTI)
+        ranges = ds.getLineRanges(700)
+        data = open(self.filename).read()
+        self.assertEqual(ranges[0][0], len(data.split('\n')[0]) +1)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (start1, end1), (start2, end2) in zip(ranges, ranges[1:]):
+            self.assertEqual(end1, start2)
+            self.assertEqual(data[end1 -1], '\n')	# at line boundaries
+
+    def test_mergeIndex_compact(self):
+        ds = self.load(columnTypes={})
+        ds2 = self.load(read=self.read, readArgs=self.readArgs,
+                                                            columnTypes={})
+        self.assertEqual(ds.indexes, ds2.indexes)	# same ints & arrays
+# end class readRecordsParallel_tests
+
+class AddFieldLazyDataSet (LazyTextFileTableDataSet if PY2 else object):
+    def processRecord(self, rcd):
+        rcd['extra'] = 'x'
+        return rcd
+# end class AddFieldLazyDataSet
+
+class AddFieldDataSet (TextFileTableDataSet if PY2 else object):
+    def processRecord(self, rcd):
+        rcd['extra'] = 'x'
+        return rcd
+# end class AddFieldDataSet
+
+class lazy_tests(TDSTestCase):
+    def loadBoth(self, eagerClass=None, lazyClass=None, **kwargs):
+        """ Return (eager, lazy) datasets for the data file """
+        return (self.load(eagerClass, **kwargs),
+                self.load(lazyClass or LazyTextFileTableDataSet, **kwargs))
+
+    def test_matches_readRecords(self):
+        for ignoreComments in (0, 1):
+            ds1, ds2 = self.loadBoth(ignoreComments=ignoreComments)
+            for fn in ['sym', 'syns']:		# build the indexes
+                ds2.getValues(fn)
+            self.assertEqual(len(ds2.records.parsed), 0)
+            self.assertSameDataSet(ds1, ds2)
+            self.assertEqual(ds1.getNumLinesRead(), ds2.getNumLinesRead())
+            self.assertSameUpdates(ds1, ds2)
+            ds2.close()
+
+    def test_processRecord(self):
+        ds1, ds2 = self.loadBoth(AddFieldDataSet, AddFieldLazyDataSet)
+        self.assertEqual(ds1.getRecordsByIndex('syns', 'b'),
+                                        ds2.getRecordsByIndex('syns', 'b'))
+        ds2.getValues('sym')
+        self.assertSameDataSet(ds1, ds2)
+
+    def test_parse_on_demand(self):
+        ds1, ds2 = self.loadBoth()
+        self.assertEqual(ds2.indexes, {})
+        self.assertTrue(ds2.hasIndex('sym'))
+        self.assertEqual(ds1.getRecordsByIndex('sym', 'pax6'),
+                                        ds2.getRecordsByIndex('sym', 'PAX6'))
+        self.assertEqual(len(ds2.records.parsed),
+                                        len(ds1.getKeysByIndex('sym', 'pax6')))
+        self.assertEqual(ds2.getRecordByKey(200), ds1.getRecordByKey(200))
+
+    def test_named_indexes(self):
+        ds1, ds2 = self.loadBoth()
+        self.assertEqual(ds1.selectKeysWhere('syns', 'c'),
+                                        ds2.selectKeysWhere('syns', 'c'))
+        self.assertEqual(len(ds2.records.parsed), 0)	# used the index
+        self.assertEqual(sorted(ds1.getValues('sym')),
+                                        sorted(ds2.getValues('sym')))
+        ds2.buildIndexes([])
+        self.assertFalse(ds2.hasIndex('sym'))
+        self.assertEqual(ds1.selectKeysWhere('count', '3'),	# full scan
+                                        ds2.selectKeysWhere('count', '3'))
+# end class lazy_tests
+
+class stream_tests(TDSTestCase):
+    def printed(self, ds, **kwargs):
+        """ Return what ds.printRecords() writes """
+        fp = StringIO.StringIO()
+        ds.printRecords(fp, **kwargs)
+        return fp.getvalue()
+
+    def test_iterRecords(self):
+        for cls in (None, DropSomeDataSet):
+            for ignoreComments in (0, 1):
+                ds1 = self.load(cls, ignoreComments=ignoreComments)
+                ds2 = (cls or TextFileTableDataSet)('test', self.filename,
+                            multiValued=MULTI, ignoreComments=ignoreComments)
+                rcds = plainRecords(ds1)
+                for rcd in rcds:
+                    del rcd['_rcdkey']
+                self.assertEqual(list(ds2.iterRecords()), rcds)
+                self.assertEqual(ds2.getNumRecords(), 0)	# nothing kept
+
+    def test_concurrent_iterations(self):
+        ds = TextFileTableDataSet('test', self.filename, multiValued=MULTI)
+        ds.addIndexes(['sym'])
+        ds.readRecords()
+        numLinesRead = ds.getNumLinesRead()
+        iter1 = ds.iterRecords()
+        iter2 = ds.iterRecords()
+        rcds1 = [next(iter1) for i in range(5)]
+        rcds2 = list(iter2)
+        rcds1 += list(iter1)
+        self.assertEqual(rcds1, rcds2)
+        self.assertEqual(len(rcds1), ds.getNumRecords())
+        self.assertEqual(ds.getNumLinesRead(), numLinesRead)
+
+    def test_write(self):
+        ds1 = self.load(ignoreComments=1)
+        ds2 = TextFileTableDataSet('test', self.filename, multiValued=MULTI,
+                                                            ignoreComments=1)
+        fp = StringIO.StringIO()
+        n = ds2.stream().write(fp, headerline='y')
+        self.assertEqual(fp.getvalue(), self.printed(ds1, headerline='y'))
+        self.assertEqual(n, ds1.getNumRecords())
+
+    def test_filter_project_transform(self):
+        ds1 = self.load(ignoreComments=1)
+        ds2 = TextFileTableDataSet('test', self.filename, multiValued=MULTI,
+                                                            ignoreComments=1)
+        keys = ds1.getKeysByIndex('sym', 'shh')
+        fp = StringIO.StringIO()
+        ds2.stream().filter(lambda rcd: rcd['sym'] == 'Shh') \
+                    .project(['id', 'syns']).write(fp, delim=',')
+        self.assertEqual(fp.getvalue(), self.printed(ds1, keys=keys,
+                                    fieldnames=['id', 'syns'], delim=','))
+
+        def addOne(rcd):
+            if rcd['count'] == None:
+                return None
+            return {'id': rcd['id'], 'n': int(rcd['count']) +1}
+        rcds = list(ds2.stream().transform(addOne, ['id', 'n']))
+        self.assertEqual(len(rcds), len([r for r in plainRecords(ds1)
+                                                    if r['count'] != None]))
+        self.assertEqual(rcds[0], {'id': '2', 'n': 3})
+# end class stream_tests
+
+class parseLine_tests(TDSTestCase):
+    def test_parseLine(self):
+        ds = TextFileTableDataSet('t', self.filename, multiValued=MULTI)
+        self.assertEqual(ds.parseLine('1\tA\t a, ,b\t7\textra\n'),
+                    {'id': '1', 'sym': 'A', 'syns': ['a', 'b'], 'count': '7'})
+        self.assertEqual(ds.parseLine('1\t\n'),
+                    {'id': '1', 'sym': None, 'syns': [], 'count': None})
+# end class parseLine_tests
+
+if __name__ == '__main__':
+    unittest.main()